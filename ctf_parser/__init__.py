@@ -1,19 +1,41 @@
 import logging
-from logging.handlers import TimedRotatingFileHandler
 
 logger = logging.getLogger('CtF Parser')
-logger.setLevel(logging.DEBUG)
 
-fh = TimedRotatingFileHandler('parser.log', when='midnight')
-fh.setLevel(logging.DEBUG)
+# The handlers of the last call of setup_logging
+_handlers = []
 
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
 
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
+def setup_logging(enable_logs=True, path='parser.log'):
+    """
+    Installs the handlers of the scripts: all messages go to a log file that
+    is rotated at midnight, from INFO on also to the console. Without
+    enable_logs, only errors are logged. Importing the package does not
+    install any handlers, and calling it again replaces the handlers it
+    installed before.
+    :param enable_logs: Log everything instead of only errors
+    :param path: Path of the log file
+    """
+    from logging.handlers import TimedRotatingFileHandler
 
-logger.addHandler(fh)
-logger.addHandler(ch)
+    logger.setLevel(logging.DEBUG if enable_logs else logging.ERROR)
+
+    # The file is only created when the first message is logged
+    fh = TimedRotatingFileHandler(path, when='midnight', delay=True)
+    fh.setLevel(logging.DEBUG)
+
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+
+    for handler in _handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    _handlers[:] = [fh, ch]
+
+    logger.addHandler(fh)
+    logger.addHandler(ch)
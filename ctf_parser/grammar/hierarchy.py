@@ -0,0 +1,140 @@
+import re
+from collections import defaultdict
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+
+"""
+Learns a coarse-to-fine symbol hierarchy from a grammar.
+
+Every phrase label of the grammar (e.g. NP, VP, but not the preterminals) is
+described by the distribution of the rules it occurs in: as the left-hand
+side with its children and as a child with its parent and sibling, and by
+the marginals of these contexts. Labels
+with similar distributions are merged by agglomerative clustering, and the
+dendrogram is cut once for every level of the hierarchy. The result has the
+format that CtfMapper reads.
+"""
+
+SEPARATORS = re.compile("[†‡]")
+
+
+def base_label(symbol):
+    """
+    Returns the label a (binarized or unary-collapsed) symbol belongs to,
+    e.g. VP for VP†VBD and S for S‡VP.
+    """
+    return SEPARATORS.split(symbol, 1)[0]
+
+
+def phrase_labels(pcfg):
+    """
+    Returns all labels that occur as the left-hand side of a binary rule.
+    """
+    symbol = pcfg.get_word_for_id
+    return sorted({base_label(symbol(lhs)) for lhs in pcfg.lhs_to_rhs})
+
+
+def label_features(pcfg, labels):
+    """
+    Describes every label by the probability mass of the rule contexts it
+    occurs in.
+    :param pcfg: The fine grammar
+    :param labels: List of phrase labels
+    :return: Matrix with one row per label, every row sums to 1
+    """
+    symbol = pcfg.get_word_for_id
+    index = {label: i for i, label in enumerate(labels)}
+    features = {}
+
+    rows = []
+    columns = []
+    values = []
+
+    def add(label, feature, probability):
+        if label not in index:
+            return
+        rows.append(index[label])
+        columns.append(features.setdefault(feature, len(features)))
+        values.append(probability)
+
+    for lhs, rules in pcfg.lhs_to_rhs.items():
+        lhs = base_label(symbol(lhs))
+        for _, rhs_1, rhs_2, prob in rules:
+            rhs_1 = base_label(symbol(rhs_1))
+            rhs_2 = base_label(symbol(rhs_2))
+
+            add(lhs, ("children", rhs_1, rhs_2), prob)
+            add(rhs_1, ("left child", lhs, rhs_2), prob)
+            add(rhs_2, ("right child", lhs, rhs_1), prob)
+
+            # Marginals, so that labels with similar but not identical
+            # contexts are close, too
+            add(lhs, ("first child", rhs_1), prob)
+            add(lhs, ("second child", rhs_2), prob)
+            add(rhs_1, ("parent", lhs), prob)
+            add(rhs_2, ("parent", lhs), prob)
+
+    matrix = np.zeros((len(labels), max(len(features), 1)))
+    np.add.at(matrix, (rows, columns), values)
+
+    totals = matrix.sum(axis=1, keepdims=True)
+    totals[totals == 0.0] = 1.0
+    return matrix / totals
+
+
+def cluster_labels(features, method="complete", metric="cosine"):
+    """
+    Agglomerative clustering of the labels.
+    :return: Linkage matrix as returned by scipy
+    """
+    return linkage(features, method=method, metric=metric)
+
+
+def build_mapping(labels, linkage_matrix, clusters_per_level):
+    """
+    Cuts the dendrogram into the levels of a hierarchy.
+    :param labels: List of phrase labels
+    :param linkage_matrix: Result of cluster_labels()
+    :param clusters_per_level: Number of clusters for every level from coarse
+    to fine, e.g. [1, 2, 4]. Must be increasing.
+    :return: Nested dictionary in the format of the CtfMapper
+    """
+    assert list(clusters_per_level) == sorted(clusters_per_level)
+
+    # Cluster ids of every label on every level
+    assignments = [fcluster(linkage_matrix, k, criterion="maxclust")
+                   for k in clusters_per_level]
+
+    def name(level, cluster):
+        return f"C{level}_{cluster}"
+
+    def children(level, members):
+        if level == len(assignments):
+            return sorted(labels[i] for i in members)
+
+        clusters = defaultdict(list)
+        for i in members:
+            clusters[assignments[level][i]].append(i)
+
+        return {name(level, cluster): children(level + 1, cluster_members)
+                for cluster, cluster_members in sorted(clusters.items())}
+
+    return children(0, range(len(labels)))
+
+
+def learn_hierarchy(pcfg, clusters_per_level=(1, 2, 4), method="complete",
+                    metric="cosine"):
+    """
+    Learns a hierarchy of the phrase labels of a grammar.
+    :param pcfg: The fine grammar
+    :param clusters_per_level: Number of clusters for every level from coarse
+    to fine
+    :param method: Linkage method (see scipy.cluster.hierarchy.linkage)
+    :param metric: Distance between the rule distributions of two labels
+    :return: Nested dictionary in the format of the CtfMapper
+    """
+    labels = phrase_labels(pcfg)
+    features = label_features(pcfg, labels)
+    linkage_matrix = cluster_labels(features, method, metric)
+    return build_mapping(labels, linkage_matrix, clusters_per_level)
@@ -1,8 +1,8 @@
+import hashlib
 import logging
 from collections import defaultdict
 
 import numpy as np
-from scipy.sparse import dok_matrix
 
 """
 Optimized PCFG class that stores binary rules in a numpy matrix and prepares
@@ -21,7 +21,8 @@ class PCFG:
         self.word_to_id = {"DUMMY": 0}
         self.id_to_word = ["DUMMY"]
 
-        self.well_known_words = {}
+        self.well_known_words = frozenset()
+        self.lexical_cells = None
         self.start_symbol = self.__add_to_signature(start_symbol)
 
     def norm_word(self, word):
@@ -31,6 +32,10 @@ class PCFG:
         lhs_id = self.rhs_to_lhs_id[rhs_1, rhs_2]
         return self.id_to_lhs[lhs_id]
 
+    def get_lhs_symbols(self, rhs_1, rhs_2):
+        lhs_id = self.rhs_to_lhs_id[rhs_1, rhs_2]
+        return self.id_to_lhs_symbols[lhs_id]
+
     def get_lhs_for_terminal_rule(self, rhs_1):
         lhs_id = self.terminal_rule_to_lhs_id[rhs_1]
         return self.id_to_lhs[lhs_id]
@@ -41,12 +46,36 @@ class PCFG:
     def get_word_for_id(self, id_):
         return self.id_to_word[id_]
 
+    def get_lexical_cells(self, create_item):
+        """
+        Ready-made diagonal chart cells for all known words. They are built
+        on the first call and shared by all parsers of this grammar.
+        :param create_item: Function (rule, word) that returns a chart item
+        :return: Dictionary of word to cell
+        """
+        cells = self.lexical_cells
+        if cells is None:
+            cells = {}
+            for word in self.well_known_words:
+                rules = self.lexicon.get(self.get_id_for_word(word), ())
+                cells[word] = {rule[0]: create_item(rule, word)
+                               for rule in rules}
+            self.lexical_cells = cells
+        return cells
+
     def __build_caches(self):
         size = max(self.non_terminals) + 1
-        self.rhs_to_lhs_id = dok_matrix((size, size), dtype=np.int32)
+        self.rhs_to_lhs_id = np.zeros((size, size), dtype=np.int32)
+        binary_rhs = []
+        binary_lhs_ids = []
         self.terminal_rule_to_lhs_id = {}
         self.first_rhs_to_second_rhs = defaultdict(set)
 
+        # The frequency of a preterminal is estimated by the inverse of its
+        # smallest lexical rule probability, i.e. the probability of a word
+        # that was seen only a few times.
+        self.tag_weights = {}
+
         for i, (lhs, rhs, prob) in enumerate(self.rule_cache):
             rhs_1 = rhs[0]
 
@@ -54,17 +83,76 @@ class PCFG:
             if len(rhs) == 1:
                 # terminal rules
                 self.terminal_rule_to_lhs_id[rhs_1] = lhs_id
+                self.tag_weights[lhs] = max(self.tag_weights.get(lhs, 0.0),
+                                            1.0 / prob)
             else:
                 # non terminals
                 rhs_2 = rhs[1]
-                self.rhs_to_lhs_id[rhs_1, rhs_2] = lhs_id
+                binary_rhs.append((rhs_1, rhs_2))
+                binary_lhs_ids.append(lhs_id)
                 self.first_rhs_to_second_rhs[rhs_1].add(rhs_2)
 
-        self.rhs_to_lhs_id = self.rhs_to_lhs_id.toarray()
+        if binary_rhs:
+            rows, columns = zip(*binary_rhs)
+            self.rhs_to_lhs_id[rows, columns] = binary_lhs_ids
+
+        # The lexical rules of every word with only the best rule for each
+        # preterminal, ordered by probability. The diagonal of the chart is
+        # initialized from these.
+        self.lexicon = {}
+        for word_id, lhs_id in self.terminal_rule_to_lhs_id.items():
+            best = {}
+            for rule in self.id_to_lhs[lhs_id]:
+                if rule[0] not in best or best[rule[0]][2] < rule[2]:
+                    best[rule[0]] = rule
+            self.lexicon[word_id] = tuple(
+                sorted(best.values(), key=lambda rule: rule[2], reverse=True))
+
+        # The rules of every right-hand side are sorted by probability (best
+        # first), so that a lookup can stop as soon as the remaining rules
+        # cannot win. The best rule of every first child is an upper bound
+        # for all its rules.
+        self.max_rule_probability = {}
+        for rules in self.id_to_lhs:
+            rules.sort(key=lambda rule: rule[-1], reverse=True)
+            if rules and len(rules[0]) == 4:
+                rhs_1 = rules[0][1]
+                self.max_rule_probability[rhs_1] = max(
+                    self.max_rule_probability.get(rhs_1, 0.0), rules[0][3])
+
+        # The left-hand sides of every right-hand side. Once all of them are
+        # in a cell, the lookup can stop at the weakest item of the cell.
+        self.id_to_lhs_symbols = [frozenset(rule[0] for rule in rules)
+                                  for rules in self.id_to_lhs]
+
         self.id_to_lhs = np.asarray(self.id_to_lhs, dtype=object)
 
+        # The grammar is shared by all parsing threads and must not change.
+        self.rhs_to_lhs_id.flags.writeable = False
+        self.id_to_lhs.flags.writeable = False
+
         self.first_rhs_symbols = set(self.first_rhs_to_second_rhs.keys())
 
+        # All rules as arrays of symbol ids, e.g. to project the grammar to
+        # a coarser level.
+        binary = [(lhs, rhs[0], rhs[1], prob)
+                  for lhs, rhs, prob in self.rule_cache if len(rhs) == 2]
+        lexical = [(lhs, rhs[0], prob)
+                   for lhs, rhs, prob in self.rule_cache if len(rhs) == 1]
+        self.binary_rules = np.array([rule[:3] for rule in binary],
+                                     dtype=np.int64).reshape(-1, 3)
+        self.binary_probabilities = np.array([rule[3] for rule in binary],
+                                             dtype=np.float64)
+        self.lexical_rules = np.array([rule[:2] for rule in lexical],
+                                      dtype=np.int64).reshape(-1, 2)
+        self.lexical_probabilities = np.array([rule[2] for rule in lexical],
+                                              dtype=np.float64)
+        for array in (self.binary_rules, self.binary_probabilities,
+                      self.lexical_rules, self.lexical_probabilities):
+            array.flags.writeable = False
+
+        self.lexical_cells = None
+
         self.rule_cache.clear()
         self.terminals.clear()
         self.non_terminals.clear()
@@ -78,7 +166,7 @@ class PCFG:
         self.word_to_id[word] = new_id
         return new_id
 
-    def load_model(self, model):
+    def __reset_rules(self):
         self.rule_cache = []
         self.id_to_lhs = [[]]
         self.rhs_to_lhs_cache = {}
@@ -91,6 +179,34 @@ class PCFG:
         self.non_terminals = set()
         self.terminals = set()
 
+    def __add_rule(self, item, rhs):
+        lhs_id = self.rhs_to_lhs_cache.get(rhs)
+        if lhs_id is None:
+            lhs_id = len(self.id_to_lhs)
+            self.id_to_lhs.append([item])
+            self.rhs_to_lhs_cache[rhs] = lhs_id
+        else:
+            self.id_to_lhs[lhs_id].append(item)
+
+        self.rule_cache.append((item[0], rhs, item[-1]))
+
+    def __add_binary_rule(self, lhs, rhs_1, rhs_2, prob):
+        self.non_terminals.add(rhs_1)
+        self.non_terminals.add(rhs_2)
+        item = (lhs, rhs_1, rhs_2, prob)
+
+        self.lhs_to_rhs[lhs].append(item)
+        self.rhs1_to_rule[rhs_1].append(item)
+        self.rhs2_to_rule[rhs_2].append(item)
+
+        self.__add_rule(item, (rhs_1, rhs_2))
+
+    def __add_lexical_rule(self, lhs, word, prob):
+        self.terminals.add(word)
+        self.__add_rule((lhs, word, prob), (word,))
+
+    def load_model(self, model):
+        self.__reset_rules()
         non_binary_rules_cache = []
 
         # Binary rules that contain only non terminals must be handled
@@ -102,59 +218,91 @@ class PCFG:
                 non_binary_rules_cache.append(data)
                 continue
 
-            lhs_raw = data[1]
-            rhs_raw = data[2:-1]
-            prob = data[-1]
-
-            lhs = self.__add_to_signature(lhs_raw)
-            rhs = [self.__add_to_signature(sym) for sym in rhs_raw]
-
-            self.non_terminals.add(rhs[0])
-            self.non_terminals.add(rhs[1])
-            item = (lhs, rhs[0], rhs[1], prob)
-
-            self.lhs_to_rhs[lhs].append(item)
-            self.rhs1_to_rule[rhs[0]].append(item)
-            self.rhs2_to_rule[rhs[1]].append(item)
-
-            lhs_id = self.rhs_to_lhs_cache.get(tuple(rhs))
-            if lhs_id is None:
-                lhs_id = len(self.id_to_lhs)
-                self.id_to_lhs.append([item])
-                self.rhs_to_lhs_cache[tuple(rhs)] = lhs_id
-            else:
-                self.id_to_lhs[lhs_id].append(item)
-
-            self.rule_cache.append((lhs, rhs, prob))
+            lhs = self.__add_to_signature(data[1])
+            rhs = [self.__add_to_signature(sym) for sym in data[2:-1]]
+            self.__add_binary_rule(lhs, rhs[0], rhs[1], data[-1])
 
         # Now handle all other rules
         for data in non_binary_rules_cache:
             if data[0] == 'WORDS':
-                self.well_known_words = data[1]
+                self.well_known_words = frozenset(data[1])
                 for word in self.well_known_words:
                     self.__add_to_signature(word)
                 continue
 
-            lhs_raw = data[1]
-            rhs_raw = data[2:-1]
-            prob = data[-1]
+            lhs = self.__add_to_signature(data[1])
+            rhs = [self.__add_to_signature(sym) for sym in data[2:-1]]
+            self.__add_lexical_rule(lhs, rhs[0], data[-1])
 
-            lhs = self.__add_to_signature(lhs_raw)
-            rhs = [self.__add_to_signature(sym) for sym in rhs_raw]
+        self.__add_to_signature("_RARE_")
 
-            self.terminals.add(rhs[0])
-            item = (lhs, rhs[0], prob)
+        self.__build_caches()
 
-            lhs_id = self.rhs_to_lhs_cache.get(tuple(rhs))
-            if lhs_id is None:
-                lhs_id = len(self.id_to_lhs)
-                self.id_to_lhs.append([item])
-                self.rhs_to_lhs_cache[tuple(rhs)] = lhs_id
-            else:
-                self.id_to_lhs[lhs_id].append(item)
+    def load_arrays(self, symbols, binary_rules, binary_probabilities,
+                    lexical_rules, lexical_probabilities, well_known_words):
+        """
+        Loads a grammar whose rules are given as arrays of symbol ids, e.g.
+        the projection of another grammar.
+        :param symbols: List of all symbols, the position is the id. The first
+        one must be 'DUMMY' and the symbols of the binary rules should come
+        before the words.
+        :param binary_rules: Array of (lhs, rhs_1, rhs_2) rows
+        :param binary_probabilities: Array with the probability of every
+        binary rule
+        :param lexical_rules: Array of (lhs, word) rows
+        :param lexical_probabilities: Array with the probability of every
+        lexical rule
+        :param well_known_words: Words that are not replaced by _RARE_
+        """
+        assert symbols[0] == "DUMMY"
+        start_symbol = self.get_word_for_id(self.start_symbol)
+
+        self.id_to_word = list(symbols)
+        self.word_to_id = {word: id_ for id_, word in enumerate(symbols)}
+        self.start_symbol = self.__add_to_signature(start_symbol)
+
+        self.__reset_rules()
+        for (lhs, rhs_1, rhs_2), prob in zip(binary_rules.tolist(),
+                                             binary_probabilities.tolist()):
+            self.__add_binary_rule(lhs, rhs_1, rhs_2, prob)
 
-            self.rule_cache.append((lhs, rhs, prob))
+        for (lhs, word), prob in zip(lexical_rules.tolist(),
+                                     lexical_probabilities.tolist()):
+            self.__add_lexical_rule(lhs, word, prob)
 
+        self.well_known_words = frozenset(well_known_words)
+        for word in self.well_known_words:
+            self.__add_to_signature(word)
         self.__add_to_signature("_RARE_")
 
         self.__build_caches()
+
+    def fingerprint(self):
+        """
+        Hash of the symbols, rules and probabilities of the grammar, to tell
+        which version of a grammar is in use.
+        """
+        digest = hashlib.sha1()
+        digest.update("\n".join(self.id_to_word).encode("utf-8"))
+        digest.update(str(self.start_symbol).encode("utf-8"))
+        for array in (self.binary_rules, self.binary_probabilities,
+                      self.lexical_rules, self.lexical_probabilities):
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def to_model(self):
+        """
+        Returns the grammar in the raw format that load_model() reads.
+        """
+        symbol = self.get_word_for_id
+        lexical = zip(self.lexical_rules.tolist(),
+                      self.lexical_probabilities.tolist())
+        binary = zip(self.binary_rules.tolist(),
+                     self.binary_probabilities.tolist())
+
+        model = [["Q1", symbol(lhs), symbol(word), prob]
+                 for (lhs, word), prob in lexical]
+        model += [["Q2", symbol(lhs), symbol(rhs_1), symbol(rhs_2), prob]
+                  for (lhs, rhs_1, rhs_2), prob in binary]
+        model.append(["WORDS", sorted(self.well_known_words)])
+        return model
@@ -0,0 +1,53 @@
+from collections import defaultdict
+
+"""
+View on a PCFG that contains only a subset of its binary rules.
+The coarse-to-fine parser creates one for every sentence, so that the lookup
+structures of the fine parser only contain rules that can actually be used.
+"""
+
+
+class RestrictedPCFG:
+
+    def __init__(self, pcfg, rules):
+        """
+        :param pcfg: The full grammar. Terminal rules, the signature and the
+        start symbol are taken from it.
+        :param rules: Iterable of binary rule items (lhs, rhs_1, rhs_2, prob)
+        """
+        self.pcfg = pcfg
+
+        self.lhs_to_rhs = defaultdict(list)
+        self.rhs1_to_rule = defaultdict(list)
+        self.rhs2_to_rule = defaultdict(list)
+        self.rhs_to_rules = defaultdict(list)
+        self.first_rhs_to_second_rhs = defaultdict(set)
+
+        for item in rules:
+            lhs, rhs_1, rhs_2, _ = item
+            self.lhs_to_rhs[lhs].append(item)
+            self.rhs1_to_rule[rhs_1].append(item)
+            self.rhs2_to_rule[rhs_2].append(item)
+            self.rhs_to_rules[rhs_1, rhs_2].append(item)
+            self.first_rhs_to_second_rhs[rhs_1].add(rhs_2)
+
+        # Best rule first, like in the full grammar. Its upper bounds per
+        # symbol are still valid for the subset.
+        for items in self.rhs_to_rules.values():
+            items.sort(key=lambda item: item[3], reverse=True)
+        self.rhs_to_lhs_symbols = {
+            rhs: frozenset(item[0] for item in items)
+            for rhs, items in self.rhs_to_rules.items()}
+
+        self.first_rhs_symbols = set(self.first_rhs_to_second_rhs.keys())
+        self.size = sum(len(items) for items in self.rhs_to_rules.values())
+
+    def __getattr__(self, name):
+        # Everything that is not restricted is read from the full grammar.
+        return getattr(self.pcfg, name)
+
+    def get_lhs(self, rhs_1, rhs_2):
+        return self.rhs_to_rules.get((rhs_1, rhs_2), [])
+
+    def get_lhs_symbols(self, rhs_1, rhs_2):
+        return self.rhs_to_lhs_symbols.get((rhs_1, rhs_2), frozenset())
@@ -1,5 +1,6 @@
 import json
-from collections import defaultdict
+
+import numpy as np
 
 from ctf_parser import logger
 from ctf_parser.grammar.pcfg import PCFG
@@ -28,90 +29,94 @@ def replace_symbols(text, fine_to_coarse, unary_symbol="‡", binary_symbol="†
     return ret
 
 
-def transform(pcfg, mapping, level=2):
+def group_sum(keys, values):
     """
-    Transforms all symbols in all rules in the given PCFG to coarse ones.
-    :param pcfg: The fine grammar.
+    Sums up the values of equal keys.
+    :return: The sorted unique keys and the sum for each of them
+    """
+    unique_keys, groups = np.unique(keys, return_inverse=True)
+    return unique_keys, np.bincount(groups, weights=values,
+                                    minlength=len(unique_keys))
+
+
+def project_grammar(pcfg, mapping, level=2):
+    """
+    Projects a grammar to the coarse symbols of a level.
+    Every symbol is mapped only once and the rules are projected as arrays of
+    symbol ids. Rules that become equal are merged by summing up their
+    probabilities before they are normalized for every left-hand side.
+    :param pcfg: The fine grammar
     :param mapping: Coarse-to-Fine symbol mapping
     :param level: The current level
-    :return: A raw coarse grammar
+    :return: The coarse PCFG
     """
     fine_to_coarse = mapping.fine_to_coarse[level]
     symbol = pcfg.get_word_for_id
 
-    """
-    Replace Symbols:
-    
-    Iterate over rules in the given grammar and replace the symbols according
-    to the coarse-to-find mapping.
-    """
-    transformed_rules = defaultdict(list)
-
-    for lhs, rules in enumerate(pcfg.id_to_lhs):
-
-        for rule in rules:
-            if len(rule) == 4:
-                lhs, rhs1, rhs2, prob = rule
-
-                lhs_t = replace_symbols(symbol(lhs), fine_to_coarse)
-
-                rhs1_t = replace_symbols(symbol(rhs1), fine_to_coarse)
-                rhs2_t = replace_symbols(symbol(rhs2), fine_to_coarse)
-                prob_t = prob
+    symbols = ["DUMMY"]
+    symbol_ids = {"DUMMY": 0}
+
+    def coarse_id(coarse_symbol):
+        id_ = symbol_ids.get(coarse_symbol)
+        if id_ is None:
+            id_ = symbol_ids[coarse_symbol] = len(symbols)
+            symbols.append(coarse_symbol)
+        return id_
+
+    # Maps the id of a fine symbol to the id of its coarse symbol. The
+    # symbols of the binary rules get the smallest ids, so that the rule
+    # matrix of the coarse grammar stays small.
+    projection = np.zeros(len(pcfg.id_to_word), dtype=np.int64)
+    for id_ in np.unique(np.concatenate([pcfg.binary_rules.ravel(),
+                                         pcfg.lexical_rules[:, 0]])).tolist():
+        projection[id_] = coarse_id(replace_symbols(symbol(id_),
+                                                    fine_to_coarse))
+
+    # Words are not projected
+    words = np.unique(pcfg.lexical_rules[:, 1])
+    word_projection = np.zeros(len(pcfg.id_to_word), dtype=np.int64)
+    word_projection[words] = [coarse_id(symbol(id_)) for id_ in words.tolist()]
+
+    # Each rule is encoded as one integer to find the rules that are merged
+    size = len(symbols)
+    binary = projection[pcfg.binary_rules]
+    binary_keys, binary_probabilities = group_sum(
+        (binary[:, 0] * size + binary[:, 1]) * size + binary[:, 2],
+        pcfg.binary_probabilities)
+    binary = np.stack([binary_keys // (size * size),
+                       binary_keys // size % size,
+                       binary_keys % size], axis=1)
+
+    lexical_keys, lexical_probabilities = group_sum(
+        projection[pcfg.lexical_rules[:, 0]] * size +
+        word_projection[pcfg.lexical_rules[:, 1]],
+        pcfg.lexical_probabilities)
+    lexical = np.stack([lexical_keys // size, lexical_keys % size], axis=1)
+
+    # Normalize the probabilities of the rules of each left-hand side
+    mass = np.bincount(binary[:, 0], weights=binary_probabilities,
+                       minlength=size)
+    mass += np.bincount(lexical[:, 0], weights=lexical_probabilities,
+                        minlength=size)
+    binary_probabilities /= mass[binary[:, 0]]
+    lexical_probabilities /= mass[lexical[:, 0]]
 
-                transformed_rules[lhs_t].append((lhs_t, rhs1_t, rhs2_t, prob_t))
-
-            elif len(rule) == 3:
-                lhs, rhs1, prob = rule
-
-                lhs_t = replace_symbols(symbol(lhs), fine_to_coarse)
-                rhs1_t = replace_symbols(symbol(rhs1), fine_to_coarse)
-                prob_t = prob
-
-                transformed_rules[lhs_t].append((lhs_t, rhs1_t, prob_t))
+    new_pcfg = PCFG()
+    new_pcfg.load_arrays(symbols, binary, binary_probabilities, lexical,
+                         lexical_probabilities,
+                         [symbol(id_) for id_ in words.tolist()])
+    return new_pcfg
 
-    """
-    Normalize rules:
-    
-    Since there are probably more rules for each left-hand side symbol, their
-    probability will not add up to 1 any more. We will now normalize them by
-    dividing each probability by the summed up probability.
-    """
-    final_rules = []
-    words = set()
-    for lhs, rules in transformed_rules.items():
-        # Sum up rules with the same rhs:
-        rhs_to_prob = defaultdict(float)
-
-        for rule in rules:
-            if len(rule) == 4:
-                rhs = (rule[1], rule[2])
-            elif len(rule) == 3:
-                rhs = (rule[1],)
-
-            prob = rule[-1]
-            rhs_to_prob[rhs] = prob
-
-        probability_mass = sum(rhs_to_prob.values())
-        for rhs, prob in rhs_to_prob.items():
-            if len(rhs) == 2:
-                final_rules.append(
-                    ["Q2", lhs, rhs[0], rhs[1], prob / probability_mass])
-            else:
-                final_rules.append(
-                    ["Q1", lhs, rhs[0], prob / probability_mass])
-                words.add(rhs[0])
 
+def transform(pcfg, mapping, level=2):
     """
-    Sort rules:
-    
-    Finally, sort rules according to their arity and write the vocabulary 
-    as the latest.
+    Transforms all symbols in all rules in the given PCFG to coarse ones.
+    :param pcfg: The fine grammar.
+    :param mapping: Coarse-to-Fine symbol mapping
+    :param level: The current level
+    :return: A raw coarse grammar
     """
-    final_rules = sorted(final_rules, key=lambda x: x[0])
-    final_rules.append(["WORDS", list(sorted(words))])
-
-    return final_rules
+    return project_grammar(pcfg, mapping, level).to_model()
 
 
 def transform_to_new_grammar(pcfg, mapping, level=2, save=True, read=False,
@@ -127,11 +132,11 @@ def transform_to_new_grammar(pcfg, mapping, level=2, save=True, read=False,
     :param prefix: Prefix for the file to read/write from or to
     :return:
     """
-    new_pcfg = PCFG()
     path = f"{prefix}_{level}.pcfg"
 
     if read:
         try:
+            new_pcfg = PCFG()
             new_pcfg.load_model(
                 [json.loads(l) for l in open(path)])
             logger.info(f"Read grammar from file (\"{path}\")"
@@ -141,13 +146,12 @@ def transform_to_new_grammar(pcfg, mapping, level=2, save=True, read=False,
         except FileNotFoundError:
             pass
 
-    new_grammar = transform(pcfg, mapping, level)
-    new_pcfg.load_model(new_grammar)
+    new_pcfg = project_grammar(pcfg, mapping, level)
 
     if save:
         with open(path, "w") as f:
             logger.info(f"Write to file (\"{path}\") (level {level})...")
-            for l in new_grammar:
+            for l in new_pcfg.to_model():
                 f.write(json.dumps(l) + "\n")
 
     return new_pcfg
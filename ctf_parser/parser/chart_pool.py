@@ -0,0 +1,135 @@
+import gc
+import threading
+import weakref
+from collections import defaultdict
+
+
+class Chart(list):
+    """
+    A chart from the pool. It keeps the buffer it is a view of and can be
+    referenced weakly.
+    """
+    __slots__ = ("buffer", "__weakref__")
+
+
+class ChartPool:
+    """
+    Keeps the charts and caches of finished parses to reuse them for the next
+    sentences instead of allocating size * size new dictionaries every time.
+
+    Charts are grouped in buckets by their length (rounded up to a multiple of
+    bucket_size). A released chart is cleared in place, so the items it
+    contained are freed immediately. The pool never holds more than
+    max_cells cells; charts that do not fit anymore are dropped.
+    The pool can be shared between threads.
+    """
+
+    def __init__(self, max_cells=200000, bucket_size=8, max_dicts=64):
+        self.max_cells = max_cells
+        self.bucket_size = bucket_size
+        self.max_dicts = max_dicts
+
+        self.buffers = defaultdict(list)
+        self.dicts = []
+        self.cells = 0
+
+        # Maps the id of a chart that is in use to the chart. A chart that is
+        # dropped without being released (e.g. after an exception) disappears
+        # from it together with its buffer.
+        self.in_use = weakref.WeakValueDictionary()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    def bucket(self, size):
+        return -(-size // self.bucket_size) * self.bucket_size
+
+    def acquire(self, size):
+        """
+        Returns an empty chart for a sentence of the given length.
+        :param size: Length of the sentence
+        :return: List of size lists with size dictionaries each
+        """
+        bucket = self.bucket(size)
+        buffer = None
+
+        with self.lock:
+            buffers = self.buffers.get(bucket)
+            if buffers:
+                buffer = buffers.pop()
+                self.cells -= bucket * bucket
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if buffer is None:
+            buffer = [[{} for _ in range(bucket)] for _ in range(bucket)]
+
+        # The rows are new lists, but the cells are the pooled dictionaries.
+        chart = Chart(row[:size] for row in buffer[:size])
+        chart.buffer = buffer
+        with self.lock:
+            self.in_use[id(chart)] = chart
+
+        return chart
+
+    def release(self, chart):
+        """
+        Clears a chart and gives it back to the pool. The chart must not be
+        used afterwards.
+        :param chart: Chart returned by acquire()
+        """
+        with self.lock:
+            pooled = self.in_use.pop(id(chart), None)
+
+        for row in chart:
+            for cell in row:
+                cell.clear()
+
+        if pooled is not chart:
+            return
+
+        buffer = chart.buffer
+
+        bucket = len(buffer)
+        with self.lock:
+            if self.cells + bucket * bucket <= self.max_cells:
+                self.buffers[bucket].append(buffer)
+                self.cells += bucket * bucket
+
+    def acquire_dict(self):
+        """
+        Returns an empty dictionary, e.g. for inside and outside scores.
+        """
+        with self.lock:
+            if self.dicts:
+                return self.dicts.pop()
+        return {}
+
+    def release_dict(self, dictionary):
+        dictionary.clear()
+        with self.lock:
+            if len(self.dicts) < self.max_dicts:
+                self.dicts.append(dictionary)
+
+    def clear(self):
+        """
+        Drops all pooled charts and dictionaries.
+        """
+        with self.lock:
+            self.buffers.clear()
+            self.dicts.clear()
+            self.cells = 0
+
+
+def freeze_grammars():
+    """
+    Moves all objects that exist now (e.g. the loaded grammars) to the
+    permanent generation of the garbage collector, so that they are not
+    traversed by every full collection. Needs Python 3.7.
+    """
+    if hasattr(gc, "freeze"):
+        gc.collect()
+        gc.freeze()
@@ -2,30 +2,105 @@ import json
 import logging
 from time import time
 
-from prettytable import PrettyTable
-
 from ctf_parser.grammar.pcfg import PCFG
-from ctf_parser.parser.tokenizer import PennTreebankTokenizer
+from ctf_parser.parser.kbest import KBestExtractor
+from ctf_parser.parser.tokenizer import FastPennTreebankTokenizer
+from ctf_parser.parser.tree_writer import build_tree, chart_events
 
 
 class NoParseFoundException(ValueError):
     pass
 
 
+class ParseContext:
+    """
+    Everything a single parse depends on besides the sentence: the grammar
+    (which may be restricted for this sentence) and the pruning functions.
+    Parsers only hold read-only data, so they can be shared between threads
+    as long as every parse gets its own context.
+    """
+
+    def __init__(self, pcfg, evaluation_function=None,
+                 tag_posterior_function=None):
+        self.pcfg = pcfg
+        if evaluation_function is None:
+            self.evaluation_function = lambda _: True
+        else:
+            self.evaluation_function = evaluation_function
+        self.tag_posterior_function = tag_posterior_function
+
+
 class CKYParser:
 
-    def __init__(self, pcfg, evaluation_function=None):
+    def __init__(self, pcfg, evaluation_function=None, tag_threshold=None,
+                 tag_top_k=None, tag_posterior_function=None,
+                 chart_pool=None, beam=None):
+        """
+        :param pcfg: The grammar
+        :param evaluation_function: Decides if an item (symbol, start, end)
+        is entered into the chart or pruned
+        :param tag_threshold: Prune preterminals whose posterior is not
+        above this value
+        :param tag_top_k: Keep only the k preterminals with the highest
+        posterior for every word
+        :param tag_posterior_function: Function (symbol, position) that
+        returns the posterior of a preterminal. If not given, the posterior
+        is estimated from the lexical rules of the word.
+        :param chart_pool: ChartPool to take the charts from
+        :param beam: Remove the items of a cell whose probability is below
+        this fraction of the best item in the cell
+        """
         self.logger = logging.getLogger('CtF Parser')
         self.pcfg = pcfg
-        self.tokenizer = PennTreebankTokenizer()
+        self.tokenizer = FastPennTreebankTokenizer()
         if evaluation_function is None:
             self.evaluation_function = lambda _: True
         else:
             self.evaluation_function = evaluation_function
 
-    def parse_best(self, sentence, log_dict=None):
-        chart = self.parse(sentence, log_dict)
-        return self.get_best_from_chart(chart)
+        self.tag_threshold = tag_threshold
+        self.tag_top_k = tag_top_k
+        self.tag_posterior_function = tag_posterior_function
+        self.chart_pool = chart_pool
+        self.beam = beam
+
+        # Ready-made diagonal cells for all known words. They are copied
+        # into the chart, so the items are shared between all sentences and
+        # all parsers of the grammar.
+        self.lexical_cells = pcfg.get_lexical_cells(
+            lambda rule, word: CKYParser.ChartItem(
+                rule[0], rule[2], rule=rule, terminal=word, pcfg=pcfg))
+
+    def parse_best(self, sentence, log_dict=None, context=None):
+        chart = self.parse(sentence, log_dict, context)
+        t0 = time()
+        try:
+            return self.get_best_from_chart(chart)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time() - t0
+
+    def write_best(self, sentence, writer, log_dict=None, context=None):
+        """
+        Parses a sentence and writes the best tree directly from the chart.
+        :param writer: TreeWriter
+        """
+        chart = self.parse(sentence, log_dict, context)
+        t0 = time()
+        try:
+            writer.write_chart(chart, self.pcfg, log_dict)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time() - t0
+
+    def release(self, chart):
+        """
+        Gives a chart back to the chart pool, if there is one.
+        """
+        if self.chart_pool is not None:
+            self.chart_pool.release(chart)
 
     def get_best_from_chart(self, chart):
         try:
@@ -37,131 +112,353 @@ class CKYParser:
 
         return tree
 
-    def parse(self, sentence, log_dict=None):
+    def parse_kbest(self, sentence, k, log_dict=None, context=None):
+        chart = self.parse(sentence, log_dict, context)
+        t0 = time()
+        try:
+            return self.get_kbest_from_chart(chart, k)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time() - t0
+
+    def get_kbest_from_chart(self, chart, k):
+        """
+        Enumerates the k best trees in the chart lazily. The alternative
+        derivations are re-derived from the rules of the grammar, restricted
+        to the items that are in the chart.
+        :param chart: Chart
+        :param k: Number of trees
+        :return: List of (probability, tree) tuples, best first
+        """
+        pcfg = self.pcfg
+        if pcfg.start_symbol not in chart[0][-1]:
+            raise NoParseFoundException
+
+        cell_edges = {}
+
+        def incoming(node):
+            symbol, i, j = node
+            if i == j:
+                item = chart[i][i][symbol]
+                return [(item.probability, (), item.terminal)]
+
+            edges = cell_edges.get((i, j))
+            if edges is None:
+                edges = self.__cell_hyperedges(chart, i, j)
+                cell_edges[(i, j)] = edges
+            return edges.get(symbol, [])
+
+        def label(node):
+            return pcfg.get_word_for_id(node[0])
+
+        extractor = KBestExtractor(incoming)
+        root = (pcfg.start_symbol, 0, len(chart) - 1)
+
+        trees = []
+        for derivation in extractor.kbest(root, k):
+            tree = extractor.tree(root, derivation, label)
+            tree[0] = tree[0].split("|")[0]
+            trees.append((derivation[0], tree))
+
+        return trees
+
+    def __cell_hyperedges(self, chart, i, j):
+        """
+        Collects all ways to build the items of a cell from items in the
+        chart.
+        :return: Dictionary of symbol to a list of (probability, tails, rule)
+        """
+        cell = chart[i][j]
+        edges = {}
+
+        for k in range(i, j):
+            first_nts = chart[i][k]
+            second_nts = chart[k + 1][j]
+
+            for rhs_1 in self.pcfg.first_rhs_symbols.intersection(first_nts):
+                for rhs_2 in self.pcfg.first_rhs_to_second_rhs[
+                        rhs_1].intersection(second_nts):
+                    for rule in self.pcfg.get_lhs(rhs_1, rhs_2):
+                        lhs = rule[0]
+                        if lhs in cell:
+                            edges.setdefault(lhs, []).append(
+                                (rule[3], ((rhs_1, i, k), (rhs_2, k + 1, j)),
+                                 rule))
+
+        return edges
+
+    def parse(self, sentence, log_dict=None, context=None):
+        t0 = time()
         words = self.tokenizer.tokenize(sentence)
+        if log_dict is not None:
+            log_dict['tokenize_time'] = time() - t0
+        return self.parse_words(words, log_dict, context)
+
+    def parse_words(self, words, log_dict=None, context=None):
+        """
+        Parses a tokenized sentence.
+        :param words: List of words as returned by the tokenizer
+        """
+        pcfg = self.pcfg if context is None else context.pcfg
         norm_words = []
 
         for word in words:
-            norm_words.append((self.pcfg.norm_word(word), word))
+            norm_words.append((pcfg.norm_word(word), word))
 
-        return self.cky(norm_words, log_dict)
+        return self.cky(norm_words, log_dict, context)
 
     def backtrace(self, item, chart):
-        if item.terminal:
-            assert item.backpointers is None
-            return [
-                self.pcfg.get_word_for_id(item.symbol),
-                item.terminal
-            ]
-
-        rhs_1, rhs_2 = item.backpointers
-
-        return [
-            self.pcfg.get_word_for_id(item.symbol),
-            self.backtrace(
-                chart[rhs_1.i][rhs_1.j][rhs_1.symbol],
-                chart
-            ),
-            self.backtrace(
-                chart[rhs_2.i][rhs_2.j][rhs_2.symbol],
-                chart
-            )
-        ]
-
-    def cky(self, norm_words, log_dict=None):
+        return build_tree(chart_events(item, chart, self.pcfg))
+
+    def cky(self, norm_words, log_dict=None, context=None):
         """
         Implementation of the CKY parsing algorithm.
         :param norm_words: List of strings
         :param log_dict: Write statistics into this dictionary
+        :param context: ParseContext of this parse. If not given, it is
+        created from the grammar and functions of the parser.
         :return: Chart
         """
+        if context is None:
+            context = ParseContext(self.pcfg, self.evaluation_function,
+                                   self.tag_posterior_function)
+        pcfg = context.pcfg
+        evaluation_function = context.evaluation_function
+
         # Set up variables for detailed logging
         t0 = time()
         stats = {
             "items_entered": 0,
-            "items_pruned": 0
+            "items_pruned": 0,
+            "candidates_generated": 0,
+            "candidates_cut": 0,
+            "tags_kept": 0,
+            "tags_pruned": 0,
+            "cells_visited": 0,
+            "split_points": 0,
+            "intersections": 0
         }
 
-        if log_dict:
+        if log_dict is not None:
             log_dict.update(stats)
             stats = log_dict
 
         # Initialize your charts (for scores and backpointers)
         size = len(norm_words)
-        chart = [[{} for _ in range(size)] for _ in range(size)]
+        if self.chart_pool is not None:
+            chart = self.chart_pool.acquire(size)
+        else:
+            chart = [[{} for _ in range(size)] for _ in range(size)]
+
+        # The cached cells can be used if the grammar (or the grammar it
+        # restricts) has the same lexicon as the one of this parser.
+        lexical_cells = self.lexical_cells \
+            if pcfg.lexicon is self.pcfg.lexicon else {}
 
         # Code for adding the words to the chart
         for i, (norm, word) in enumerate(norm_words):
-            id_ = self.pcfg.get_id_for_word(norm)
-            for lhs, rhs, prob in self.pcfg.get_lhs_for_terminal_rule(id_):
-                item = CKYParser.ChartItem(lhs, prob, rule=(lhs, rhs, prob),
-                                           terminal=word,
-                                           pcfg=self.pcfg)
-                existing_item = chart[i][i].get(lhs)
-                if not existing_item or \
-                        existing_item.probability < item.probability:
-                    chart[i][i][lhs] = item
+            cell = lexical_cells.get(word) if norm == word else None
+            if cell is not None:
+                chart[i][i].update(cell)
+            else:
+                # Rare words keep their own form as terminal
+                id_ = pcfg.get_id_for_word(norm)
+                for rule in pcfg.lexicon.get(id_, ()):
+                    chart[i][i][rule[0]] = CKYParser.ChartItem(
+                        rule[0], rule[2], rule=rule, terminal=word, pcfg=pcfg)
+
+            if self.tag_threshold is not None or self.tag_top_k is not None:
+                self.__prune_tags(chart[i][i], i, stats, context)
+            else:
+                stats['tags_kept'] += len(chart[i][i])
+
+        beam = self.beam
+        lookup = self.__loop_based_lookup
+        if beam is not None:
+            stats['items_beam_pruned'] = 0
 
         # Implementation is based upon J&M
         for j in range(size):
             for i in range(j, -1, -1):
+                cell = chart[i][j]
+                best = 0.0
+                stats['cells_visited'] += 1
+                stats['split_points'] += j - i
                 for k in range(i, j):
                     first_nts = chart[i][k]
                     second_nts = chart[k + 1][j]
+                    floor = best * beam if beam is not None else 0.0
 
-                    lookup = self.__loop_based_lookup
-
-                    for entry in lookup(first_nts, second_nts):
+                    # Every candidate beats the item of its lhs in the cell
+                    for entry in lookup(first_nts, second_nts, pcfg, cell,
+                                        floor, stats):
                         lhs, rhs_1, rhs_2, probability = entry
-                        existing_item = chart[i][j].get(lhs)
-                        if not existing_item \
-                                or existing_item.probability < probability:
-                            item = CKYParser.ChartItem(lhs, probability,
-                                                       (i, k, rhs_1),
-                                                       (k + 1, j, rhs_2),
-                                                       rule=entry,
-                                                       pcfg=self.pcfg)
-
-                            # Decide whether to prune or not!
-                            if self.evaluation_function((lhs, i, j)):
-                                chart[i][j][lhs] = item
-                                stats['items_entered'] += 1
-                            else:
-                                stats['items_pruned'] += 1
 
+                        # Decide whether to prune or not!
+                        if evaluation_function((lhs, i, j)):
+                            cell[lhs] = CKYParser.ChartItem(
+                                lhs, probability, (i, k, rhs_1),
+                                (k + 1, j, rhs_2), rule=entry, pcfg=pcfg)
+                            stats['items_entered'] += 1
+                            if probability > best:
+                                best = probability
+                        else:
+                            stats['items_pruned'] += 1
+
+                if beam is not None and i < j:
+                    # The cell is complete, remove the items outside the beam
+                    floor = best * beam
+                    outside_beam = [lhs for lhs, item in cell.items()
+                                    if item.probability < floor]
+                    for lhs in outside_beam:
+                        del cell[lhs]
+                    stats['items_beam_pruned'] += len(outside_beam)
+
+        elapsed = time() - t0
         stats.update({
-            "time": time() - t0,
+            "time": elapsed,
+            "chart_time": elapsed,
             "length": len(norm_words)
         })
 
         return chart
 
-    def __loop_based_lookup(self, first_nts, second_nts):
+    def __prune_tags(self, cell, position, stats, context):
+        """
+        Removes the preterminals from a diagonal cell whose posterior is too
+        low. At least the best preterminal is always kept.
+        :param cell: Diagonal cell of the chart
+        :param position: Position of the word
+        :param stats: Statistics dictionary
+        :param context: ParseContext of the parse
+        """
+        tag_posterior_function = context.tag_posterior_function
+        if tag_posterior_function is None:
+            # P(tag | word) from the lexical rules and the estimated
+            # frequency of the tags
+            weights = {tag: item.probability * context.pcfg.tag_weights[tag]
+                       for tag, item in cell.items()}
+            total = sum(weights.values())
+            posteriors = {tag: weight / total
+                          for tag, weight in weights.items()}
+        else:
+            posteriors = {tag: tag_posterior_function(tag, position)
+                          for tag in cell}
+
+        ranked = sorted(posteriors, key=posteriors.get, reverse=True)
+
+        keep = ranked
+        if self.tag_top_k is not None:
+            keep = keep[:self.tag_top_k]
+        if self.tag_threshold is not None:
+            keep = [tag for tag in keep
+                    if posteriors[tag] > self.tag_threshold] or ranked[:1]
+
+        keep = set(keep)
+        for tag in ranked:
+            if tag not in keep:
+                del cell[tag]
+
+        stats['tags_kept'] += len(keep)
+        stats['tags_pruned'] += len(ranked) - len(keep)
+
+    def __loop_based_lookup(self, first_nts, second_nts, pcfg, cell, floor,
+                            stats):
+        """
+        Yields the candidates (lhs, rhs_1, rhs_2, probability) for a cell
+        from the items of two of its sub cells. Candidates that cannot beat
+        the item of their lhs in the cell are not generated. The rules of a
+        pair of children are sorted by probability, so the remaining ones
+        are skipped once a rule falls below the floor (of a beam), or once
+        all their lhs are in the cell and the rule cannot beat the weakest
+        item of the cell.
+        :param cell: The cell the candidates are for
+        :param floor: Candidates must not be less probable than this
+        :param stats: Statistics dictionary
+        """
+        if not first_nts or not second_nts:
+            return
+
+        # Intersections with the rhs symbols of the grammar
+        stats['intersections'] += 1
+
         second_symbols = second_nts.keys()
-        first_symbols = self.pcfg.first_rhs_symbols
+        first_symbols = pcfg.first_rhs_symbols
 
         possible_rhs1 = first_symbols.intersection(first_nts)
-
+        if floor:
+            # Upper bound for the probability of any rule of a first child
+            max_rule_probability = pcfg.max_rule_probability
+            max_second = max(item.probability
+                             for item in second_nts.values())
+
+        # Lower bound for the probabilities of the items in the cell,
+        # computed when it is needed first
+        weakest = None
+
+        generated = 0
+        cut = 0
+        intersections = 0
         for rhs_1_symbol in possible_rhs1:
             rhs_1 = first_nts[rhs_1_symbol]
+            if floor and rhs_1.probability * max_second * \
+                    max_rule_probability[rhs_1_symbol] < floor:
+                continue
 
+            intersections += 1
             possible_rhs2 = \
-                self.pcfg.first_rhs_to_second_rhs[
+                pcfg.first_rhs_to_second_rhs[
                     rhs_1_symbol].intersection(
                     second_symbols)
 
             for rhs_2_symbol in possible_rhs2:
                 rhs_2 = second_nts[rhs_2_symbol]
-
-                for lhs, _, _, prob in self.pcfg.get_lhs(rhs_1.symbol,
-                                                         rhs_2.symbol):
-                    probability = rhs_1.probability
-                    probability *= rhs_2.probability
-                    probability *= prob
-
-                    yield lhs, rhs_1.symbol, rhs_2.symbol, probability
+                children = rhs_1.probability * rhs_2.probability
+
+                rules = pcfg.get_lhs(rhs_1_symbol, rhs_2_symbol)
+                complete = None
+                for n, (lhs, _, _, prob) in enumerate(rules):
+                    probability = children * prob
+                    if floor and probability < floor:
+                        cut += len(rules) - n
+                        break
+
+                    existing_item = cell.get(lhs)
+                    if existing_item is not None and \
+                            existing_item.probability >= probability:
+                        if weakest is None:
+                            weakest = min(item.probability
+                                          for item in cell.values())
+                        if probability <= weakest:
+                            # Checked once per pair of children
+                            if complete is None:
+                                complete = cell.keys() >= \
+                                    pcfg.get_lhs_symbols(rhs_1_symbol,
+                                                         rhs_2_symbol)
+                            if complete:
+                                cut += len(rules) - n - 1
+                                break
+                        continue
+
+                    generated += 1
+                    yield lhs, rhs_1_symbol, rhs_2_symbol, probability
+
+                    if weakest is not None:
+                        # The candidate may have replaced an item or added
+                        # a new one
+                        item = cell.get(lhs)
+                        if item is not None and item.probability < weakest:
+                            weakest = item.probability
+
+        stats['candidates_generated'] += generated
+        stats['candidates_cut'] += cut
+        stats['intersections'] += intersections
 
     def print_table(self, chart):
+        # Only needed for debugging, so it is not imported at startup
+        from prettytable import PrettyTable
+
         table = PrettyTable([""] + list(range(len(chart))))
         for i, row in enumerate(chart):
             r = [i]
@@ -1,62 +1,474 @@
 import json
 import logging
+import threading
 import time
 
+from ctf_parser.grammar.restricted_pcfg import RestrictedPCFG
 from ctf_parser.grammar.transform import transform_to_new_grammar, \
     replace_symbols
-from ctf_parser.parser.cky_parser import CKYParser, NoParseFoundException
-from ctf_parser.parser.inside_outside_calculator import InsideOutsideCalculator
+from ctf_parser.parser.cky_parser import CKYParser, NoParseFoundException, \
+    ParseContext
+from ctf_parser.parser.forest import Forest
+from ctf_parser.parser.inside_outside_calculator import \
+    INSIDE_OUTSIDE_CALCULATORS
+from ctf_parser.parser.tree_writer import penn_word
+
+# Counters of the CKY parser that are summed over all levels. The attempts
+# of the fallback cascade are summed separately as fallback_<counter>.
+COUNTERS = ('items_pruned', 'items_entered', 'candidates_generated',
+            'candidates_cut', 'tags_kept', 'tags_pruned', 'cells_visited',
+            'split_points', 'intersections')
 
 
 class CoarseToFineParser:
 
-    def __init__(self, pcfg, mapping, prefix="grammar", threshold=None):
+    def __init__(self, pcfg, mapping, prefix=None, threshold=None,
+                 start_symbols=None, skip_levels=False, min_effectiveness=1.0,
+                 warmup=10, probe_interval=100, restrict_grammar=False,
+                 tag_threshold=None, tag_top_k=None, chart_pool=None,
+                 inside_outside="exact", beam=None, background=False,
+                 observer=None, fallback=False, relax_factor=100.0,
+                 relax_steps=2):
+        """
+        Creates a coarse grammar for every level of the mapping.
+        :param pcfg: The fine grammar
+        :param mapping: Coarse-to-fine mapping object (any depth)
+        :param prefix: If given, the coarse grammars are also written to
+        files with this prefix (e.g. to inspect them)
+        :param threshold: Pruning threshold (one value or one per level)
+        :param start_symbols: Start symbol for each level (coarse to fine).
+        If not given, the start symbol of the fine grammar is projected
+        through the mapping.
+        :param skip_levels: Bypass coarse levels that do not pay off
+        :param min_effectiveness: Estimated time saved by a level divided by
+        the time it costs. Levels below this value are skipped.
+        :param warmup: Number of sentences before a level can be skipped
+        :param probe_interval: Skipped levels are still parsed every n-th
+        sentence to keep their statistics up to date.
+        :param restrict_grammar: Parse every level only with the rules whose
+        coarse projection is used in the chart of the previous level.
+        :param tag_threshold: Prune preterminals whose posterior in the
+        previous level is not above this value
+        :param tag_top_k: Keep only the k best preterminals for every word
+        :param chart_pool: ChartPool for the charts and inside/outside caches.
+        The charts of intermediate levels are given back as soon as the next
+        level has been parsed.
+        :param inside_outside: How the scores of a level are calculated (one
+        value or one per level): 'exact' sums over all rules of the grammar,
+        'sparse' only over the items in the chart of the level, 'viterbi'
+        uses the best derivations in the chart (max-product).
+        :param beam: Remove the items of a cell whose probability is below
+        this fraction of the best item in the cell (on all levels)
+        :param background: Build the coarse levels in a background thread.
+        Until they are ready, sentences are parsed with the fine grammar
+        alone.
+        :param observer: Object that is informed about the work of every
+        level, e.g. to profile a grammar. See GrammarProfiler in
+        ctf_parser.scripts.profiler for the methods it must have.
+        :param fallback: Instead of giving up when a level finds no parse,
+        parse that level again with relaxed thresholds (reusing the charts
+        of the coarser levels) and, as a last resort, parse the finest level
+        without pruning.
+        :param relax_factor: Every relaxation divides the threshold by this
+        value
+        :param relax_steps: Number of relaxations before the threshold is
+        set to 0 (only items without a posterior are pruned)
+        """
         self.logger = logging.getLogger('CtF Parser')
         self.mapping = mapping
-        self.grammars = [pcfg]
-
-        current_pcfg = pcfg
-        for i in range(mapping.levels, -1, -1):
-            self.logger.info(f"Transform {i}")
-            current_pcfg = transform_to_new_grammar(current_pcfg, mapping, i,
-                                                    save=True, read=True,
-                                                    prefix=prefix)
 
-            # TODO make this generic
-            if i == 2:
-                current_pcfg.start_symbol = current_pcfg.get_id_for_word("S_")
-            if i == 1:
-                current_pcfg.start_symbol = current_pcfg.get_id_for_word("HP")
-            if i == 0:
-                current_pcfg.start_symbol = current_pcfg.get_id_for_word("P")
+        # One coarse grammar per level of the mapping, the coarsest one and
+        # the fine grammar
+        levels = mapping.levels + 2
 
-            self.grammars.append(current_pcfg)
-
-        self.logger.info(f"Prepared {len(self.grammars)} grammars...")
-
-        self.grammars.reverse()
+        if start_symbols is not None:
+            assert len(start_symbols) == levels
+            pcfg.start_symbol = pcfg.get_id_for_word(start_symbols[-1])
 
         if threshold is None:
-            self.thresholds = [0.0001 for _ in self.grammars]
+            self.thresholds = [0.0001 for _ in range(levels)]
         elif isinstance(threshold, list):
-            assert len(threshold) == len(self.grammars)
+            assert len(threshold) == levels
             self.thresholds = threshold
         else:
-            self.thresholds = [threshold for _ in self.grammars]
+            self.thresholds = [threshold for _ in range(levels)]
 
-    def parse_best(self, sentence):
+        if isinstance(inside_outside, list):
+            assert len(inside_outside) == levels
+            self.inside_outside = inside_outside
+        else:
+            self.inside_outside = [inside_outside for _ in range(levels)]
+
+        for mode in self.inside_outside:
+            if mode not in INSIDE_OUTSIDE_CALCULATORS:
+                raise ValueError(f"Unknown inside/outside mode '{mode}'.")
+
+        self.skip_levels = skip_levels
+        self.min_effectiveness = min_effectiveness
+        self.warmup = warmup
+        self.probe_interval = probe_interval
+        self.sentences_parsed = 0
+
+        self.restrict_grammar = restrict_grammar
+        self.rule_projections = {}
+
+        self.tag_threshold = tag_threshold
+        self.tag_top_k = tag_top_k
+
+        self.chart_pool = chart_pool
+        self.observer = observer
+
+        self.fallback = fallback
+        self.relax_factor = relax_factor
+        self.relax_steps = relax_steps
+
+        # Accumulated cost and benefit of every level used for pruning.
+        # The finest level never prunes anything, so its entry stays empty.
+        self.level_statistics = [
+            {"runs": 0, "cost": 0.0, "time_saved": 0.0, "items_pruned": 0}
+            for _ in range(levels)]
+
+        # One parser per level, shared by all parses. Everything that belongs
+        # to a single parse is passed in a ParseContext, the lock guards the
+        # statistics and caches that are shared between threads.
+        # The parser of the fine grammar is ready at once; until the coarse
+        # levels are built, sentences are parsed with it alone.
+        self.parser_arguments = {"tag_threshold": tag_threshold,
+                                 "tag_top_k": tag_top_k,
+                                 "chart_pool": chart_pool, "beam": beam}
+        self.grammars = [pcfg]
+        self.parsers = [CKYParser(pcfg, **self.parser_arguments)]
+        self.tokenizer = self.parsers[-1].tokenizer
+        self.lock = threading.Lock()
+
+        self.ready = threading.Event()
+        self.build_time = None
+        self.build_error = None
+
+        if background:
+            threading.Thread(target=self.__build_in_background,
+                             args=(prefix, start_symbols),
+                             daemon=True).start()
+        else:
+            self.__build_levels(prefix, start_symbols)
+
+    def __build_levels(self, prefix, start_symbols):
+        """
+        Projects the coarse grammars and creates their parsers. The lists of
+        grammars and parsers are replaced when all levels are ready.
+        """
+        t0 = time.time()
+        pcfg = self.grammars[-1]
+        mapping = self.mapping
+        grammars = [pcfg]
+
+        current_pcfg = pcfg
+        start_symbol = pcfg.get_word_for_id(pcfg.start_symbol)
+        for i in range(mapping.levels, -1, -1):
+            self.logger.info(f"Transform {i}")
+            current_pcfg = transform_to_new_grammar(
+                current_pcfg, mapping, i, save=prefix is not None,
+                read=False, prefix=prefix)
+
+            # The start symbol of a coarse level is the projection of the
+            # start symbol of the next finer level.
+            start_symbol = replace_symbols(start_symbol,
+                                           mapping.fine_to_coarse[i])
+            current_pcfg.start_symbol = current_pcfg.get_id_for_word(
+                start_symbol)
+
+            grammars.append(current_pcfg)
+
+        self.logger.info(f"Prepared {len(grammars)} grammars...")
+
+        grammars.reverse()
+
+        if start_symbols is not None:
+            for grammar, symbol in zip(grammars, start_symbols):
+                grammar.start_symbol = grammar.get_id_for_word(symbol)
+
+        for i, grammar in enumerate(grammars):
+            if grammar.start_symbol is None:
+                self.logger.warning(f"No start symbol found for level {i}.")
+
+        parsers = [CKYParser(grammar, **self.parser_arguments)
+                   for grammar in grammars[:-1]]
+        parsers.append(self.parsers[-1])
+
+        # The fine grammar and parser stay the last entries, so they can be
+        # used while the lists are replaced.
+        self.grammars = grammars
+        self.parsers = parsers
+        self.build_time = time.time() - t0
+        self.ready.set()
+
+    def __build_in_background(self, prefix, start_symbols):
+        try:
+            self.__build_levels(prefix, start_symbols)
+            self.logger.info(f"Coarse levels ready after "
+                             f"{self.build_time:0.2f}s.")
+        except Exception as e:
+            # Keep parsing with the fine grammar alone
+            self.build_error = e
+            self.logger.exception("Building the coarse levels failed.")
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Waits until the coarse levels are built.
+        :param timeout: Maximum number of seconds to wait
+        :return: True if they are ready
+        """
+        return self.ready.wait(timeout)
+
+    def parse_best(self, sentence, log_dict=None):
         """
         Returns the tree of the best parse for the sentence.
         :param sentence: String
+        :param log_dict: Write the summary statistics into this dictionary
         :return: Tree
         """
-        chart = self.parse(sentence)
-        parser = CKYParser(self.grammars[-1])
-        return parser.get_best_from_chart(chart)
+        chart = self.parse(sentence, log_dict)
+        t0 = time.time()
+        try:
+            return self.parsers[-1].get_best_from_chart(chart)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time.time() - t0
+
+    def write_best(self, sentence, writer, log_dict=None):
+        """
+        Parses a sentence and writes the best tree directly from the chart
+        of the finest level.
+        :param writer: TreeWriter
+        """
+        try:
+            chart = self.parse(sentence, log_dict)
+        except NoParseFoundException:
+            writer.write_no_parse(log_dict)
+            return
+
+        t0 = time.time()
+        try:
+            writer.write_chart(chart, self.grammars[-1], log_dict)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time.time() - t0
+
+    def parse_forest(self, sentence, log_dict=None):
+        """
+        Packs the pruned chart of the finest level into a forest, which
+        can be used without the grammar.
+        :param sentence: String
+        :return: Forest
+        """
+        chart = self.parse(sentence, log_dict)
+        t0 = time.time()
+        try:
+            return Forest.from_chart(chart, self.grammars[-1], sentence)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time.time() - t0
+
+    def parse_kbest(self, sentence, k, log_dict=None):
+        """
+        Returns the k best trees for the sentence from the chart of the
+        finest level.
+        :param sentence: String
+        :param k: Number of trees
+        :param log_dict: Write the summary statistics into this dictionary
+        :return: List of (probability, tree) tuples, best first
+        """
+        chart = self.parse(sentence, log_dict)
+        t0 = time.time()
+        try:
+            return self.parsers[-1].get_kbest_from_chart(chart, k)
+        finally:
+            self.release(chart)
+            if log_dict is not None:
+                log_dict['backtrace_time'] = time.time() - t0
+
+    def release(self, chart, inside_outside_calculator=None):
+        """
+        Gives a chart and the caches of its inside/outside calculator back to
+        the chart pool, if there is one.
+        :param chart: Chart returned by parse()
+        :param inside_outside_calculator: Calculator created for the chart
+        """
+        if self.chart_pool is None:
+            return
+
+        if chart is not None:
+            self.chart_pool.release(chart)
+
+        if inside_outside_calculator is not None:
+            self.chart_pool.release_dict(
+                inside_outside_calculator.inside_cache)
+            self.chart_pool.release_dict(
+                inside_outside_calculator.outside_cache)
+
+    def project_symbol(self, symbol, fine_level, coarse_level):
+        """
+        Projects a symbol string of one level to a coarser level by applying
+        the mappings of all levels in between.
+        :param symbol: Symbol string of the fine level
+        :param fine_level: Index of the fine level
+        :param coarse_level: Index of the coarse level
+        :return: Symbol string of the coarse level
+        """
+        for level in range(fine_level - 1, coarse_level - 1, -1):
+            symbol = replace_symbols(symbol,
+                                     self.mapping.fine_to_coarse[level])
+        return symbol
+
+    def project_rules(self, fine_level, coarse_level):
+        """
+        Groups the binary rules of a level by their projection to a coarser
+        level. Rules with symbols that have no coarse counterpart are grouped
+        under None. The result is cached.
+        :param fine_level: Index of the fine level
+        :param coarse_level: Index of the coarse level
+        :return: Dictionary of coarse (lhs, rhs_1, rhs_2) to fine rules
+        """
+        with self.lock:
+            projection = self.rule_projections.get((fine_level, coarse_level))
+        if projection is not None:
+            return projection
+
+        fine_pcfg = self.grammars[fine_level]
+        coarse_pcfg = self.grammars[coarse_level]
+        symbol_cache = {}
+
+        def coarse_symbol(symbol):
+            if symbol not in symbol_cache:
+                symbol_cache[symbol] = coarse_pcfg.get_id_for_word(
+                    self.project_symbol(fine_pcfg.get_word_for_id(symbol),
+                                        fine_level, coarse_level))
+            return symbol_cache[symbol]
+
+        projection = {}
+        for items in fine_pcfg.lhs_to_rhs.values():
+            for item in items:
+                key = tuple(coarse_symbol(symbol) for symbol in item[:3])
+                if None in key:
+                    key = None
+                projection.setdefault(key, []).append(item)
+
+        with self.lock:
+            self.rule_projections[(fine_level, coarse_level)] = projection
+        return projection
+
+    def chart_rules(self, chart, pcfg):
+        """
+        Collects the binary rules with a nonzero posterior in a chart, i.e.
+        all rules that are part of at least one complete derivation of the
+        start symbol. The chart is traversed top-down from the root cell.
+        :param chart: Chart of the coarse level
+        :param pcfg: Grammar the chart was created with
+        :return: Set of (lhs, rhs_1, rhs_2) tuples and a chart of the sets
+        of symbols that are part of a complete derivation.
+        """
+        size = len(chart)
+        rules = set()
+        reachable = [[set() for _ in range(size)] for _ in range(size)]
+
+        if pcfg.start_symbol in chart[0][size - 1]:
+            reachable[0][size - 1].add(pcfg.start_symbol)
+
+        for length in range(size - 1, 0, -1):
+            for i in range(0, size - length):
+                j = i + length
+                symbols = reachable[i][j]
+                if not symbols:
+                    continue
+
+                for k in range(i, j):
+                    first_nts = chart[i][k]
+                    second_nts = chart[k + 1][j]
+
+                    for rhs_1 in pcfg.first_rhs_symbols.intersection(
+                            first_nts):
+                        for rhs_2 in pcfg.first_rhs_to_second_rhs[
+                                rhs_1].intersection(second_nts):
+                            for lhs, _, _, _ in pcfg.get_lhs(rhs_1, rhs_2):
+                                if lhs in symbols:
+                                    rules.add((lhs, rhs_1, rhs_2))
+                                    reachable[i][k].add(rhs_1)
+                                    reachable[k + 1][j].add(rhs_2)
+
+        return rules, reachable
+
+    def restrict(self, fine_level, coarse_level, coarse_rules):
+        """
+        Creates a view on the grammar of a level that only contains the rules
+        whose projection has a nonzero posterior in the coarse chart.
+        :param fine_level: Index of the level to restrict
+        :param coarse_level: Index of the level the chart belongs to
+        :param coarse_rules: Rules returned by chart_rules() for the chart
+        of the coarse level
+        :return: RestrictedPCFG
+        """
+        projection = self.project_rules(fine_level, coarse_level)
+
+        # Rules without a coarse counterpart cannot be judged and are kept.
+        rules = list(projection.get(None, []))
+        for key in coarse_rules:
+            rules.extend(projection.get(key, []))
+
+        return RestrictedPCFG(self.grammars[fine_level], rules)
+
+    def effectiveness(self, level):
+        """
+        Estimated time a level saves through pruning divided by the time it
+        costs (parsing and inside/outside calculation).
+        :param level: Index of the level
+        :return: Float or None, if the level has not been measured yet
+        """
+        with self.lock:
+            statistics = self.level_statistics[level]
+            if not statistics['runs'] or not statistics['cost']:
+                return None
+            return statistics['time_saved'] / statistics['cost']
+
+    def relaxed_thresholds(self, threshold):
+        """
+        Thresholds to parse a level again with after it found no parse.
+        :param threshold: Threshold of the level
+        :return: List of decreasing thresholds, ending with 0
+        """
+        thresholds = [threshold / self.relax_factor ** step
+                      for step in range(1, self.relax_steps + 1)]
+        thresholds.append(0.0)
+        return [relaxed for relaxed in thresholds if relaxed < threshold]
+
+    def is_skipped(self, level, sentence_number):
+        """
+        Decides whether a level should be bypassed for the next sentence.
+        The finest level is never skipped.
+        :param level: Index of the level
+        :param sentence_number: Number of the sentence to parse
+        :return: True or False
+        """
+        if not self.skip_levels or level == len(self.grammars) - 1:
+            return False
+
+        if self.level_statistics[level]['runs'] < self.warmup:
+            return False
+
+        if sentence_number % self.probe_interval == 0:
+            # Parse the level from time to time to see if it pays off again.
+            return False
+
+        effectiveness = self.effectiveness(level)
+        return effectiveness is not None and \
+            effectiveness < self.min_effectiveness
 
     def create_evaluation_function(self, fine_pcfg, coarse_pcfg,
-                                   inside_outside_calculator, fine_to_coarse,
-                                   sentence_probability, threshold):
+                                   inside_outside_calculator, project,
+                                   sentence_probability, threshold,
+                                   timer=None, support=None):
         """
         Defines the evaluation function used to decide if an item will be
         pruned or not.
@@ -65,8 +477,12 @@ class CoarseToFineParser:
         :param fine_pcfg: PCFG of the current level
         :param coarse_pcfg: PCFG of the previous level
         :param inside_outside_calculator: IO Calculator of the previous level
-        :param fine_to_coarse: Mapping to get coarse symbols for fine ones.
+        :param project: Function that maps fine symbol strings to coarse ones.
         :param sentence_probability: Probability of the previous sentence.
+        :param timer: List whose first element accumulates the time spent on
+        calculating inside and outside scores.
+        :param support: Chart of the coarse symbols with a nonzero posterior.
+        If given, items whose coarse symbol is not part of it are pruned.
         :return:
         """
         symbol_cache = {}
@@ -92,8 +508,8 @@ class CoarseToFineParser:
             # Lazily create the coarse version of a symbol for a given fine one
             coarse_symbol = symbol_cache.get(fine_symbol)
             if coarse_symbol is None:
-                coarse_symbol_as_string = replace_symbols(
-                    fine_pcfg.get_word_for_id(fine_symbol), fine_to_coarse)
+                coarse_symbol_as_string = project(
+                    fine_pcfg.get_word_for_id(fine_symbol))
 
                 coarse_symbol = coarse_pcfg.get_id_for_word(
                     coarse_symbol_as_string)
@@ -104,89 +520,379 @@ class CoarseToFineParser:
                                     f"{fine_symbol}.")
                 return True
 
+            if support is not None and \
+                    coarse_symbol not in support[start][end]:
+                return False
+
             # Calculate inside and outside scores for the coarse symbol
             # in the previous chart.
+            t0 = time.time()
 
             inside = inside_outside_calculator.inside(
                 coarse_symbol, start, end)
             outside = inside_outside_calculator.outside(
                 coarse_symbol, start, end)
 
+            if timer is not None:
+                timer[0] += time.time() - t0
+
             score = inside * outside / sentence_probability
 
             return score > threshold
 
         return evaluate
 
-    def parse(self, sentence):
+    def create_tag_posterior_function(self, fine_pcfg, coarse_pcfg,
+                                      inside_outside_calculator, project,
+                                      sentence_probability):
+        """
+        Defines the function used to calculate the posterior of a
+        preterminal from the inside and outside scores of its coarse
+        counterpart in the previous level.
+        :param fine_pcfg: PCFG of the current level
+        :param coarse_pcfg: PCFG of the previous level
+        :param inside_outside_calculator: IO Calculator of the previous level
+        :param project: Function that maps fine symbol strings to coarse ones.
+        :param sentence_probability: Probability of the previous sentence.
+        :return: Function (symbol, position) or None for the first level
+        """
+        if inside_outside_calculator is None:
+            # Without a previous level, the lexical rules are used instead.
+            return None
+
+        symbol_cache = {}
+
+        def posterior(symbol, position):
+            if symbol not in symbol_cache:
+                symbol_cache[symbol] = coarse_pcfg.get_id_for_word(
+                    project(fine_pcfg.get_word_for_id(symbol)))
+            coarse_symbol = symbol_cache[symbol]
+
+            if coarse_symbol is None:
+                return 1.0
+
+            inside = inside_outside_calculator.inside(
+                coarse_symbol, position, position)
+            outside = inside_outside_calculator.outside(
+                coarse_symbol, position, position)
+
+            return inside * outside / sentence_probability
+
+        return posterior
+
+    def parse(self, sentence, log_dict=None):
         """
         Parses the input and returns the chart.
         :param sentence: String
+        :param log_dict: Write the summary statistics into this dictionary
         :return: Chart
         """
+        # All levels parse the same words, so they are tokenized only once.
+        t0 = time.time()
+        words = self.tokenizer.tokenize(sentence)
+        if log_dict is not None:
+            log_dict['tokenize_time'] = time.time() - t0
+        return self.parse_words(words, log_dict, sentence)
+
+    def parse_words(self, words, log_dict=None, sentence=None):
+        """
+        Parses a tokenized sentence and returns the chart.
+        :param words: List of words as returned by the tokenizer
+        :param log_dict: Write the summary statistics into this dictionary
+        :param sentence: The input as it is logged (default: the words)
+        :return: Chart
+        """
+        if sentence is None:
+            sentence = " ".join(penn_word(word) for word in words)
+
+        if not self.ready.is_set():
+            return self.__parse_fine(words, log_dict, sentence)
+
         t0 = time.time()
         overall_statistics = {"thresholds": self.thresholds,
                               "input": sentence, "items_pruned": 0,
-                              "items_entered": 0, "type": "summary",
-                              "timestamp": t0}
-
-        fine_pcfg = None
+                              "items_entered": 0, "candidates_generated": 0,
+                              "candidates_cut": 0, "tags_kept": 0,
+                              "tags_pruned": 0, "cells_visited": 0,
+                              "split_points": 0, "intersections": 0,
+                              "chart_time": 0.0, "inside_outside_time": 0.0,
+                              "level_times": [], "type": "summary",
+                              "timestamp": t0, "skipped_levels": [],
+                              "levels_ready": True}
+
+        if self.fallback:
+            overall_statistics['fallback'] = []
+
+        if log_dict is not None:
+            log_dict.update(overall_statistics)
+            overall_statistics = log_dict
+
+        with self.lock:
+            self.sentences_parsed += 1
+            sentence_number = self.sentences_parsed
+
+        coarse_level = None
+        coarse_pcfg = None
+        coarse_chart = None
+        coarse_grammar = None
         fine_chart = None
         inside_outside_calculator = None
         sentence_probability = None
-        parser = None
+        coarse_cost = 0.0
+        timer = [0.0]
 
         # Iterate from coarse to fine grammars and parse the sentence.
         for i in range(0, len(self.grammars)):
+            if self.is_skipped(i, sentence_number):
+                overall_statistics['skipped_levels'].append(i)
+                overall_statistics['level_times'].append(0.0)
+                self.__log_statistics(
+                    {"level": i, "input": sentence, "type": "level",
+                     "skipped": True, "effectiveness": self.effectiveness(i)})
+                continue
+
             t1 = time.time()
-            fine_to_coarse = self.mapping.fine_to_coarse[i - 1]
             threshold = self.thresholds[i]
-
-            coarse_pcfg = fine_pcfg
             fine_pcfg = self.grammars[i]
 
-            # Create the evaluation function that decides over pruning.
-            # If this is the first, level 0 grammar, the function will accept
-            # every item to be entered into the chart.
-            evaluate = self.create_evaluation_function(
-                fine_pcfg, coarse_pcfg, inside_outside_calculator,
-                fine_to_coarse, sentence_probability, threshold)
+            def project(symbol, fine_level=i, coarse_level=coarse_level):
+                return self.project_symbol(symbol, fine_level, coarse_level)
 
-            parser = CKYParser(fine_pcfg, evaluation_function=evaluate)
-
-            # Parse the sentence with the current grammar.
             log_statistics = {"level": i, "threshold": threshold,
                               "input": sentence, "type": "level",
-                              "timestamp": t1}
-            fine_chart = parser.parse(sentence, log_dict=log_statistics)
-
-            overall_statistics['length'] = log_statistics['length']
-            overall_statistics['items_pruned'] += log_statistics['items_pruned']
-            overall_statistics['items_entered'] += log_statistics[
-                'items_entered']
-
-            if i < len(self.grammars) - 1:
-                # Set up the inside-outside calculator that will be used to
-                # parse with the next finer grammar. These steps are only
-                # necessary if there is a next level.
+                              "timestamp": t1, "skipped": False,
+                              "coarse_level": coarse_level}
 
-                inside_outside_calculator = InsideOutsideCalculator(
-                    fine_chart, fine_pcfg)
-
-                # Also pre-compute the sentence probability.
-                sentence_probability = inside_outside_calculator.inside(
-                    fine_pcfg.start_symbol, 0, len(fine_chart) - 1)
-
-                log_statistics['sentence_probability'] = sentence_probability
-                if sentence_probability == 0.0:
+            # Only use the rules (and symbols) that are part of a derivation
+            # in the previous chart.
+            grammar = fine_pcfg
+            support = None
+            if self.restrict_grammar and coarse_level is not None:
+                coarse_rules, support = self.chart_rules(coarse_chart,
+                                                         coarse_grammar)
+                grammar = self.restrict(i, coarse_level, coarse_rules)
+                log_statistics['rules'] = grammar.size
+
+            # If the level finds no parse, it is parsed again with relaxed
+            # thresholds and the scores of the previous level.
+            thresholds = [threshold]
+            if self.fallback and inside_outside_calculator is not None:
+                thresholds += self.relaxed_thresholds(threshold)
+
+            level_calculator = None
+            first_counters = None
+            for attempt, threshold in enumerate(thresholds):
+                if attempt:
+                    self.release(fine_chart, level_calculator)
+                    level_calculator = None
+                    overall_statistics['fallback'].append(
+                        {"level": i, "threshold": threshold})
+                    log_statistics['threshold'] = threshold
+
+                # Create the evaluation function that decides over pruning.
+                # If this is the first parsed grammar, the function will
+                # accept every item to be entered into the chart.
+                timer[0] = 0.0
+                evaluate = self.create_evaluation_function(
+                    fine_pcfg, coarse_pcfg, inside_outside_calculator,
+                    project, sentence_probability, threshold, timer, support)
+
+                if self.observer is not None:
+                    evaluate = self.observer.evaluation_function(i, grammar,
+                                                                 evaluate)
+
+                # Parse the sentence with the current grammar.
+
+                tag_posterior = self.create_tag_posterior_function(
+                    fine_pcfg, coarse_pcfg, inside_outside_calculator,
+                    project, sentence_probability)
+
+                context = ParseContext(grammar, evaluate, tag_posterior)
+                fine_chart = self.parsers[i].parse_words(
+                    words, log_statistics, context)
+
+                overall_statistics['length'] = log_statistics['length']
+                prefix = "fallback_" if attempt else ""
+                for key in COUNTERS:
+                    overall_statistics[prefix + key] = overall_statistics.get(
+                        prefix + key, 0) + log_statistics[key]
+                if attempt == 0 and inside_outside_calculator is not None:
+                    first_counters = inside_outside_calculator.counters()
+
+                # Scores of the previous level are calculated lazily while
+                # the chart is filled.
+                log_statistics['evaluation_time'] = timer[0]
+                overall_statistics['chart_time'] += \
+                    log_statistics['time'] - timer[0]
+                overall_statistics['inside_outside_time'] += timer[0]
+
+                if self.observer is not None:
+                    self.observer.level_parsed(i, grammar, fine_chart)
+
+                if i == len(self.grammars) - 1:
+                    parsed = not fine_chart or \
+                        fine_pcfg.start_symbol in fine_chart[0][-1]
+                else:
+                    # Set up the inside-outside calculator that will be used
+                    # to parse with the next finer grammar. These steps are
+                    # only necessary if there is a next level.
+                    calculator = INSIDE_OUTSIDE_CALCULATORS[
+                        self.inside_outside[i]]
+                    log_statistics['inside_outside'] = self.inside_outside[i]
+                    t2 = time.time()
+
+                    if self.chart_pool is not None:
+                        level_calculator = calculator(
+                            fine_chart, grammar,
+                            self.chart_pool.acquire_dict(),
+                            self.chart_pool.acquire_dict())
+                    else:
+                        level_calculator = calculator(fine_chart, grammar)
+
+                    # Also pre-compute the sentence probability.
+                    level_probability = level_calculator.inside(
+                        fine_pcfg.start_symbol, 0, len(fine_chart) - 1)
+
+                    log_statistics['sentence_probability'] = \
+                        level_probability
+                    log_statistics['inside_outside_time'] = time.time() - t2
+                    overall_statistics['inside_outside_time'] += \
+                        log_statistics['inside_outside_time']
+                    parsed = level_probability > 0.0
+
+                if parsed:
+                    break
+
+            if not parsed and (self.fallback or level_calculator is not None):
+                self.release(fine_chart, level_calculator)
+                self.release(coarse_chart, inside_outside_calculator)
+                self.__log_statistics(log_statistics)
+
+                if not self.fallback:
                     raise NoParseFoundException(
-                        f"No parse found after parsing at level {i}. Aborting.")
-
+                        f"No parse found after parsing at level {i}. "
+                        f"Aborting.")
+
+                # Last resort: the finest level without any pruning
+                fine_chart = self.__parse_unpruned(words, overall_statistics,
+                                                   sentence)
+                break
+
+            if self.observer is not None and \
+                    inside_outside_calculator is not None:
+                self.observer.scores_used(coarse_level,
+                                          inside_outside_calculator)
+
+            if inside_outside_calculator is not None:
+                # The scores of the previous level are complete now that
+                # this level has been pruned with them. The lookups of the
+                # fallback attempts are counted separately.
+                for key, value in inside_outside_calculator.counters().items():
+                    first = first_counters[key]
+                    counts = [(f"io_{key}", first)]
+                    if value != first:
+                        counts.append((f"fallback_io_{key}", value - first))
+                    for name, count in counts:
+                        log_statistics[name] = count
+                        overall_statistics[name] = \
+                            overall_statistics.get(name, 0) + count
+
+            if coarse_level is not None:
+                self.__update_level_statistics(coarse_level,
+                                               coarse_cost + timer[0],
+                                               log_statistics, timer[0])
+
+            # The chart and scores of the previous level are not needed
+            # any more.
+            self.release(coarse_chart, inside_outside_calculator)
+            coarse_chart = None
+            inside_outside_calculator = None
+
+            overall_statistics['level_times'].append(time.time() - t1)
+
+            if level_calculator is not None:
                 log_statistics['overall_time'] = time.time() - t1
+                log_statistics['effectiveness'] = self.effectiveness(i)
 
-            self.logger.info(json.dumps(log_statistics, sort_keys=True))
+                inside_outside_calculator = level_calculator
+                sentence_probability = level_probability
+                coarse_level = i
+                coarse_pcfg = fine_pcfg
+                coarse_chart = fine_chart
+                coarse_grammar = grammar
+                coarse_cost = time.time() - t1
 
+            self.__log_statistics(log_statistics)
+
+        overall_statistics['effectiveness'] = [
+            self.effectiveness(i) for i in range(len(self.grammars) - 1)]
         overall_statistics['time'] = time.time() - t0
-        self.logger.info(json.dumps(overall_statistics, sort_keys=True))
+        self.__log_statistics(overall_statistics)
 
         return fine_chart
+
+    def __parse_fine(self, words, log_dict, sentence):
+        """
+        Parses with the fine grammar alone while the coarse levels are being
+        built.
+        """
+        statistics = {"input": sentence, "type": "summary",
+                      "timestamp": time.time(), "levels_ready": False}
+        if log_dict is not None:
+            log_dict.update(statistics)
+            statistics = log_dict
+
+        chart = self.parsers[-1].parse_words(words, statistics)
+        self.__log_statistics(statistics)
+        return chart
+
+    def __parse_unpruned(self, words, overall_statistics, sentence):
+        """
+        Parses the finest level without pruning, after the cascade of
+        relaxed thresholds has failed.
+        """
+        level = len(self.grammars) - 1
+        statistics = {"level": level, "input": sentence, "type": "level",
+                      "timestamp": time.time(), "skipped": False,
+                      "unpruned": True}
+
+        chart = self.parsers[-1].parse_words(words, statistics)
+        for key in COUNTERS:
+            overall_statistics[f"fallback_{key}"] = overall_statistics.get(
+                f"fallback_{key}", 0) + statistics[key]
+        overall_statistics['chart_time'] += statistics['chart_time']
+        overall_statistics['fallback'].append(
+            {"level": level, "threshold": None, "unpruned": True})
+
+        self.__log_statistics(statistics)
+        return chart
+
+    def __log_statistics(self, statistics):
+        # Serializing the statistics is skipped if nobody reads them
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(json.dumps(statistics, sort_keys=True))
+
+    def __update_level_statistics(self, level, cost, log_statistics,
+                                  evaluation_time):
+        """
+        Accounts the items pruned in a finer level to the coarse level whose
+        scores were used for pruning.
+        The time saved is estimated by the average time the finer level spent
+        on every item it entered into its chart.
+        :param level: Index of the coarse level
+        :param cost: Time spent on parsing the coarse level and calculating
+        its inside and outside scores
+        :param log_statistics: Statistics of the finer level
+        :param evaluation_time: Part of the finer level's time spent on
+        inside and outside scores
+        """
+        items_pruned = log_statistics['items_pruned']
+        time_per_item = max(log_statistics['time'] - evaluation_time, 0.0) / \
+            max(log_statistics['items_entered'], 1)
+
+        with self.lock:
+            statistics = self.level_statistics[level]
+            statistics['runs'] += 1
+            statistics['cost'] += cost
+            statistics['items_pruned'] += items_pruned
+            statistics['time_saved'] += items_pruned * time_per_item
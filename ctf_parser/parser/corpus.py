@@ -0,0 +1,221 @@
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from sys import stderr
+
+from ctf_parser.parser.tree_writer import TreeWriter
+
+"""
+Parses large corpora into sharded JSONL files and can resume after a crash.
+
+The input files (plain text or gzip, one sentence per line) are streamed and
+every sentence is written with its tree and statistics to the current shard.
+A shard is written under a temporary name and only renamed when it is
+complete. Afterwards, the manifest in the output directory records the
+shard and the input position after it. A rerun with the same inputs
+continues after the last complete shard.
+"""
+
+MANIFEST = "manifest.json"
+
+
+def open_input(path):
+    """
+    Opens a text file (gzip compressed if it ends with .gz).
+    :return: Tuple of the text stream and the underlying binary file, whose
+    position tells how much of the file has been read
+    """
+    raw = open(path, "rb")
+    if path.endswith(".gz"):
+        stream = io.TextIOWrapper(gzip.GzipFile(fileobj=raw),
+                                  encoding="utf-8")
+    else:
+        stream = io.TextIOWrapper(raw, encoding="utf-8")
+    return stream, raw
+
+
+class CorpusParser:
+
+    def __init__(self, parser, output_dir, shard_sentences=100000,
+                 shard_seconds=None, progress_interval=60, compress=False):
+        """
+        :param parser: A CKYParser or CoarseToFineParser
+        :param output_dir: Directory for the shards and the manifest
+        :param shard_sentences: Maximum number of sentences in a shard
+        :param shard_seconds: Maximum time spent on a shard
+        :param progress_interval: Seconds between two progress reports
+        :param compress: Write gzip compressed shards
+        """
+        self.logger = logging.getLogger('CtF Parser')
+        self.parser = parser
+        self.output_dir = output_dir
+        self.shard_sentences = shard_sentences
+        self.shard_seconds = shard_seconds
+        self.progress_interval = progress_interval
+        self.compress = compress
+
+        self.manifest_path = os.path.join(output_dir, MANIFEST)
+
+    def load_manifest(self, inputs):
+        """
+        Reads the manifest of a previous run or creates a new one.
+        """
+        if not os.path.exists(self.manifest_path):
+            return {"inputs": inputs, "shards": [],
+                    "position": {"file": 0, "line": 0}, "finished": False}
+
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+
+        if manifest["inputs"] != inputs:
+            raise ValueError(f"{self.manifest_path} belongs to a run with "
+                             f"other inputs: {manifest['inputs']}")
+        return manifest
+
+    def save_manifest(self, manifest):
+        # Replace the manifest atomically, so that it is never half written
+        path = self.manifest_path + ".tmp"
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(path, self.manifest_path)
+
+    def sentences(self, inputs, position):
+        """
+        Streams the sentences of all inputs, starting at a position.
+        :return: Generator of (file index, line number, sentence, progress),
+        where progress is the share of all input bytes read so far
+        """
+        sizes = [os.path.getsize(path) for path in inputs]
+        total = max(sum(sizes), 1)
+
+        for file_index in range(position["file"], len(inputs)):
+            done = sum(sizes[:file_index])
+            skip = position["line"] if file_index == position["file"] else 0
+
+            stream, raw = open_input(inputs[file_index])
+            with stream:
+                for line_number, line in enumerate(stream):
+                    if line_number < skip:
+                        continue
+                    yield file_index, line_number, line.strip(), \
+                        (done + raw.tell()) / total
+
+    def run(self, inputs):
+        """
+        Parses all inputs, continuing a previous run in the output directory.
+        :param inputs: List of paths
+        :return: The manifest
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest = self.load_manifest(inputs)
+        if manifest["finished"]:
+            self.logger.info("All inputs have been parsed already.")
+            return manifest
+
+        sentences = self.sentences(inputs, manifest["position"])
+        t0 = time.time()
+        progress = {"sentences": 0, "start": t0, "report": t0,
+                    "fraction": 0.0, "start_fraction": None}
+
+        while True:
+            shard = self.__parse_shard(manifest, sentences, progress)
+            if shard is None:
+                break
+
+            manifest["shards"].append(shard)
+            manifest["position"] = {"file": shard["end_file"],
+                                    "line": shard["end_line"]}
+            self.save_manifest(manifest)
+            self.logger.info(json.dumps(dict(shard, type="shard"),
+                                        sort_keys=True))
+
+        manifest["finished"] = True
+        self.save_manifest(manifest)
+        self.__report(progress, final=True)
+        return manifest
+
+    def __parse_shard(self, manifest, sentences, progress):
+        """
+        Parses sentences into the next shard until one of its limits is
+        reached or the input ends.
+        :return: Description of the shard or None if the input has ended
+        """
+        name = f"shard-{len(manifest['shards']):05d}.jsonl"
+        if self.compress:
+            name += ".gz"
+        path = os.path.join(self.output_dir, name)
+        tmp_path = path + ".tmp"
+
+        if self.compress:
+            stream = gzip.open(tmp_path, "wt", encoding="utf-8")
+        else:
+            stream = open(tmp_path, "w", encoding="utf-8")
+
+        t0 = time.time()
+        shard = {"name": name, "sentences": 0, "no_parse": 0}
+        with stream, TreeWriter(stream, "jsonl") as writer:
+            for file_index, line_number, sentence, fraction in sentences:
+                if shard["sentences"] == 0:
+                    shard["start_file"] = file_index
+                    shard["start_line"] = line_number
+
+                log = {"file": file_index, "line": line_number,
+                       "sentence": sentence}
+                if sentence:
+                    self.parser.write_best(sentence, writer, log)
+                else:
+                    writer.write_no_parse(log)
+
+                shard["sentences"] += 1
+                shard["end_file"] = file_index
+                shard["end_line"] = line_number + 1
+
+                progress["sentences"] += 1
+                progress["fraction"] = fraction
+                if progress["start_fraction"] is None:
+                    progress["start_fraction"] = fraction
+                self.__report(progress)
+
+                if shard["sentences"] >= self.shard_sentences or (
+                        self.shard_seconds is not None and
+                        time.time() - t0 >= self.shard_seconds):
+                    break
+
+        shard["no_parse"] = writer.no_parses
+        if shard["sentences"] == 0:
+            os.remove(tmp_path)
+            return None
+
+        os.replace(tmp_path, path)
+        shard["time"] = time.time() - t0
+        return shard
+
+    def __report(self, progress, final=False):
+        now = time.time()
+        if not final and now - progress["report"] < self.progress_interval:
+            return
+        progress["report"] = now
+
+        elapsed = max(now - progress["start"], 1e-9)
+        speed = progress["sentences"] / elapsed
+
+        # The remaining time is estimated from the share of the input bytes
+        # that was read in this run.
+        eta = None
+        start_fraction = progress["start_fraction"] or 0.0
+        done = progress["fraction"] - start_fraction
+        if done > 0.0:
+            eta = elapsed * (1.0 - progress["fraction"]) / done
+
+        report = {"type": "progress", "sentences": progress["sentences"],
+                  "sentences_per_second": speed,
+                  "progress": progress["fraction"], "eta": eta}
+        self.logger.info(json.dumps(report, sort_keys=True))
+
+        eta_text = f"{eta:.0f}s" if eta is not None else "unknown"
+        print(f"{progress['sentences']} sentences, {speed:.2f} sentences/s, "
+              f"{100 * progress['fraction']:.1f}% done, ETA {eta_text}",
+              file=stderr)
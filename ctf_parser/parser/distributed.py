@@ -0,0 +1,390 @@
+import io
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from ctf_parser.parser.tree_writer import TreeWriter
+
+"""
+Parses a corpus with several worker processes, possibly on other machines.
+
+The coordinator listens on a TCP port and cuts the input into work units of
+consecutive sentences. Since parsing a sentence costs about n^3 for n words,
+a unit is filled until the estimated cost of its sentences reaches a limit,
+so a unit contains either one long sentence or many short ones.
+Workers load their grammars before they register with the coordinator and
+then pull one unit after the other. A sentence on which the parser fails is
+written without a parse by the worker, while a unit whose worker reports an
+error, disconnects or times out is given to another worker. The results are
+written in the order of the input.
+
+Messages are JSON objects, one per line:
+- worker: {"type": "register", "worker": name}
+- coordinator: {"type": "unit", "id": n, "sentences": [...], "format": f}
+- worker: {"type": "result", "id": n, "output": text} or
+  {"type": "error", "id": n, "message": text}
+- coordinator: {"type": "done"} when there is no work left
+"""
+
+
+def sentence_cost(sentence):
+    """
+    Estimated cost of parsing a sentence, cubic in its length.
+    """
+    return max(len(sentence.split()), 1) ** 3
+
+
+def send_message(connection, message):
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def receive_message(reader):
+    """
+    Reads the next message.
+    :return: The message or None if the connection has been closed
+    """
+    line = reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def no_parse_output(sentences, output_format, statistics=None):
+    stream = io.StringIO()
+    with TreeWriter(stream, output_format) as writer:
+        for sentence in sentences:
+            writer.write_no_parse(dict(statistics or {}, sentence=sentence))
+    return stream.getvalue()
+
+
+class WorkUnit:
+
+    def __init__(self, id_, sentences, cost):
+        self.id = id_
+        self.sentences = sentences
+        self.cost = cost
+        self.attempts = 0
+
+
+def work_units(sentences, unit_cost=20000, max_sentences=1000):
+    """
+    Groups consecutive sentences into units of about the same cost.
+    :param sentences: Iterable of strings
+    :param unit_cost: Estimated cost at which a unit is complete
+    :param max_sentences: Maximum number of sentences in a unit
+    :return: Generator of WorkUnits
+    """
+    unit = []
+    cost = 0
+    id_ = 0
+    for sentence in sentences:
+        current = sentence_cost(sentence)
+        if unit and (cost + current > unit_cost or
+                     len(unit) >= max_sentences):
+            yield WorkUnit(id_, unit, cost)
+            id_ += 1
+            unit = []
+            cost = 0
+
+        unit.append(sentence)
+        cost += current
+
+    if unit:
+        yield WorkUnit(id_, unit, cost)
+
+
+class Coordinator:
+
+    def __init__(self, host="127.0.0.1", port=0, output_format="jsonl",
+                 unit_cost=20000, max_sentences=1000, max_retries=3,
+                 unit_timeout=None, max_pending=64):
+        """
+        :param host: Address to listen on
+        :param port: Port to listen on (0 picks a free port, see address)
+        :param output_format: One of TreeWriter.FORMATS
+        :param unit_cost: Estimated cost (sum of the cubed sentence lengths)
+        at which a work unit is complete
+        :param max_sentences: Maximum number of sentences in a work unit
+        :param max_retries: How often a failed unit is given to a worker
+        again. Afterwards, its sentences are written without a parse.
+        :param unit_timeout: Seconds a worker may take for a unit before it
+        is considered to have failed
+        :param max_pending: Maximum number of units that are handed out
+        ahead of the first unit that has not been written yet
+        """
+        if output_format not in TreeWriter.FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}'.")
+
+        self.logger = logging.getLogger('CtF Parser')
+        self.output_format = output_format
+        self.unit_cost = unit_cost
+        self.max_sentences = max_sentences
+        self.max_retries = max_retries
+        self.unit_timeout = unit_timeout
+        self.max_pending = max_pending
+
+        # socket.create_server() needs Python 3.8
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address = self.server.getsockname()[:2]
+
+        self.condition = threading.Condition()
+        self.connections = []
+        self.acceptor = None
+
+    def run(self, sentences, stream):
+        """
+        Distributes the sentences to the workers and writes the results.
+        Returns when all sentences have been written.
+        :param sentences: Iterable of strings
+        :param stream: Text stream for the output
+        :return: Dictionary with the statistics
+        """
+        self.units = work_units(sentences, self.unit_cost, self.max_sentences)
+        self.exhausted = False
+        self.retry = deque()
+        self.in_flight = 0
+        self.dispatched = 0
+        self.results = {}
+        self.next_id = 0
+        self.stream = stream
+        self.statistics = {"units": 0, "sentences": 0, "retries": 0,
+                           "failed_units": 0, "workers": {}}
+
+        t0 = time.time()
+        # close() may join the acceptor from another thread
+        acceptor = threading.Thread(target=self.__accept, daemon=True)
+        acceptor.start()
+        self.acceptor = acceptor
+
+        with self.condition:
+            while not (self.exhausted and self.next_id == self.dispatched):
+                self.condition.wait()
+            # Wake up the workers that wait for a unit
+            self.condition.notify_all()
+
+        self.close()
+        for thread in list(self.connections):
+            thread.join()
+
+        stream.flush()
+        self.statistics["time"] = time.time() - t0
+        self.logger.info(json.dumps(dict(self.statistics, type="distributed"),
+                                    sort_keys=True))
+        return self.statistics
+
+    def __accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            thread = threading.Thread(target=self.__serve, args=(connection,),
+                                      daemon=True)
+            self.connections.append(thread)
+            thread.start()
+
+    def __serve(self, connection):
+        name = None
+        with connection, connection.makefile("r", encoding="utf-8") as reader:
+            try:
+                message = receive_message(reader)
+                if message is None or message.get("type") != "register":
+                    return
+                name = message.get("worker")
+                self.logger.info(f"Worker {name} registered.")
+                connection.settimeout(self.unit_timeout)
+
+                while True:
+                    unit = self.__next_unit()
+                    if unit is None:
+                        send_message(connection, {"type": "done"})
+                        return
+
+                    try:
+                        send_message(connection, {
+                            "type": "unit", "id": unit.id,
+                            "sentences": unit.sentences,
+                            "format": self.output_format})
+                        message = receive_message(reader)
+                    except (OSError, ValueError) as e:
+                        self.__fail(unit, name, repr(e))
+                        return
+
+                    if message is None:
+                        self.__fail(unit, name, "worker disconnected")
+                        return
+                    if message.get("type") != "result" or \
+                            message.get("id") != unit.id:
+                        self.__fail(unit, name, message.get("message"))
+                        continue
+
+                    self.__complete(unit, name, message["output"])
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.logger.info(f"Worker {name} left.")
+
+    def __next_unit(self):
+        """
+        Waits for the next unit to work on.
+        :return: The unit or None if all work is done
+        """
+        with self.condition:
+            while True:
+                if self.retry:
+                    self.in_flight += 1
+                    return self.retry.popleft()
+
+                if not self.exhausted and \
+                        self.dispatched - self.next_id < self.max_pending:
+                    unit = next(self.units, None)
+                    if unit is not None:
+                        self.dispatched += 1
+                        self.in_flight += 1
+                        return unit
+                    self.exhausted = True
+
+                if self.exhausted and self.in_flight == 0:
+                    return None
+                self.condition.wait()
+
+    def __complete(self, unit, name, output):
+        with self.condition:
+            self.in_flight -= 1
+            worker = self.statistics["workers"].setdefault(
+                name, {"units": 0, "sentences": 0})
+            worker["units"] += 1
+            worker["sentences"] += len(unit.sentences)
+            self.__store(unit, output)
+
+    def __fail(self, unit, name, reason):
+        with self.condition:
+            self.in_flight -= 1
+            unit.attempts += 1
+            self.logger.warning(f"Unit {unit.id} failed on worker {name}: "
+                                f"{reason}")
+
+            if unit.attempts > self.max_retries:
+                self.statistics["failed_units"] += 1
+                self.__store(unit, no_parse_output(
+                    unit.sentences, self.output_format, {"error": reason}))
+            else:
+                self.statistics["retries"] += 1
+                self.retry.append(unit)
+                self.condition.notify_all()
+
+    def __store(self, unit, output):
+        # Write all results that are complete in the order of the input
+        self.results[unit.id] = (unit, output)
+        while self.next_id in self.results:
+            unit, output = self.results.pop(self.next_id)
+            self.stream.write(output)
+            self.statistics["units"] += 1
+            self.statistics["sentences"] += len(unit.sentences)
+            self.next_id += 1
+        self.condition.notify_all()
+
+    def close(self):
+        # Closing the socket does not wake up accept() on Linux
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        if self.acceptor is not None:
+            self.acceptor.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def connect(address, timeout=30.0):
+    """
+    Connects to the coordinator, waiting until it accepts connections.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection(address)
+        except OSError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.1)
+
+
+def parse_unit(parser, sentences, output_format, name=None):
+    """
+    Parses the sentences of a unit. A sentence on which the parser fails is
+    written without a parse and with the error in its statistics.
+    :return: The output of the TreeWriter
+    """
+    logger = logging.getLogger('CtF Parser')
+    stream = io.StringIO()
+    with TreeWriter(stream, output_format) as writer:
+        for sentence in sentences:
+            log = {"sentence": sentence, "worker": name}
+            if not sentence:
+                writer.write_no_parse(log)
+                continue
+
+            try:
+                parser.write_best(sentence, writer, log)
+            except Exception as e:
+                logger.exception(f"Parsing '{sentence}' failed.")
+                writer.write_no_parse(dict(log, error=repr(e)))
+    return stream.getvalue()
+
+
+def run_worker(parser, address, name=None, connect_timeout=30.0):
+    """
+    Parses units of the coordinator until it has no work left.
+    :param parser: A CKYParser or CoarseToFineParser
+    :param address: Tuple of host and port of the coordinator
+    :param name: Name of the worker in the logs and statistics
+    :param connect_timeout: Seconds to wait for the coordinator
+    :return: Number of units that have been parsed
+    """
+    logger = logging.getLogger('CtF Parser')
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    units = 0
+
+    connection = connect(tuple(address), connect_timeout)
+    with connection, connection.makefile("r", encoding="utf-8") as reader:
+        try:
+            send_message(connection, {"type": "register", "worker": name})
+
+            while True:
+                message = receive_message(reader)
+                if message is None or message["type"] == "done":
+                    return units
+
+                try:
+                    output = parse_unit(parser, message["sentences"],
+                                        message["format"], name)
+                except Exception as e:
+                    logger.exception(f"Unit {message['id']} failed.")
+                    send_message(connection, {"type": "error",
+                                              "id": message["id"],
+                                              "message": repr(e)})
+                    continue
+
+                send_message(connection, {"type": "result",
+                                          "id": message["id"],
+                                          "output": output})
+                units += 1
+        except OSError:
+            # The coordinator has closed the connection, e.g. after the
+            # unit timed out or all sentences are written.
+            logger.warning(f"Lost the connection to the coordinator after "
+                           f"{units} units.")
+            return units
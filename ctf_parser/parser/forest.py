@@ -0,0 +1,215 @@
+import gzip
+import json
+
+from ctf_parser.parser.cky_parser import NoParseFoundException
+from ctf_parser.parser.inside_outside_calculator import \
+    SparseInsideOutsideCalculator
+from ctf_parser.parser.kbest import KBestExtractor
+from ctf_parser.parser.tree_writer import penn_word
+
+"""
+Packed parse forests that can be used without the grammar.
+
+A forest contains every item of a chart that is part of a complete parse,
+with its inside and outside score, and the hyperedges between them. Every
+hyperedge refers to a rule in the rule table of the forest, so the
+probabilities travel with the forest. Forests are stored as JSON lines, one
+sentence per line (gzip compressed if the file name ends with .gz).
+"""
+
+
+class Forest:
+
+    def __init__(self, words, nodes, rules, edges, root, sentence=None):
+        """
+        :param words: List of words
+        :param nodes: List of [label, start, end, inside, outside]
+        :param rules: List of [lhs, rhs_1, rhs_2, probability] for binary and
+        [lhs, word, probability] for lexical rules
+        :param edges: List of [head, rule, tail...], the nodes and rules are
+        given by their index. Lexical edges have no tails.
+        :param root: Index of the root node
+        :param sentence: The input sentence
+        """
+        self.words = words
+        self.nodes = nodes
+        self.rules = rules
+        self.edges = edges
+        self.root = root
+        self.sentence = sentence
+
+        self.incoming = None
+
+    @staticmethod
+    def from_chart(chart, pcfg, sentence=None, inside_outside_calculator=None):
+        """
+        Packs the items of a chart that are part of a complete parse.
+        :param chart: Chart of the CKYParser
+        :param pcfg: Grammar of the chart
+        :param sentence: The input sentence
+        :param inside_outside_calculator: SparseInsideOutsideCalculator of the
+        chart. It is created if not given.
+        :return: Forest
+        """
+        io = inside_outside_calculator
+        if io is None:
+            io = SparseInsideOutsideCalculator(chart, pcfg)
+
+        length = len(chart)
+        if length == 0 or io.inside(pcfg.start_symbol, 0, length - 1) == 0.0:
+            raise NoParseFoundException
+
+        symbol = pcfg.get_word_for_id
+        node_ids = {}
+        nodes = []
+        rule_ids = {}
+        rules = []
+        edges = []
+
+        def node(key):
+            node_id = node_ids.get(key)
+            if node_id is None:
+                node_id = node_ids[key] = len(nodes)
+                nodes.append([symbol(key[0]), key[1], key[2],
+                              io.inside(*key), io.outside(*key)])
+            return node_id
+
+        def rule(key, prob):
+            rule_id = rule_ids.get(key)
+            if rule_id is None:
+                rule_id = rule_ids[key] = len(rules)
+                rules.append(list(key) + [prob])
+            return rule_id
+
+        words = []
+        for i in range(length):
+            word = None
+            for tag, item in chart[i][i].items():
+                word = penn_word(item.terminal)
+                if io.outside(tag, i, i) > 0.0:
+                    edges.append([node((tag, i, i)),
+                                  rule((symbol(tag), word), item.rule[-1])])
+            words.append(word)
+
+        for (i, j), span_edges in io.edges.items():
+            for lhs, rhs_1, rhs_2, k, prob in span_edges:
+                if io.outside(lhs, i, j) > 0.0:
+                    edges.append([
+                        node((lhs, i, j)),
+                        rule((symbol(lhs), symbol(rhs_1), symbol(rhs_2)),
+                             prob),
+                        node((rhs_1, i, k)),
+                        node((rhs_2, k + 1, j))])
+
+        return Forest(words, nodes, rules, edges,
+                      node_ids[(pcfg.start_symbol, 0, length - 1)], sentence)
+
+    @property
+    def probability(self):
+        """
+        Sum of the probabilities of all trees in the forest.
+        """
+        return self.nodes[self.root][3]
+
+    def kbest(self, k):
+        """
+        Returns the k best trees of the forest.
+        :return: List of (probability, tree) tuples, best first
+        """
+        if self.incoming is None:
+            self.__index()
+
+        extractor = KBestExtractor(lambda node: self.incoming.get(node, []))
+
+        def label(node):
+            return self.nodes[node][0]
+
+        trees = []
+        for derivation in extractor.kbest(self.root, k):
+            tree = extractor.tree(self.root, derivation, label)
+            tree[0] = tree[0].split("|")[0]
+            trees.append((derivation[0], tree))
+
+        return trees
+
+    def viterbi(self):
+        """
+        Returns the best tree as (probability, tree).
+        """
+        return self.kbest(1)[0]
+
+    def marginals(self):
+        """
+        Posterior probability of every node, i.e. the probability mass of
+        the trees that contain it.
+        :return: Dictionary of (label, start, end) to the posterior
+        """
+        total = self.probability
+        return {(label, start, end): inside * outside / total
+                for label, start, end, inside, outside in self.nodes}
+
+    def edge_marginals(self):
+        """
+        Posterior probability of every hyperedge.
+        :return: List of posteriors in the order of the edges
+        """
+        total = self.probability
+        marginals = []
+        for head, rule, *tails in self.edges:
+            score = self.nodes[head][4] * self.rules[rule][-1]
+            for tail in tails:
+                score *= self.nodes[tail][3]
+            marginals.append(score / total)
+        return marginals
+
+    def to_json(self):
+        return json.dumps({"sentence": self.sentence, "words": self.words,
+                           "root": self.root, "nodes": self.nodes,
+                           "rules": self.rules, "edges": self.edges},
+                          separators=(",", ":"), ensure_ascii=False)
+
+    @staticmethod
+    def from_json(line):
+        data = json.loads(line)
+        if data is None:
+            return None
+        return Forest(data["words"], data["nodes"], data["rules"],
+                      data["edges"], data["root"], data.get("sentence"))
+
+    def __index(self):
+        self.incoming = {}
+        for head, rule, *tails in self.edges:
+            rule = self.rules[rule]
+            if tails:
+                edge = (rule[-1], tuple(tails), None)
+            else:
+                edge = (rule[-1], (), rule[1])
+            self.incoming.setdefault(head, []).append(edge)
+
+
+def open_forests(path, mode="r"):
+    """
+    Opens a file of forests for reading ('r') or writing ('w').
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_forests(path):
+    """
+    Reads the forests of a file one after the other. Sentences without a
+    parse are None.
+    :return: Generator of forests
+    """
+    with open_forests(path) as f:
+        for line in f:
+            yield Forest.from_json(line)
+
+
+def write_forest(stream, forest):
+    """
+    Writes a forest (or None for a sentence without a parse) as one line.
+    """
+    stream.write(forest.to_json() if forest is not None else "null")
+    stream.write("\n")
@@ -0,0 +1,211 @@
+import gc
+import hashlib
+import logging
+import threading
+import time
+
+from ctf_parser.parser.chart_pool import freeze_grammars
+from ctf_parser.parser.cky_parser import NoParseFoundException
+
+"""
+Replaces the grammars of a long-running parser without a restart.
+
+A new parser is loaded and validated in a background thread while the old
+one keeps parsing. Then it is swapped in between two sentences. Every parse
+runs completely on the version that was active when it started, and the old
+version is dropped (and its memory collected) as soon as its last parse is
+done.
+"""
+
+
+def parser_fingerprint(parser):
+    """
+    Fingerprint of all grammars of a parser (the levels of a
+    CoarseToFineParser depend on the mapping as well).
+    """
+    grammars = getattr(parser, "grammars", None) or [parser.pcfg]
+    digest = hashlib.sha1()
+    for grammar in grammars:
+        digest.update(grammar.fingerprint().encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+class GrammarVersion:
+    """
+    A parser with its grammars, which never change after loading.
+    """
+
+    def __init__(self, parser, number, load_time):
+        self.parser = parser
+        self.number = number
+        self.fingerprint = parser_fingerprint(parser)
+        self.load_time = load_time
+
+        # Number of parses that currently use this version
+        self.in_flight = 0
+
+
+class HotReloadParser:
+    """
+    Wraps a parser that can be replaced by reload() while sentences are
+    parsed. The statistics of every parse contain the fingerprint and the
+    number of the grammar version and the time its loading took.
+    """
+
+    def __init__(self, loader, validation_sentences=(), refreeze=False):
+        """
+        :param loader: Function without arguments that loads the grammars
+        and returns a new parser (e.g. a CoarseToFineParser)
+        :param validation_sentences: Sentences every new parser must parse
+        before it is used
+        :param refreeze: The grammars are kept in the permanent generation
+        of the garbage collector (see freeze_grammars). After a reload, the
+        old version is unfrozen and collected, the new one is frozen.
+        """
+        self.logger = logging.getLogger('CtF Parser')
+        self.loader = loader
+        self.validation_sentences = list(validation_sentences)
+        self.refreeze = refreeze
+
+        self.condition = threading.Condition()
+        self.reload_lock = threading.Lock()
+        self.reload_error = None
+        self.reloads = 0
+
+        t0 = time.time()
+        parser = self.__load()
+        self.version = GrammarVersion(parser, 0, time.time() - t0)
+
+    @property
+    def parser(self):
+        return self.version.parser
+
+    @property
+    def fingerprint(self):
+        return self.version.fingerprint
+
+    def __getattr__(self, name):
+        # Everything else is done by the active version
+        return getattr(self.version.parser, name)
+
+    def __load(self):
+        """
+        Loads and validates a new parser.
+        """
+        parser = self.loader()
+
+        wait_until_ready = getattr(parser, "wait_until_ready", None)
+        if wait_until_ready is not None:
+            # Coarse levels that are built in the background
+            wait_until_ready()
+            if parser.build_error is not None:
+                raise parser.build_error
+
+        for grammar in getattr(parser, "grammars", None) or [parser.pcfg]:
+            if grammar.start_symbol is None:
+                raise ValueError("A grammar has no start symbol.")
+
+        for sentence in self.validation_sentences:
+            try:
+                parser.parse_best(sentence)
+            except NoParseFoundException:
+                raise ValueError(f"No parse for the validation sentence "
+                                 f"'{sentence}'.")
+
+        return parser
+
+    def reload(self, wait=True):
+        """
+        Loads a new version with the loader and swaps it in. If loading or
+        validation fails, the active version is kept.
+        :param wait: Wait until the old version is dropped. Otherwise the
+        reload runs in a background thread.
+        :return: True if the new version is active (always True if not
+        waiting)
+        """
+        if not wait:
+            threading.Thread(target=self.reload, daemon=True).start()
+            return True
+
+        with self.reload_lock:
+            t0 = time.time()
+            try:
+                parser = self.__load()
+            except Exception as e:
+                self.reload_error = e
+                self.logger.exception("Reloading the grammars failed, the "
+                                      "active version is kept.")
+                return False
+
+            with self.condition:
+                old = self.version
+                self.version = GrammarVersion(parser, old.number + 1,
+                                              time.time() - t0)
+                self.reload_error = None
+                self.reloads += 1
+
+                # Parses that started before keep the old version
+                while old.in_flight > 0:
+                    self.condition.wait()
+
+            self.logger.info(f"Grammar version {self.version.number} "
+                             f"({self.version.fingerprint}) is active after "
+                             f"{self.version.load_time:0.2f}s.")
+
+            # e.g. the thread pool of a SegmentingParser
+            close = getattr(old.parser, "close", None)
+            if close is not None:
+                close()
+            old.parser = None
+            del old
+            if self.refreeze and hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+                freeze_grammars()
+            else:
+                gc.collect()
+            return True
+
+    def __acquire(self, log_dict):
+        with self.condition:
+            version = self.version
+            version.in_flight += 1
+
+        if log_dict is not None:
+            log_dict.update({"grammar_fingerprint": version.fingerprint,
+                             "grammar_version": version.number,
+                             "reload_time": version.load_time})
+        return version
+
+    def __release(self, version):
+        with self.condition:
+            version.in_flight -= 1
+            if version.in_flight == 0:
+                self.condition.notify_all()
+
+    def parse_best(self, sentence, log_dict=None):
+        version = self.__acquire(log_dict)
+        try:
+            return version.parser.parse_best(sentence, log_dict)
+        finally:
+            self.__release(version)
+
+    def write_best(self, sentence, writer, log_dict=None):
+        version = self.__acquire(log_dict)
+        try:
+            version.parser.write_best(sentence, writer, log_dict)
+        finally:
+            self.__release(version)
+
+    def parse_forest(self, sentence, log_dict=None):
+        version = self.__acquire(log_dict)
+        try:
+            return version.parser.parse_forest(sentence, log_dict)
+        finally:
+            self.__release(version)
+
+    def parse_kbest(self, sentence, k, log_dict=None):
+        version = self.__acquire(log_dict)
+        try:
+            return version.parser.parse_kbest(sentence, k, log_dict)
+        finally:
+            self.__release(version)
@@ -10,15 +10,38 @@ class InsideOutsideCalculator:
     Natural Language Processing, p. 392 - 396
     """
 
-    def __init__(self, chart, pcfg):
-        self.inside_cache = {}
-        self.outside_cache = {}
+    def __init__(self, chart, pcfg, inside_cache=None, outside_cache=None):
+        """
+        :param chart: The chart to calculate the scores for
+        :param pcfg: The grammar used to create the chart
+        :param inside_cache: Empty dictionary to store the inside scores in
+        :param outside_cache: Empty dictionary to store the outside scores in
+        """
+        self.inside_cache = {} if inside_cache is None else inside_cache
+        self.outside_cache = {} if outside_cache is None else outside_cache
 
         self.pcfg = pcfg
         self.chart = chart
         self.input_length = len(chart)
         self.logger = logging.getLogger('CtF Parser')
 
+        # Work counters, see counters()
+        self.inside_calls = 0
+        self.inside_cache_hits = 0
+        self.outside_calls = 0
+        self.outside_cache_hits = 0
+
+    def counters(self):
+        """
+        Number of (recursive) calls and cache hits, which do not depend on
+        the speed of the machine.
+        :return: Dictionary
+        """
+        return {"inside_calls": self.inside_calls,
+                "inside_cache_hits": self.inside_cache_hits,
+                "outside_calls": self.outside_calls,
+                "outside_cache_hits": self.outside_cache_hits}
+
     def outside(self, symbol, start, end):
         """
         Calculate the outside score of the symbol for the given span.
@@ -27,10 +50,12 @@ class InsideOutsideCalculator:
         :param end: q
         :return:
         """
+        self.outside_calls += 1
 
         # Try to read from cache
         cache = self.outside_cache.get((symbol, start, end))
         if cache is not None:
+            self.outside_cache_hits += 1
             return cache
 
         # Base case
@@ -81,10 +106,12 @@ class InsideOutsideCalculator:
         :param end: q
         :return:
         """
+        self.inside_calls += 1
 
         # Try to read from cache
         cache = self.inside_cache.get((symbol, start, end))
         if cache is not None:
+            self.inside_cache_hits += 1
             return cache
 
         # Base case
@@ -112,6 +139,251 @@ class InsideOutsideCalculator:
         return score
 
 
+class SparseInsideOutsideCalculator:
+    """
+    Calculates the inside and outside scores of all items in the chart at
+    once. Only the symbols that are in a cell of the chart are considered,
+    so the cost depends on the number of items in the (pruned) chart instead
+    of the size of the grammar. Scores of items that are not in the chart
+    are 0.
+    """
+
+    def __init__(self, chart, pcfg, inside_cache=None, outside_cache=None):
+        """
+        :param chart: The chart to calculate the scores for
+        :param pcfg: The grammar used to create the chart
+        :param inside_cache: Empty dictionary to store the inside scores in
+        :param outside_cache: Empty dictionary to store the outside scores in
+        """
+        self.inside_cache = {} if inside_cache is None else inside_cache
+        self.outside_cache = {} if outside_cache is None else outside_cache
+
+        self.pcfg = pcfg
+        self.chart = chart
+        self.input_length = len(chart)
+        self.logger = logging.getLogger('CtF Parser')
+        self.intersections = 0
+
+        # Binary edges (lhs, rhs_1, rhs_2, split, probability) of every span
+        self.edges = self.__calculate_inside()
+        self.__calculate_outside(self.edges)
+
+    def counters(self):
+        """
+        Number of set intersections and of the edges between the items of
+        the chart.
+        :return: Dictionary
+        """
+        return {"intersections": self.intersections,
+                "edges": sum(len(span_edges)
+                             for span_edges in self.edges.values())}
+
+    def outside(self, symbol, start, end):
+        return self.outside_cache.get((symbol, start, end), 0.0)
+
+    def inside(self, symbol, start, end):
+        return self.inside_cache.get((symbol, start, end), 0.0)
+
+    def __calculate_inside(self):
+        """
+        Bottom-up pass over the chart. Collects the edges that connect the
+        items of the chart for the outside pass.
+        """
+        chart = self.chart
+        pcfg = self.pcfg
+        length = self.input_length
+        inside = self.inside_cache
+        edges = {}
+        intersections = 0
+
+        for i in range(length):
+            for symbol, item in chart[i][i].items():
+                inside[(symbol, i, i)] = item.rule[-1]
+
+        for span in range(1, length):
+            for i in range(length - span):
+                j = i + span
+                cell = chart[i][j]
+                if not cell:
+                    continue
+
+                span_edges = []
+                for k in range(i, j):
+                    first_nts = chart[i][k]
+                    second_nts = chart[k + 1][j]
+                    if not first_nts or not second_nts:
+                        continue
+
+                    intersections += 1
+                    for rhs_1 in pcfg.first_rhs_symbols.intersection(
+                            first_nts):
+                        inside_1 = inside[(rhs_1, i, k)]
+                        intersections += 1
+
+                        for rhs_2 in pcfg.first_rhs_to_second_rhs[
+                                rhs_1].intersection(second_nts):
+                            score = inside_1 * inside[(rhs_2, k + 1, j)]
+
+                            for lhs, _, _, prob in pcfg.get_lhs(rhs_1, rhs_2):
+                                if lhs not in cell:
+                                    continue
+
+                                key = (lhs, i, j)
+                                inside[key] = inside.get(key, 0.0) + \
+                                    prob * score
+                                span_edges.append((lhs, rhs_1, rhs_2, k, prob))
+
+                edges[i, j] = span_edges
+
+        self.intersections = intersections
+        return edges
+
+    def __calculate_outside(self, edges):
+        """
+        Top-down pass over the spans from the longest to the shortest. When
+        a span is reached, the outside scores of its items are complete and
+        are passed on to their children.
+        """
+        length = self.input_length
+        inside = self.inside_cache
+        outside = self.outside_cache
+
+        if length == 0:
+            return
+
+        if self.pcfg.start_symbol in self.chart[0][length - 1]:
+            outside[(self.pcfg.start_symbol, 0, length - 1)] = 1.0
+
+        for span in range(length - 1, 0, -1):
+            for i in range(length - span):
+                j = i + span
+                for lhs, rhs_1, rhs_2, k, prob in edges.get((i, j), ()):
+                    outside_lhs = outside.get((lhs, i, j))
+                    if not outside_lhs:
+                        continue
+
+                    score = prob * outside_lhs
+                    key_1 = (rhs_1, i, k)
+                    key_2 = (rhs_2, k + 1, j)
+                    outside[key_1] = outside.get(key_1, 0.0) + \
+                        score * inside[key_2]
+                    outside[key_2] = outside.get(key_2, 0.0) + \
+                        score * inside[key_1]
+
+
+class ViterbiInsideOutsideCalculator:
+    """
+    Max-product instead of sum-product scores. The inside score of an item
+    is the probability of its best derivation, which the CKY parser has
+    already stored in the chart, so only the outside scores (the probability
+    of the best context of an item) are calculated in one top-down pass.
+    Divided by the probability of the best parse, inside * outside is the
+    share of the best parse that contains the item.
+    """
+
+    def __init__(self, chart, pcfg, inside_cache=None, outside_cache=None):
+        """
+        :param chart: The chart to calculate the scores for
+        :param pcfg: The grammar used to create the chart
+        :param inside_cache: Not used, the inside scores are in the chart
+        :param outside_cache: Empty dictionary to store the outside scores in
+        """
+        self.inside_cache = {} if inside_cache is None else inside_cache
+        self.outside_cache = {} if outside_cache is None else outside_cache
+
+        self.pcfg = pcfg
+        self.chart = chart
+        self.input_length = len(chart)
+        self.logger = logging.getLogger('CtF Parser')
+        self.intersections = 0
+        self.edges = 0
+
+        self.__calculate_outside()
+
+    def counters(self):
+        """
+        Number of set intersections and of the edges that passed an outside
+        score on to their children.
+        :return: Dictionary
+        """
+        return {"intersections": self.intersections, "edges": self.edges}
+
+    def outside(self, symbol, start, end):
+        return self.outside_cache.get((symbol, start, end), 0.0)
+
+    def inside(self, symbol, start, end):
+        item = self.chart[start][end].get(symbol)
+        return item.probability if item is not None else 0.0
+
+    def __calculate_outside(self):
+        """
+        Top-down pass over the spans from the longest to the shortest. The
+        outside score of an item is final when its span is reached and is
+        passed on to the children of all its edges in the chart.
+        """
+        chart = self.chart
+        pcfg = self.pcfg
+        length = self.input_length
+        outside = self.outside_cache
+        intersections = 0
+        edges = 0
+
+        if length == 0:
+            return
+
+        if pcfg.start_symbol in chart[0][length - 1]:
+            outside[(pcfg.start_symbol, 0, length - 1)] = 1.0
+
+        for span in range(length - 1, 0, -1):
+            for i in range(length - span):
+                j = i + span
+                heads = {symbol: outside[(symbol, i, j)]
+                         for symbol in chart[i][j]
+                         if (symbol, i, j) in outside}
+                if not heads:
+                    continue
+
+                for k in range(i, j):
+                    first_nts = chart[i][k]
+                    second_nts = chart[k + 1][j]
+                    if not first_nts or not second_nts:
+                        continue
+
+                    intersections += 1
+                    for rhs_1 in pcfg.first_rhs_symbols.intersection(
+                            first_nts):
+                        key_1 = (rhs_1, i, k)
+                        inside_1 = first_nts[rhs_1].probability
+                        intersections += 1
+
+                        for rhs_2 in pcfg.first_rhs_to_second_rhs[
+                                rhs_1].intersection(second_nts):
+                            key_2 = (rhs_2, k + 1, j)
+                            inside_2 = second_nts[rhs_2].probability
+
+                            for lhs, _, _, prob in pcfg.get_lhs(rhs_1, rhs_2):
+                                outside_lhs = heads.get(lhs)
+                                if outside_lhs is None:
+                                    continue
+
+                                edges += 1
+                                score = prob * outside_lhs
+                                if score * inside_2 > outside.get(key_1, 0.0):
+                                    outside[key_1] = score * inside_2
+                                if score * inside_1 > outside.get(key_2, 0.0):
+                                    outside[key_2] = score * inside_1
+
+        self.intersections = intersections
+        self.edges = edges
+
+
+INSIDE_OUTSIDE_CALCULATORS = {
+    "exact": InsideOutsideCalculator,
+    "sparse": SparseInsideOutsideCalculator,
+    "viterbi": ViterbiInsideOutsideCalculator
+}
+
+
 if __name__ == '__main__':
     GRAMMAR = [
         ["Q1", "NP", "Peter", 0.5],
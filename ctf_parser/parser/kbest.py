@@ -0,0 +1,187 @@
+import heapq
+from collections import deque
+from itertools import count
+
+"""
+Lazy k-best extraction from a hypergraph, following Algorithm 3 of
+Huang & Chiang (2005): Better k-best Parsing.
+
+A hypergraph is given by a function that returns the incoming hyperedges of a
+node. A hyperedge is a tuple (weight, tails, label): the tails are the nodes
+of its children (an empty tuple for leaves) and the score of a derivation is
+the product of the weight and the scores of the sub-derivations. The
+derivations of a node are only enumerated when they are requested.
+"""
+
+
+class KBestExtractor:
+
+    def __init__(self, incoming):
+        """
+        :param incoming: Function that maps a node to its list of hyperedges
+        """
+        self.incoming = incoming
+
+        # Node -> list of hyperedges
+        self.edges = {}
+        # Node -> list of derivations (score, edge index, ranks), best first
+        self.derivations = {}
+        # Node -> heap of candidates (-score, counter, edge index, ranks)
+        self.candidates = {}
+        # Node -> set of (edge index, ranks) that were already pushed
+        self.seen = {}
+        # Node -> deque of (edge index, ranks) that still have to be pushed
+        self.pending = {}
+        # Node -> number of derivations whose successors are pending
+        self.expanded = {}
+        # Nodes whose derivations are all enumerated
+        self.exhausted = set()
+        self.counter = count()
+
+    def kth_best(self, node, k):
+        """
+        Returns the k-th best derivation of the node (counting from 0).
+        :param node: A node of the hypergraph
+        :param k: Rank of the derivation
+        :return: Tuple (score, edge, ranks) or None if there are less than
+        k + 1 derivations. The ranks are the ranks of the derivations of the
+        tails of the edge.
+        """
+        # The derivations of the tails are requested with an explicit stack
+        # instead of recursion, so deep trees do not hit the recursion limit.
+        requests = [(node, k)]
+        while requests:
+            request = self.__advance(*requests[-1])
+            if request is None:
+                requests.pop()
+            else:
+                requests.append(request)
+
+        derivations = self.derivations[node]
+        if len(derivations) <= k:
+            return None
+        score, edge_index, ranks = derivations[k]
+        return score, self.edges[node][edge_index], ranks
+
+    def kbest(self, node, k):
+        """
+        Returns up to k derivations of the node in score order.
+        """
+        result = []
+        for i in range(k):
+            derivation = self.kth_best(node, i)
+            if derivation is None:
+                break
+            result.append(derivation)
+        return result
+
+    def tree(self, node, derivation, label):
+        """
+        Builds the tree of a derivation as nested lists.
+        :param node: The root node of the derivation
+        :param derivation: Tuple returned by kth_best()
+        :param label: Function that maps a node to the label of its tree
+        :return: [label, word] for leaves, [label, child, ...] otherwise
+        """
+        _, edge, ranks = derivation
+        tree = [label(node)]
+        root = tree
+
+        # Iterative depth-first construction to avoid deep recursion.
+        agenda = [(root, edge, ranks)]
+        while agenda:
+            subtree, edge, ranks = agenda.pop()
+            tails = edge[1]
+
+            if not tails:
+                subtree.append(edge[2])
+                continue
+
+            for tail, rank in zip(tails, ranks):
+                _, tail_edge, tail_ranks = self.kth_best(tail, rank)
+                child = [label(tail)]
+                subtree.append(child)
+                agenda.append((child, tail_edge, tail_ranks))
+
+        return root
+
+    def __initialize(self, node):
+        self.edges[node] = self.incoming(node)
+        self.derivations[node] = []
+        self.candidates[node] = []
+        self.seen[node] = set()
+        self.pending[node] = deque(
+            (edge_index, (0,) * len(edge[1]))
+            for edge_index, edge in enumerate(self.edges[node]))
+        self.expanded[node] = 0
+
+    def __advance(self, node, k):
+        """
+        Enumerates the derivations of the node until the k-th one is found or
+        there are no more.
+        :return: None when done, otherwise the (tail, rank) whose derivation
+        is needed first
+        """
+        if node not in self.derivations:
+            self.__initialize(node)
+
+        derivations = self.derivations[node]
+        candidates = self.candidates[node]
+        pending = self.pending[node]
+
+        while len(derivations) <= k:
+            while pending:
+                request = self.__push(node, *pending[0])
+                if request is not None:
+                    return request
+                pending.popleft()
+
+            if self.expanded[node] < len(derivations):
+                # The successors of the last derivation only become
+                # candidates when the next derivation is needed.
+                _, edge_index, ranks = derivations[-1]
+                pending.extend((edge_index, successor)
+                               for successor in successors(ranks))
+                self.expanded[node] = len(derivations)
+                continue
+
+            if not candidates:
+                self.exhausted.add(node)
+                return None
+
+            score, _, edge_index, ranks = heapq.heappop(candidates)
+            derivations.append((-score, edge_index, ranks))
+
+        return None
+
+    def __push(self, node, edge_index, ranks):
+        """
+        Adds the candidate of an edge with the given ranks of its tails.
+        :return: None when done, otherwise the (tail, rank) whose derivation
+        is needed first
+        """
+        key = (edge_index, ranks)
+        if key in self.seen[node]:
+            return None
+
+        edge = self.edges[node][edge_index]
+        score = edge[0]
+        for tail, rank in zip(edge[1], ranks):
+            derivations = self.derivations.get(tail, ())
+            if len(derivations) <= rank:
+                if tail not in self.exhausted:
+                    return tail, rank
+                # The tail has less than rank + 1 derivations
+                self.seen[node].add(key)
+                return None
+            score *= derivations[rank][0]
+
+        self.seen[node].add(key)
+        heapq.heappush(self.candidates[node],
+                       (-score, next(self.counter), edge_index, ranks))
+        return None
+
+
+def successors(ranks):
+    for i in range(len(ranks)):
+        yield ranks[:i] + (ranks[i] + 1,) + ranks[i + 1:]
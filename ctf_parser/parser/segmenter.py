@@ -0,0 +1,260 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from ctf_parser.parser.cky_parser import NoParseFoundException
+from ctf_parser.parser.tree_writer import penn_word
+
+"""
+Bounds the cost of very long inputs by parsing them in segments.
+
+Parsing is cubic in the length of the input, so a run-on line or a missing
+newline can stall a parser for minutes. Inputs with more words than a limit
+are split into segments at safe boundaries: after punctuation or before a
+coordinating conjunction. With a coarse-to-fine parser, the coarsest grammar
+(which is small enough to parse a window of the limit's length cheaply)
+scores the positions at which a window can be split, and a segment ends at
+the best scored boundary in the second half of the window, or at the best
+scored position if there is no such boundary. Otherwise, the segment ends
+at the last boundary within the limit. If a stretch of the input has no
+boundary, it is cut at the limit. The segments are parsed
+independently (optionally by a pool of threads) and their trees are joined
+under a root whose label marks the tree as segmented.
+"""
+
+PUNCTUATION = frozenset([",", ";", ":", "--", "."])
+CONJUNCTIONS = frozenset(["and", "or", "but", "nor", "yet", "so"])
+
+
+def segment(words, max_length, punctuation=PUNCTUATION,
+            conjunctions=CONJUNCTIONS, score_splits=None):
+    """
+    Splits a list of words into segments of at most max_length words.
+    :param words: List of words as returned by the tokenizer
+    :param max_length: Maximum number of words in a segment
+    :param punctuation: Words after which a segment may end
+    :param conjunctions: Words before which a segment may end
+    :param score_splits: Function of a window (start, stop) of the words
+    that returns a dictionary of the positions at which the window may be
+    split to their scores. A segment ends at the best scored boundary in
+    the second half of the window or, if there is none, at the best scored
+    position (the latest one on ties). Without scores, it ends at the last
+    boundary.
+    :return: List of (start, end) spans
+    """
+    if max_length < 1:
+        raise ValueError(f"max_length must be at least 1, not {max_length}.")
+
+    # Positions at which a new segment may start
+    boundaries = set()
+    for i, word in enumerate(words):
+        word = penn_word(word)
+        if word in punctuation:
+            boundaries.add(i + 1)
+        elif word.lower() in conjunctions:
+            boundaries.add(i)
+
+    spans = []
+    start = 0
+    while len(words) - start > max_length:
+        end = None
+        if score_splits is not None:
+            # The window has one more word, so a segment of max_length words
+            # is a split as well
+            scores = score_splits(start, start + max_length + 1)
+            candidates = [i for i in scores
+                          if start + max(2, (max_length + 1) // 2) <= i <=
+                          start + max_length]
+            candidates = [i for i in candidates if i in boundaries] or \
+                candidates
+            end = max(candidates, key=lambda i: (scores[i], i), default=None)
+
+        if end is None:
+            # Segments of a single word are avoided
+            end = max((i for i in boundaries
+                       if start + 1 < i <= start + max_length),
+                      default=start + max_length)
+        spans.append((start, end))
+        start = end
+    spans.append((start, len(words)))
+    return spans
+
+
+def chart_split_scores(chart, start_symbol):
+    """
+    Scores the positions at which the words of a chart may be split by the
+    probability of the best analysis of the words as a complete segment
+    (an item of the start symbol) followed by any constituent. All splits
+    cover the same words, so their scores can be compared.
+    :param chart: Chart of a CKYParser
+    :param start_symbol: Id of the start symbol of the chart's grammar
+    :return: Dictionary of positions (1 to the number of words - 1) to scores
+    """
+    size = len(chart)
+    scores = {}
+    for k in range(1, size):
+        left = chart[0][k - 1].get(start_symbol)
+        right = chart[k][size - 1]
+        if left is not None and right:
+            scores[k] = left.probability * \
+                max(item.probability for item in right.values())
+    return scores
+
+
+class SegmentingParser:
+    """
+    Wraps a CKYParser or CoarseToFineParser and parses inputs that are
+    longer than max_length words in segments. All other methods are those of
+    the wrapped parser.
+    """
+
+    def __init__(self, parser, max_length=50, root=None, fragment="FRAG",
+                 max_workers=1):
+        """
+        :param parser: A CKYParser or CoarseToFineParser
+        :param max_length: Inputs with more words are segmented
+        :param root: Label of the node that joins the segments (default: the
+        start symbol of the grammar with the function tag -SEGMENTED, which
+        scorers that strip function tags ignore)
+        :param fragment: Label of a segment without a parse. Its words become
+        the children of this node.
+        :param max_workers: Number of threads that parse the segments of an
+        input
+        """
+        if max_length < 1:
+            raise ValueError(f"max_length must be at least 1, not "
+                             f"{max_length}.")
+
+        self.logger = logging.getLogger('CtF Parser')
+        self.parser = parser
+        self.max_length = max_length
+        self.fragment = fragment
+
+        fine_parser = getattr(parser, "parsers", [parser])[-1]
+        self.fine_parser = fine_parser
+        self.root = root if root is not None else \
+            fine_parser.pcfg.get_word_for_id(
+                fine_parser.pcfg.start_symbol) + "-SEGMENTED"
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers) \
+            if max_workers > 1 else None
+
+    def __getattr__(self, name):
+        # Everything that is not segmented is done by the wrapped parser.
+        return getattr(self.parser, name)
+
+    def parse_best(self, sentence, log_dict=None):
+        """
+        Returns the best tree, joined from the trees of the segments if the
+        sentence is too long.
+        """
+        words = self.parser.tokenizer.tokenize(sentence)
+        if len(words) <= self.max_length:
+            chart = self.parser.parse_words(words, log_dict)
+            try:
+                return self.fine_parser.get_best_from_chart(chart)
+            finally:
+                self.parser.release(chart)
+
+        return self.parse_segments(words, log_dict)
+
+    def write_best(self, sentence, writer, log_dict=None):
+        """
+        Parses a sentence and writes the best tree. The statistics of a
+        segmented sentence contain 'segmented' and the number of segments,
+        which also marks it in the jsonl format.
+        :param writer: TreeWriter
+        """
+        words = self.parser.tokenizer.tokenize(sentence)
+        if len(words) <= self.max_length:
+            self.parser.write_best(sentence, writer, log_dict)
+            return
+
+        log_dict = {} if log_dict is None else log_dict
+        writer.write_tree(self.parse_segments(words, log_dict), log_dict)
+
+    def parse_segments(self, words, log_dict=None):
+        """
+        Parses the segments of a tokenized sentence and joins their trees.
+        :param words: List of words as returned by the tokenizer
+        :param log_dict: Write the statistics into this dictionary
+        :return: Tree
+        """
+        t0 = time.time()
+        spans = segment(words, self.max_length,
+                        score_splits=partial(self.__score_splits, words))
+        segments = [words[start:end] for start, end in spans]
+
+        if self.executor is not None:
+            results = list(self.executor.map(self.__parse_segment, segments))
+        else:
+            results = [self.__parse_segment(segment_words)
+                       for segment_words in segments]
+
+        parsed = [segment_statistics for _, segment_statistics in results
+                  if segment_statistics is not None]
+        statistics = {
+            "segmented": True,
+            "segments": [end - start for start, end in spans],
+            "unparsed_segments": len(results) - len(parsed),
+            "items_entered": sum(segment_statistics.get("items_entered", 0)
+                                 for segment_statistics in parsed),
+            "time": time.time() - t0
+        }
+        self.logger.info(f"Parsed {len(words)} words in {len(spans)} "
+                         f"segments.")
+
+        if log_dict is not None:
+            log_dict.update(statistics)
+
+        return [self.root] + [tree for tree, _ in results]
+
+    def __score_splits(self, words, start, stop):
+        """
+        Scores the splits of a window of the words with the chart of the
+        coarsest level. A CKYParser (or a coarse-to-fine parser whose
+        levels are not built yet) only has the fine grammar, which would
+        parse every window as expensively as the segments themselves, so
+        its inputs are split at punctuation and conjunctions.
+        :return: Dictionary of positions in the words to scores
+        """
+        parsers = getattr(self.parser, "parsers", [])
+        if len(parsers) < 2:
+            return {}
+
+        coarse_parser = parsers[0]
+        chart = coarse_parser.parse_words(words[start:stop])
+        try:
+            return {start + k: score for k, score in chart_split_scores(
+                chart, coarse_parser.pcfg.start_symbol).items()}
+        finally:
+            coarse_parser.release(chart)
+
+    def __parse_segment(self, words):
+        """
+        :return: The tree and the statistics of the segment. A segment
+        without a parse is a flat fragment without statistics.
+        """
+        statistics = {}
+        try:
+            chart = self.parser.parse_words(words, statistics)
+        except NoParseFoundException:
+            return [self.fragment] + list(words), None
+
+        try:
+            return self.fine_parser.get_best_from_chart(chart), statistics
+        except NoParseFoundException:
+            return [self.fragment] + list(words), None
+        finally:
+            self.parser.release(chart)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
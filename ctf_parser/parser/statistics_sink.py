@@ -0,0 +1,178 @@
+import glob
+import logging
+import os
+import threading
+
+import numpy as np
+
+"""
+Collects the statistics of many parses in columns and writes them in chunks.
+
+Parsing a corpus produces millions of statistics dictionaries. Instead of
+logging each of them as a JSON string, only their numeric values are kept
+in a buffer. When a batch is full, it is written as one columnar chunk to a
+directory: a Parquet file if pyarrow is installed, otherwise a CSV file.
+load_statistics() reads all chunks back into one NumPy array per column,
+and pandas can read the chunks directly (read_parquet / read_csv).
+"""
+
+FORMATS = ("auto", "csv", "parquet")
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def numeric_values(statistics, keys=None):
+    """
+    The numeric values of a statistics dictionary. Lists of numbers (e.g.
+    the time of every level) become one value per entry.
+    :param statistics: Dictionary
+    :param keys: Only use these keys
+    :return: Dictionary of column name to number
+    """
+    values = {}
+    for key in statistics if keys is None else keys:
+        value = statistics.get(key)
+        if isinstance(value, (int, float)):
+            values[key] = value
+        elif isinstance(value, list):
+            for i, entry in enumerate(value):
+                if isinstance(entry, (int, float)):
+                    values[f"{key}_{i}"] = entry
+    return values
+
+
+class StatisticsSink:
+    """
+    Buffers the statistics of parses and writes a chunk file whenever
+    batch_size rows are collected, so the memory is bounded. The columns of
+    a chunk are all numeric keys of its rows, missing values are NaN.
+    """
+
+    def __init__(self, path, batch_size=10000, output_format="auto",
+                 keys=None):
+        """
+        :param path: Directory for the chunks
+        :param batch_size: Number of rows per chunk
+        :param output_format: 'parquet', 'csv' or 'auto' (Parquet if
+        pyarrow is installed)
+        :param keys: Only write these keys of the statistics
+        """
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown statistics format '{output_format}'.")
+        if output_format == "auto":
+            output_format = "parquet" if has_pyarrow() else "csv"
+
+        self.logger = logging.getLogger('CtF Parser')
+        self.path = path
+        self.batch_size = batch_size
+        self.output_format = output_format
+        self.keys = keys
+
+        os.makedirs(path, exist_ok=True)
+        # Continue after the chunks of a previous run
+        self.chunks = len(chunk_files(path))
+        self.rows = 0
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def add(self, statistics):
+        """
+        Adds the statistics of a parse to the buffer.
+        """
+        row = numeric_values(statistics, self.keys)
+        with self.lock:
+            self.buffer.append(row)
+            self.rows += 1
+            if len(self.buffer) >= self.batch_size:
+                self.__flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows as a chunk.
+        """
+        with self.lock:
+            self.__flush()
+
+    def __flush(self):
+        if not self.buffer:
+            return
+
+        rows = self.buffer
+        self.buffer = []
+
+        names = sorted(set().union(*rows))
+        arrays = [np.array([row.get(name, np.nan) for row in rows],
+                           dtype=np.float64)
+                  for name in names]
+
+        name = os.path.join(self.path, f"statistics-{self.chunks:05d}")
+        if self.output_format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.table(dict(zip(names, arrays)))
+            pyarrow.parquet.write_table(table, f"{name}.parquet.tmp")
+            os.replace(f"{name}.parquet.tmp", f"{name}.parquet")
+        else:
+            with open(f"{name}.csv.tmp", "w") as f:
+                np.savetxt(f, np.column_stack(arrays), delimiter=",",
+                           header=",".join(names), comments="", fmt="%.13g")
+            os.replace(f"{name}.csv.tmp", f"{name}.csv")
+
+        self.chunks += 1
+        self.logger.debug(f"Wrote {len(rows)} statistics to {name}.")
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def chunk_files(path):
+    return sorted(glob.glob(os.path.join(path, "statistics-*.csv")) +
+                  glob.glob(os.path.join(path, "statistics-*.parquet")))
+
+
+def load_statistics(path):
+    """
+    Reads all chunks of a StatisticsSink.
+    :param path: Directory of the chunks
+    :return: Dictionary of column name to NumPy array
+    """
+    chunks = []
+    for name in chunk_files(path):
+        if name.endswith(".parquet"):
+            import pyarrow.parquet
+
+            table = pyarrow.parquet.read_table(name)
+            chunks.append({column: table.column(column).to_numpy()
+                           for column in table.column_names})
+        elif name.endswith(".csv"):
+            data = np.genfromtxt(name, delimiter=",", names=True,
+                                 deletechars="")
+            # A chunk with a single row is read as a scalar
+            chunks.append({column: np.atleast_1d(data[column])
+                           for column in data.dtype.names})
+
+    # Columns that are missing in a chunk are NaN
+    columns = {}
+    for chunk in chunks:
+        columns.update(dict.fromkeys(chunk))
+
+    statistics = {}
+    for column in columns:
+        statistics[column] = np.concatenate([
+            chunk[column] if column in chunk
+            else np.full(len(next(iter(chunk.values()))), np.nan)
+            for chunk in chunks])
+    return statistics
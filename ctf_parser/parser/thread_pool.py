@@ -0,0 +1,80 @@
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from ctf_parser.parser.cky_parser import NoParseFoundException
+
+"""
+Parses many sentences with a single parser object in a pool of threads, so
+that all threads share one copy of the grammars. On CPython builds with a
+GIL the threads take turns; on free-threaded builds (PEP 703) they run on
+all cores in parallel.
+"""
+
+
+def gil_enabled():
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+class ThreadPoolParser:
+
+    def __init__(self, parser, max_workers=None):
+        """
+        :param parser: A CKYParser or CoarseToFineParser
+        :param max_workers: Number of threads (default: CPU count)
+        """
+        self.logger = logging.getLogger('CtF Parser')
+        self.parser = parser
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        if gil_enabled():
+            self.logger.info("The GIL is enabled, threads will not parse "
+                             "in parallel.")
+
+    def parse_best(self, sentence, log_dict=None):
+        """
+        Returns the best tree for a sentence or None if there is no parse.
+        :param log_dict: Write the statistics of the parse into this
+        dictionary
+        """
+        try:
+            return self.parser.parse_best(sentence, log_dict)
+        except NoParseFoundException:
+            return None
+
+    def parse_batch(self, sentences, parse=None):
+        """
+        Parses a list of sentences concurrently.
+        :param sentences: List of strings
+        :param parse: Function that parses one sentence in a thread (default:
+        parse_best), e.g. to also return its statistics or a forest
+        :return: List of trees (None for sentences without a parse), or the
+        results of parse, in the order of the input
+        """
+        return list(self.executor.map(parse or self.parse_best, sentences))
+
+    def parse_stream(self, sentences, batch_size=64, parse=None):
+        """
+        Parses an iterable of sentences (e.g. a file) in batches and yields
+        the trees in the order of the input.
+        :param sentences: Iterable of strings
+        :param batch_size: Number of sentences that are parsed at once
+        :param parse: Function that parses one sentence in a thread
+        """
+        sentences = iter(sentences)
+        while True:
+            batch = list(islice(sentences, batch_size))
+            if not batch:
+                return
+            yield from self.parse_batch(batch, parse)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -4,6 +4,8 @@
 # Author: Edward Loper <edloper@gradient.cis.upenn.edu>
 #         Michael Heilman <mheilman@cmu.edu> (re-port from http://www.cis.upenn.edu/~treebank/tokenizer.sed)
 import re
+from functools import lru_cache
+from itertools import groupby, tee, zip_longest
 
 
 SYM_MAP = {
@@ -49,6 +51,13 @@ class PennTreebankTokenizer:
                      re.compile(r"(?i)\b(wha)(t)(cha)\b")]
     
     def tokenize(self, text):
+        return list(apply_exceptions(self.split(text)))
+
+    def split(self, text):
+        """
+        Applies the regular expressions to the text and splits it, without
+        the tokenization exceptions.
+        """
         #starting quotes
         text = re.sub(r'^\"', r'``', text)
         text = re.sub(r'(``)', r' \1 ', text)
@@ -88,36 +97,288 @@ class PennTreebankTokenizer:
         # for regexp in self.CONTRACTIONS4:
         #     text = regexp.sub(r' \1 \2 \3 ', text)
         
-        words = []
-        tokens = text.split()
-        skip = False
-        start_quotes = False
-        for i, t in enumerate(tokens):
-            if skip:
-                skip = False
-            
-            # Tokenization Exceptions
-            elif t == '&' and len(tokens[i+1]) == 1:
-                words[-1] += '&' + tokens[i+1]
-                skip = True
-            elif t == '#':
-                words.append('#' + tokens[i+1])
-                skip = True
-            elif t == "'s" and words[-1].isdigit():
-                words[-1] += t
-            
-            # Special Penn symbols: keep track of original in tuple
-            elif t in SYM_MAP:
-                words.append((SYM_MAP[t], t))
-            elif t == '"':
-                if start_quotes:
-                    start_quotes = False
-                    words.append(("''", t))
+        return text.split()
+
+
+def apply_exceptions(tokens):
+    """
+    Applies the tokenization exceptions of the Penn Treebank to a stream of
+    tokens, e.g. joins 'AT', '&', 'T' to 'AT&T'. Needs one token lookahead.
+    :param tokens: Iterable of tokens
+    :return: Generator of words
+    """
+    tokens, following = tee(tokens)
+    next(following, None)
+
+    # The last word is held back, since the next token may be appended to it
+    last = None
+    skip = False
+    start_quotes = False
+    for t, next_token in zip_longest(tokens, following):
+        if skip:
+            skip = False
+            continue
+
+        # Tokenization Exceptions
+        if t == '&' and isinstance(last, str) and next_token is not None \
+                and len(next_token) == 1:
+            last += '&' + next_token
+            skip = True
+            continue
+        elif t == '#' and next_token is not None:
+            word = '#' + next_token
+            skip = True
+        elif t == "'s" and isinstance(last, str) and last.isdigit():
+            last += t
+            continue
+
+        # Special Penn symbols: keep track of original in tuple
+        elif t in SYM_MAP:
+            word = (SYM_MAP[t], t)
+        elif t == '"':
+            if start_quotes:
+                start_quotes = False
+                word = ("''", t)
+            else:
+                start_quotes = True
+                word = ('``', t)
+
+        else:
+            word = t
+
+        if last is not None:
+            yield last
+        last = word
+
+    if last is not None:
+        yield last
+
+
+class FastPennTreebankTokenizer(PennTreebankTokenizer):
+    """
+    Produces the same words as the PennTreebankTokenizer in one scan over the
+    text, without rewriting it once per regular expression. All rules only
+    look at one character left and right of a whitespace separated chunk
+    (and at the start and end of the text), so every chunk is split on its
+    own: one combined expression finds its punctuation, and the rules mark
+    the positions where the PennTreebankTokenizer would insert a space. The
+    rules for quotes and contractions come last, since they depend on the
+    spaces inserted before them. Chunks that consist only of letters and
+    digits are words already.
+
+        >>> t = FastPennTreebankTokenizer()
+        >>> t.tokenize("They'll save and invest more.")
+        ['They', "'ll", 'save', 'and', 'invest', 'more', '.']
+    """
+
+    CHUNK = re.compile(r'\S+')
+    # One alternative per rule that puts spaces around punctuation
+    PUNCTUATION = re.compile(r"`+|\"|[:,]|\.+|-+|'+|[;@#$%&?!\]\[(){}<>]")
+    CLOSERS = ']})>"\''
+    ENDINGS = re.compile(r"'ll|'LL|'re|'RE|'ve|'VE|n't|N'T")
+    CONTRACTIONS = re.compile(r"(?i)(can)(not)|(d)('ye)|(gim)(me)|(gon)(na)|"
+                              r"(got)(ta)|(lem)(me)|(mor)('n)|(wan)(na)|"
+                              r"('t)(is|was)")
+    # Last groups of wanna and 'tis/'twas in CONTRACTIONS
+    WANNA = 16
+    TIS = 18
+
+    def __init__(self, cache_size=65536):
+        """
+        :param cache_size: Number of chunks whose tokens are cached
+        """
+        self.split_chunk = lru_cache(maxsize=cache_size)(self.__split_chunk)
+
+    def tokenize(self, text):
+        return list(self.iter_tokenize(text))
+
+    def iter_tokenize(self, text):
+        """
+        Tokenizes a text without building the list of words.
+        :return: Generator of words
+        """
+        return apply_exceptions(self.__iter_tokens(text))
+
+    def tokenize_many(self, texts):
+        """
+        Tokenizes texts one after the other, e.g. the lines of a file. Only
+        one text is held in memory at a time.
+        :param texts: Iterable of strings
+        :return: Generator of lists of words, one per text
+        """
+        for text in texts:
+            yield self.tokenize(text)
+
+    def __iter_tokens(self, text):
+        # End of the last chunk, only whitespace follows it
+        end = len(text.rstrip())
+        for match in self.CHUNK.finditer(text):
+            chunk = match.group()
+            start, stop = match.span()
+
+            if chunk.isalnum() and not self.CONTRACTIONS.search(chunk):
+                yield chunk
+                continue
+
+            # The rules only tell spaces from other whitespace, which is
+            # passed as a tab. The start and end of the text are ''.
+            before = text[start - 1:start]
+            after = text[stop:stop + 1]
+            yield from self.split_chunk(
+                chunk, before if before in ('', ' ') else '\t',
+                after if after in ('', ' ') else '\t', stop >= end)
+
+    def __split_chunk(self, chunk, before, after, last):
+        # spaces[i] is set if a space is inserted before chunk[i] (or after
+        # the chunk for i == len(chunk)), early[i] if it is inserted before
+        # the rule for single quotes
+        if not before and chunk[0] == '"':
+            chunk = '``' + chunk[1:]
+        length = len(chunk)
+        spaces = bytearray(length + 1)
+        early = bytearray(length + 1)
+        quotes = {}
+        consumed = 0
+
+        for match in self.PUNCTUATION.finditer(chunk):
+            i, j = match.span()
+            c = chunk[i]
+            if c == '`':
+                # ``, paired from the left
+                for k in range(i, j - 1, 2):
+                    spaces[k] = spaces[k + 2] = 1
+                    early[k] = early[k + 2] = 1
+            elif c == '-':
+                # --, paired from the left
+                for k in range(i, j - 1, 2):
+                    spaces[k] = spaces[k + 2] = 1
+            elif c == '"':
+                # Opening after a space or an opening bracket, else closing
+                previous = chunk[i - 1] if i > 0 else before
+                if previous in (' ', '(', '[', '{', '<') or \
+                        previous == '`' and spaces[i]:
+                    quotes[i] = '``'
+                    early[i] = early[j] = 1
                 else:
-                    start_quotes = True
-                    words.append(('``', t))
-            
+                    quotes[i] = "''"
+                spaces[i] = spaces[j] = 1
+            elif c == ':' or c == ',':
+                # Unless a digit follows. The next character is consumed.
+                following = chunk[j] if j < length else after
+                if i >= consumed and following and \
+                        not following.isdecimal():
+                    spaces[i] = spaces[j] = 1
+                    early[i] = early[j] = 1
+                    consumed = j + 1
+            elif c == '.':
+                # ..., grouped from the left
+                for k in range(i, j - 2, 3):
+                    spaces[k] = spaces[k + 3] = 1
+                    early[k] = early[k + 3] = 1
+            elif c == "'":
+                # '' after any other character, again from the left
+                k = i - 1 if i > 0 and not spaces[i] else i
+                while k + 2 < j:
+                    spaces[k + 1] = spaces[k + 3] = 1
+                    k += 3
             else:
-                words.append(t)
-        
-        return words
+                spaces[i] = spaces[j] = 1
+                if c not in '[](){}<>':
+                    early[i] = early[j] = 1
+
+        if last:
+            # A period at the end of the text, unless it follows a period.
+            # The whitespace after it becomes a space.
+            k = length
+            while k > 0 and chunk[k - 1] in self.CLOSERS:
+                k -= 1
+            if k > 0 and chunk[k - 1] == '.':
+                k -= 1
+                if k > 0:
+                    matched = chunk[k - 1] != '.' or spaces[k]
+                else:
+                    matched = before != ''
+                if matched:
+                    spaces[k] = early[k] = 1
+                    after = ' '
+
+        if "'" in chunk:
+            # ' before a space, unless a quote precedes it
+            for i, c in enumerate(chunk):
+                if c == "'" and i > 0 and \
+                        (chunk[i - 1] != "'" or early[i]) and \
+                        (early[i + 1] or i + 1 == length and after == ' '):
+                    spaces[i] = 1
+
+        # The text is padded with spaces
+        self.__split_contractions(chunk, before or ' ', after or ' ', spaces)
+
+        words = []
+        start = 0
+        while start < length:
+            stop = spaces.find(1, start + 1)
+            if stop == -1:
+                stop = length
+            word = chunk[start:stop]
+            words.append(quotes[start] if word == '"' else word)
+            start = stop
+        return tuple(words)
+
+    def __split_contractions(self, chunk, before, after, spaces):
+        length = len(chunk)
+
+        def space(i):
+            return spaces[i] or i == length and after == ' '
+
+        def boundary(i):
+            return i == 0 or i == length or spaces[i] or \
+                not is_word(chunk[i - 1]) or not is_word(chunk[i])
+
+        if "'" in chunk:
+            # 's, 'm, 'd and ' before a space, unless a quote precedes them
+            split = [i for i, c in enumerate(chunk)
+                     if c == "'" and i > 0 and not spaces[i] and
+                     chunk[i - 1] != "'" and
+                     (space(i + 1) or i + 1 < length and
+                      chunk[i + 1] in 'sSmMdD' and space(i + 2))]
+            for i in split:
+                spaces[i] = 1
+
+            # 'll, 're, 've and n't before a space
+            split = [match.start() for match in self.ENDINGS.finditer(chunk)
+                     if match.start() > 0 and not spaces[match.start()] and
+                     chunk[match.start() - 1] != "'" and
+                     space(match.end())]
+            for i in split:
+                spaces[i] = 1
+
+        # Every contraction is a rule of its own, applied in the order of
+        # CONTRACTIONS ('tis before 'twas). Its matches only see the spaces
+        # inserted before the rule.
+        def rule(match):
+            return match.lastindex, len(match.group())
+
+        matches = sorted(self.CONTRACTIONS.finditer(chunk), key=rule)
+        for _, matches in groupby(matches, key=rule):
+            split = []
+            for match in matches:
+                start, stop = match.span()
+                if any(spaces[start + 1:stop]):
+                    continue
+
+                if match.lastindex == self.TIS:
+                    matched = (spaces[start] or start == 0 and
+                               before == ' ') and boundary(stop)
+                elif match.lastindex == self.WANNA:
+                    matched = boundary(start) and space(stop)
+                else:
+                    matched = boundary(start) and boundary(stop)
+
+                if matched:
+                    split += [start, match.start(match.lastindex), stop]
+            for i in split:
+                spaces[i] = 1
+
+
+def is_word(c):
+    return c.isalnum() or c == '_'
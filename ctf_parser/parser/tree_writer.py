@@ -0,0 +1,267 @@
+import json
+import sys
+from itertools import chain
+
+"""
+Serializes parse trees into a stream without building nested lists first.
+
+A tree is walked iteratively and turned into a stream of events: opening a
+constituent, a word and closing a constituent. Binarized and collapsed
+unary symbols of the grammar are undone on the event stream, before the
+events are written in one of the output formats.
+"""
+
+OPEN, WORD, CLOSE = 0, 1, 2
+CLOSE_EVENT = (CLOSE, None)
+
+
+def chart_events(item, chart, pcfg):
+    """
+    Walks the best tree below an item of the chart.
+    :param item: ChartItem of the root
+    :param chart: Chart
+    :param pcfg: Grammar to look up the symbols
+    :return: Generator of events
+    """
+    agenda = [item]
+    while agenda:
+        item = agenda.pop()
+        if item is None:
+            yield CLOSE_EVENT
+            continue
+
+        yield OPEN, pcfg.get_word_for_id(item.symbol)
+        if item.terminal:
+            yield WORD, item.terminal
+            yield CLOSE_EVENT
+            continue
+
+        rhs_1, rhs_2 = item.backpointers
+        agenda.append(None)
+        agenda.append(chart[rhs_2.i][rhs_2.j][rhs_2.symbol])
+        agenda.append(chart[rhs_1.i][rhs_1.j][rhs_1.symbol])
+
+
+def tree_events(tree):
+    """
+    Walks a tree given as nested lists, e.g. from parse_best().
+    :return: Generator of events
+    """
+    agenda = [tree]
+    while agenda:
+        node = agenda.pop()
+        if node is None:
+            yield CLOSE_EVENT
+        elif isinstance(node, list):
+            yield OPEN, node[0]
+            agenda.append(None)
+            agenda.extend(reversed(node[1:]))
+        else:
+            yield WORD, node
+
+
+def debinarize(events, unary_symbol="‡", binary_symbol="†"):
+    """
+    Removes the intermediate nodes of binarized rules (their children are
+    attached to the parent) and expands collapsed unary chains.
+    :param events: Iterable of events
+    :param unary_symbol: Character that separates the symbols of a unary chain
+    :param binary_symbol: Character used in the symbols of intermediate nodes
+    :return: Generator of events
+    """
+    # Number of CLOSE events to emit for every open node
+    closes = []
+    for event in events:
+        kind, value = event
+        if kind == OPEN:
+            if binary_symbol in value:
+                closes.append(0)
+                continue
+
+            chain_labels = value.split(unary_symbol)
+            closes.append(len(chain_labels))
+            for label in chain_labels:
+                yield OPEN, label
+        elif kind == CLOSE:
+            for _ in range(closes.pop()):
+                yield CLOSE_EVENT
+        else:
+            yield event
+
+
+def build_tree(events):
+    """
+    Builds a tree of nested lists from events.
+    """
+    root = None
+    stack = []
+    for kind, value in events:
+        if kind == OPEN:
+            node = [value]
+            if stack:
+                stack[-1].append(node)
+            else:
+                root = node
+            stack.append(node)
+        elif kind == CLOSE:
+            stack.pop()
+        else:
+            stack[-1].append(value)
+    return root
+
+
+def penn_word(word):
+    # Words of the tokenizer may be tuples (Penn symbol, original)
+    return word[0] if isinstance(word, tuple) else word
+
+
+class TreeWriter:
+    """
+    Writes trees in one of these formats, one tree per line:
+    - list: The Python representation of the tree as nested lists, without
+      undoing the binarization (as parse_best() returns it)
+    - ptb: Bracketed Penn Treebank format
+    - json: The tree as nested JSON arrays
+    - jsonl: A JSON object with the tree and the statistics of the parse,
+      and "segmented": true if the tree was joined from segments
+    The output is collected and written to the stream in large chunks.
+    """
+
+    FORMATS = ["list", "ptb", "json", "jsonl"]
+
+    NO_PARSE = {
+        "list": "[]",
+        "ptb": "()",
+        "json": "null",
+        "jsonl": "null"
+    }
+
+    def __init__(self, stream=None, output_format="list", buffer_size=65536,
+                 line_buffered=False):
+        """
+        :param stream: Text stream to write to (default: stdout)
+        :param output_format: One of TreeWriter.FORMATS
+        :param buffer_size: Number of characters collected before writing
+        :param line_buffered: Write every tree immediately, e.g. when the
+        parser is used interactively
+        """
+        if output_format not in self.FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}'.")
+
+        self.stream = stream if stream is not None else sys.stdout
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        self.line_buffered = line_buffered
+
+        self.pieces = []
+        self.buffered = 0
+
+        self.trees = 0
+        self.no_parses = 0
+
+    def write_chart(self, chart, pcfg, statistics=None):
+        """
+        Writes the best tree of a chart.
+        :param chart: Chart of the CKYParser
+        :param pcfg: Grammar of the chart
+        :param statistics: Dictionary that is written with the jsonl format
+        """
+        root = chart[0][-1].get(pcfg.start_symbol) if chart else None
+        if root is None:
+            self.write_no_parse(statistics)
+            return
+
+        events = chart_events(root, chart, pcfg)
+        _, label = next(events)
+        self.__write_events(chain([(OPEN, label.split("|")[0])], events),
+                            statistics)
+
+    def write_tree(self, tree, statistics=None):
+        """
+        Writes a tree of nested lists (or no parse if the tree is None).
+        """
+        if not tree:
+            self.write_no_parse(statistics)
+            return
+
+        self.__write_events(tree_events(tree), statistics)
+
+    def write_no_parse(self, statistics=None):
+        self.no_parses += 1
+        self.__begin(statistics)
+        self.__write(self.NO_PARSE[self.output_format])
+        self.__end(statistics)
+
+    def flush(self):
+        self.stream.write("".join(self.pieces))
+        self.stream.flush()
+        self.pieces = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __write(self, piece):
+        self.pieces.append(piece)
+        self.buffered += len(piece)
+
+    def __begin(self, statistics):
+        if self.output_format == "jsonl":
+            self.__write('{"tree": ')
+
+    def __end(self, statistics):
+        if self.output_format == "jsonl":
+            if statistics and statistics.get("segmented"):
+                self.__write(', "segmented": true')
+            self.__write(', "statistics": ')
+            self.__write(json.dumps(statistics or {}, sort_keys=True,
+                                    default=str))
+            self.__write("}")
+        self.__write("\n")
+
+        if self.line_buffered or self.buffered >= self.buffer_size:
+            self.flush()
+
+    def __write_events(self, events, statistics):
+        self.trees += 1
+        if self.output_format == "list":
+            open_node, separator, close_node = "[", ", ", "]"
+            label_text = word_text = repr
+        elif self.output_format == "ptb":
+            open_node, separator, close_node = "(", " ", ")"
+            label_text = str
+            word_text = penn_word
+            events = debinarize(events)
+        else:
+            open_node, separator, close_node = "[", ", ", "]"
+            label_text = json.dumps
+
+            def word_text(word):
+                return json.dumps(penn_word(word))
+
+            events = debinarize(events)
+
+        self.__begin(statistics)
+
+        write = self.__write
+        first = True
+        for kind, value in events:
+            if kind == OPEN:
+                if not first:
+                    write(separator)
+                write(open_node)
+                write(label_text(value))
+                first = False
+            elif kind == WORD:
+                write(separator)
+                write(word_text(value))
+            else:
+                write(close_node)
+
+        self.__end(statistics)
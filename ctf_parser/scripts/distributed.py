@@ -0,0 +1,175 @@
+import argparse
+import json
+import sys
+from itertools import chain
+from sys import stderr
+
+from ctf_parser import setup_logging
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.chart_pool import freeze_grammars
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.corpus import open_input
+from ctf_parser.parser.distributed import Coordinator, run_worker
+from ctf_parser.parser.tree_writer import TreeWriter
+from ctf_parser.scripts.parser import add_segment_arguments, \
+    create_segmenting_parser, inside_outside_modes, read_mapping
+
+
+def read_sentences(paths):
+    if not paths:
+        return (line.strip() for line in sys.stdin)
+
+    def read(path):
+        stream, _ = open_input(path)
+        with stream:
+            for line in stream:
+                yield line.strip()
+
+    return chain.from_iterable(read(path) for path in paths)
+
+
+def coordinator():
+    parser = argparse.ArgumentParser(
+        "ctfcoordinator", description="Distributes sentences to parsing "
+                                      "workers and writes the trees in the "
+                                      "order of the input.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--host", help="Address to listen on.",
+                        type=str, required=False, default="0.0.0.0")
+    parser.add_argument("--port", help="Port to listen on.",
+                        type=int, required=False, default=5790)
+    parser.add_argument("--input",
+                        help="Files with one sentence per line (plain or "
+                             ".gz). Without it, stdin is read.",
+                        type=str, required=False, nargs='+', default=None)
+    parser.add_argument("--output",
+                        help="File for the trees. Without it, they are "
+                             "written to stdout.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--format",
+                        help="Output format of the trees.",
+                        type=str, required=False, default="jsonl",
+                        choices=TreeWriter.FORMATS)
+    parser.add_argument("--unit_cost",
+                        help="Estimated cost of a work unit as the sum of "
+                             "the cubed sentence lengths.",
+                        type=int, required=False, default=20000)
+    parser.add_argument("--max_sentences",
+                        help="Maximum number of sentences in a work unit.",
+                        type=int, required=False, default=1000)
+    parser.add_argument("--max_retries",
+                        help="How often a failed work unit is retried.",
+                        type=int, required=False, default=3)
+    parser.add_argument("--unit_timeout",
+                        help="Seconds after which a work unit is given to "
+                             "another worker.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--enable_logs",
+                        help="Enable logging to stdout and file.",
+                        dest='enable_logs', action='store_true',
+                        required=False, default=False)
+
+    args = parser.parse_args()
+    setup_logging(args.enable_logs)
+
+    output = open(args.output, "w", encoding="utf-8") \
+        if args.output is not None else sys.stdout
+
+    with Coordinator(args.host, args.port, output_format=args.format,
+                     unit_cost=args.unit_cost,
+                     max_sentences=args.max_sentences,
+                     max_retries=args.max_retries,
+                     unit_timeout=args.unit_timeout) as server:
+        print(f"Waiting for workers on {server.address[0]}:"
+              f"{server.address[1]}...", file=stderr)
+        statistics = server.run(read_sentences(args.input), output)
+
+    if args.output is not None:
+        output.close()
+
+    print(f"Parsed {statistics['sentences']} sentences in "
+          f"{statistics['units']} units with "
+          f"{len(statistics['workers'])} workers "
+          f"({statistics['retries']} retries, "
+          f"{statistics['failed_units']} failed units).", file=stderr)
+
+
+def worker():
+    parser = argparse.ArgumentParser(
+        "ctfworker", description="Loads the grammars and parses the work "
+                                 "units of a coordinator.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--coordinator",
+                        help="Address of the coordinator as host:port.",
+                        type=str, required=False, default="127.0.0.1:5790")
+    parser.add_argument("--name",
+                        help="Name of the worker in the statistics "
+                             "(default: host and process id).",
+                        type=str, required=False, default=None)
+    parser.add_argument("--parser",
+                        help="Parse with the coarse-to-fine or the plain "
+                             "CKY parser.",
+                        type=str, required=False, default="ctf",
+                        choices=["ctf", "cky"])
+    parser.add_argument("--grammar", help="Path to the grammar to be used.",
+                        type=str, required=False, default="data/grammar.pcfg")
+    parser.add_argument("--ctfmapping",
+                        help="Path to the coarse-to-fine symbol mapping file.",
+                        type=str, required=False,
+                        default="data/ctf_mapping.yml")
+    parser.add_argument("--threshold",
+                        help="Threshold for coarse-to-fine parsing.",
+                        type=float, required=False, default=0.0001)
+    parser.add_argument("--fast_start",
+                        help="Build the coarse levels in the background and "
+                             "parse with the fine grammar alone until they "
+                             "are ready.",
+                        dest='fast_start', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--fallback",
+                        help="If a level finds no parse, parse it again "
+                             "with relaxed thresholds and finally the fine "
+                             "grammar without pruning.",
+                        dest='fallback', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--inside_outside",
+                        help="Calculate the inside/outside scores of a level "
+                             "over the whole grammar ('exact'), only over "
+                             "the items in its chart ('sparse') or from the "
+                             "best derivations in its chart ('viterbi'). "
+                             "One value or one per level (coarse to fine).",
+                        type=str, required=False, nargs='+',
+                        default=["exact"],
+                        choices=["exact", "sparse", "viterbi"])
+    add_segment_arguments(parser)
+    parser.add_argument("--connect_timeout",
+                        help="Seconds to wait for the coordinator.",
+                        type=float, required=False, default=30.0)
+    parser.add_argument("--enable_logs",
+                        help="Enable logging to stdout and file.",
+                        dest='enable_logs', action='store_true',
+                        required=False, default=False)
+
+    args = parser.parse_args()
+    setup_logging(args.enable_logs)
+
+    print("Preparing parser...", file=stderr)
+
+    pcfg = PCFG()
+    pcfg.load_model([json.loads(l) for l in open(args.grammar)])
+    if args.parser == "ctf":
+        mapping = read_mapping(args.ctfmapping)
+        sentence_parser = CoarseToFineParser(
+            pcfg, mapping, threshold=args.threshold,
+            inside_outside=inside_outside_modes(args),
+            background=args.fast_start, fallback=args.fallback)
+    else:
+        sentence_parser = CKYParser(pcfg)
+    sentence_parser = create_segmenting_parser(sentence_parser, args)
+    freeze_grammars()
+
+    host, port = args.coordinator.rsplit(":", 1)
+    units = run_worker(sentence_parser, (host, int(port)), args.name,
+                       args.connect_timeout)
+    print(f"Done after {units} work units.", file=stderr)
@@ -0,0 +1,147 @@
+import argparse
+import json
+import logging
+import time
+from itertools import islice
+from sys import stderr
+
+import yaml
+from prettytable import PrettyTable
+
+from ctf_parser import setup_logging
+from ctf_parser.grammar.hierarchy import learn_hierarchy
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import NoParseFoundException
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+
+
+def score_hierarchy(pcfg, mapping, sentences, **parser_arguments):
+    """
+    Parses a sample of sentences with a hierarchy and measures how well its
+    coarse levels prune.
+    :param pcfg: The fine grammar
+    :param mapping: Hierarchy in the format of the CtfMapper
+    :param sentences: List of sentences
+    :param parser_arguments: Further arguments for the CoarseToFineParser
+    :return: Dictionary with the statistics
+    """
+    parser = CoarseToFineParser(pcfg, CtfMapper(mapping), **parser_arguments)
+
+    items_entered = 0
+    items_pruned = 0
+    no_parse = 0
+
+    t0 = time.time()
+    for sentence in sentences:
+        statistics = {}
+        try:
+            parser.release(parser.parse(sentence, statistics))
+        except NoParseFoundException:
+            no_parse += 1
+
+        items_entered += statistics.get('items_entered', 0)
+        items_pruned += statistics.get('items_pruned', 0)
+    parse_time = time.time() - t0
+
+    return {
+        "levels": len(parser.grammars) - 1,
+        "time": parse_time,
+        "sentences_per_second": len(sentences) / max(parse_time, 1e-9),
+        "pruning_rate": items_pruned / max(items_entered + items_pruned, 1),
+        "coarse_cost": sum(statistics['cost']
+                           for statistics in parser.level_statistics),
+        "no_parse": no_parse
+    }
+
+
+def hierarchy():
+    parser = argparse.ArgumentParser(
+        "ctfhierarchy", description="Learns coarse-to-fine symbol "
+                                    "hierarchies from a grammar and chooses "
+                                    "the one that parses a sample fastest.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--grammar", help="Path to the grammar to be used.",
+                        type=str, required=False, default="data/grammar.pcfg")
+    parser.add_argument("--sentences",
+                        help="File with one sentence per line to score the "
+                             "hierarchies on. Without it, the first "
+                             "candidate is written.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--sample",
+                        help="Number of sentences used for scoring.",
+                        type=int, required=False, default=50)
+    parser.add_argument("--levels",
+                        help="Number of clusters per level from coarse to "
+                             "fine, e.g. '1,2,4'. Can be given several times.",
+                        type=str, required=False, action='append',
+                        default=None)
+    parser.add_argument("--methods",
+                        help="Linkage methods to try.",
+                        type=str, required=False, nargs='+',
+                        default=["complete", "average"])
+    parser.add_argument("--metric",
+                        help="Distance between the rule distributions of two "
+                             "labels.",
+                        type=str, required=False, default="cosine")
+    parser.add_argument("--threshold",
+                        help="Threshold for coarse-to-fine parsing.",
+                        type=float, required=False, default=0.0001)
+    parser.add_argument("--output",
+                        help="Path of the YAML file for the best hierarchy.",
+                        type=str, required=False,
+                        default="ctf_mapping_learned.yml")
+
+    parser.add_argument("--enable_logs",
+                        help="Enable logging to stdout and file.",
+                        dest='enable_logs', action='store_true',
+                        required=False, default=False)
+
+    args = parser.parse_args()
+    setup_logging(args.enable_logs)
+    logger = logging.getLogger('CtF Parser')
+
+    pcfg = PCFG()
+    pcfg.load_model([json.loads(l) for l in open(args.grammar)])
+
+    levels = args.levels or ["1,2,4", "1,3,6", "2,6"]
+    candidates = []
+    for level_string in levels:
+        clusters_per_level = [int(k) for k in level_string.split(",")]
+        for method in args.methods:
+            mapping = learn_hierarchy(pcfg, clusters_per_level, method,
+                                      args.metric)
+            candidates.append((level_string, method, mapping))
+
+    best = candidates[0][2]
+
+    if args.sentences is not None:
+        with open(args.sentences) as f:
+            sentences = [line.strip() for line in islice(f, args.sample)]
+
+        table = PrettyTable(["levels", "method", "sentences/s",
+                             "pruning rate", "coarse cost", "no parse"])
+        scores = []
+        for n, (level_string, method, mapping) in enumerate(candidates):
+            print(f"Scoring {level_string} ({method})...", file=stderr)
+            score = score_hierarchy(pcfg, mapping, sentences,
+                                    threshold=args.threshold)
+            logger.info(json.dumps(
+                dict(score, levels=level_string, method=method),
+                sort_keys=True))
+
+            scores.append((score['no_parse'], score['time'], n))
+            table.add_row([level_string, method,
+                           f"{score['sentences_per_second']:0.2f}",
+                           f"{score['pruning_rate']:0.4f}",
+                           f"{score['coarse_cost']:0.2f}",
+                           score['no_parse']])
+
+        print(table, file=stderr)
+
+        # Prefer hierarchies that find a parse for every sentence
+        best = candidates[min(scores)[2]][2]
+
+    with open(args.output, "w") as f:
+        yaml.safe_dump(best, f, default_flow_style=False)
+    print(f"Wrote the hierarchy to {args.output}.", file=stderr)
@@ -1,16 +1,202 @@
 import argparse
-import hashlib
 import json
 import logging
+import signal
 import time
+from functools import partial
 from sys import stdin, stderr
 
-import yaml
-
+from ctf_parser import setup_logging
 from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.chart_pool import ChartPool, freeze_grammars
 from ctf_parser.parser.cky_parser import NoParseFoundException, CKYParser
 from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.corpus import CorpusParser
 from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.parser.forest import Forest, open_forests, write_forest
+from ctf_parser.parser.hot_reload import HotReloadParser
+from ctf_parser.parser.segmenter import SegmentingParser
+from ctf_parser.parser.statistics_sink import StatisticsSink, FORMATS
+from ctf_parser.parser.thread_pool import ThreadPoolParser
+from ctf_parser.parser.tree_writer import TreeWriter
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def add_corpus_arguments(parser):
+    parser.add_argument("--input",
+                        help="Parse these files (plain or .gz, one sentence "
+                             "per line) instead of stdin into shards in "
+                             "--output_dir. A rerun resumes an interrupted "
+                             "run.",
+                        type=str, required=False, nargs='+', default=None)
+    parser.add_argument("--output_dir",
+                        help="Directory for the shards and the manifest.",
+                        type=str, required=False, default="parsed")
+    parser.add_argument("--shard_sentences",
+                        help="Maximum number of sentences per shard.",
+                        type=int, required=False, default=100000)
+    parser.add_argument("--shard_seconds",
+                        help="Maximum time in seconds spent on a shard.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--progress_interval",
+                        help="Seconds between two progress reports.",
+                        type=float, required=False, default=60)
+    parser.add_argument("--compress",
+                        help="Write gzip compressed shards.",
+                        dest='compress', action='store_true',
+                        required=False, default=False)
+
+
+def add_segment_arguments(parser):
+    parser.add_argument("--max_length",
+                        help="Parse inputs with more words in segments that "
+                             "are split at punctuation and conjunctions, "
+                             "scored by the coarsest grammar.",
+                        type=positive_int, required=False, default=None)
+    parser.add_argument("--segment_root",
+                        help="Label of the node that joins the segments "
+                             "(default: the start symbol with the function "
+                             "tag -SEGMENTED).",
+                        type=str, required=False, default=None)
+    parser.add_argument("--segment_threads",
+                        help="Number of threads that parse the segments of "
+                             "an input.",
+                        type=int, required=False, default=1)
+
+
+def add_statistics_arguments(parser):
+    parser.add_argument("--statistics",
+                        help="Write the numeric statistics of every sentence "
+                             "(counters and phase timings) in chunks to this "
+                             "directory.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--statistics_format",
+                        help="Format of the chunks ('auto' writes Parquet if "
+                             "pyarrow is installed, otherwise CSV).",
+                        type=str, required=False, default="auto",
+                        choices=FORMATS)
+    parser.add_argument("--statistics_batch",
+                        help="Number of sentences per statistics chunk.",
+                        type=int, required=False, default=10000)
+
+
+def create_statistics_sink(args):
+    if args.statistics is None:
+        return None
+    return StatisticsSink(args.statistics, batch_size=args.statistics_batch,
+                          output_format=args.statistics_format)
+
+
+def create_segmenting_parser(parser, args):
+    # Long-input segmentation is opt-in
+    if args.max_length is None:
+        return parser
+    return SegmentingParser(parser, max_length=args.max_length,
+                            root=args.segment_root,
+                            max_workers=args.segment_threads)
+
+
+def parse_corpus(parser, args):
+    corpus_parser = CorpusParser(parser, args.output_dir,
+                                 shard_sentences=args.shard_sentences,
+                                 shard_seconds=args.shard_seconds,
+                                 progress_interval=args.progress_interval,
+                                 compress=args.compress)
+    corpus_parser.run(args.input)
+
+
+def read_mapping(path):
+    # yaml is only needed for the coarse-to-fine parser
+    import yaml
+
+    with open(path) as f:
+        return CtfMapper(yaml.load(f))
+
+
+def create_chart_pool(args):
+    if args.max_pool_cells > 0:
+        return ChartPool(max_cells=args.max_pool_cells)
+    return None
+
+
+def inside_outside_modes(args):
+    # One mode for all levels or one per level
+    if len(args.inside_outside) == 1:
+        return args.inside_outside[0]
+    return args.inside_outside
+
+
+def create_tree_writer(args):
+    # Write every tree immediately when the parser is used interactively
+    return TreeWriter(output_format=args.format, line_buffered=stdin.isatty())
+
+
+def open_forest_file(args):
+    if args.forest is None:
+        return None
+    return open_forests(args.forest, "w")
+
+
+def write_forest_and_tree(writer, forests, forest, log):
+    write_forest(forests, forest)
+    writer.write_tree(forest.viterbi()[1] if forest is not None else None,
+                      log)
+
+
+def parse_chart_forest(parser, sentence, log):
+    # The forest of the chart of a CKYParser
+    chart = parser.parse(sentence, log)
+    try:
+        return Forest.from_chart(chart, parser.pcfg, sentence)
+    finally:
+        parser.release(chart)
+
+
+def record_statistics(log, statistics, logger=None):
+    # The coarse-to-fine parser logs its statistics itself
+    if logger is not None and logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(log, sort_keys=True))
+    if statistics is not None:
+        statistics.add(log)
+
+
+def parse_line(parse, line):
+    """
+    Parses a line of the input, e.g. in a thread of a ThreadPoolParser.
+    :param parse: Function of the sentence and the log dictionary
+    :return: The result of parse (None if there is no parse) and the log
+    """
+    log = {"sentence": line.strip(), "timestamp": time.time()}
+    try:
+        return parse(line.strip(), log), log
+    except NoParseFoundException:
+        return None, log
+
+
+def parse_with_threads(parser, threads, writer, statistics, logger=None,
+                       forests=None, parse_forest=None):
+    """
+    Parses stdin with a pool of threads. The trees, forests and statistics
+    are written by the calling thread in the order of the input.
+    :param forests: Forest file or None
+    :param parse_forest: Function of the sentence and the log dictionary that
+    returns the forest of a sentence
+    """
+    parse = parser.parse_best if forests is None else parse_forest
+    with ThreadPoolParser(parser, max_workers=threads) as pool:
+        for result, log in pool.parse_stream(
+                stdin, parse=partial(parse_line, parse)):
+            if forests is None:
+                writer.write_tree(result, log)
+            else:
+                write_forest_and_tree(writer, forests, result, log)
+            record_statistics(log, statistics, logger)
 
 
 def ctf():
@@ -25,6 +211,78 @@ def ctf():
     parser.add_argument("--threshold",
                         help="Threshold for coarse-to-fine parsing.",
                         type=float, required=False, default=0.0001)
+    parser.add_argument("--fast_start",
+                        help="Build the coarse levels in the background and "
+                             "parse with the fine grammar alone until they "
+                             "are ready.",
+                        dest='fast_start', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--fallback",
+                        help="If a level finds no parse, parse it again "
+                             "with relaxed thresholds and finally the fine "
+                             "grammar without pruning.",
+                        dest='fallback', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--hot_reload",
+                        help="Reload the grammar and the mapping when the "
+                             "process receives SIGHUP. Sentences are parsed "
+                             "with the old grammars until the new ones are "
+                             "loaded.",
+                        dest='hot_reload', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--skip_levels",
+                        help="Bypass coarse levels whose pruning does not pay "
+                             "off for their inside/outside cost.",
+                        dest='skip_levels', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--inside_outside",
+                        help="Calculate the inside/outside scores of a level "
+                             "over the whole grammar ('exact'), only over "
+                             "the items in its chart ('sparse') or from the "
+                             "best derivations in its chart ('viterbi'). "
+                             "One value or one per level (coarse to fine).",
+                        type=str, required=False, nargs='+',
+                        default=["exact"],
+                        choices=["exact", "sparse", "viterbi"])
+    parser.add_argument("--restrict_grammar",
+                        help="Parse each level only with the rules used in "
+                             "the chart of the previous level.",
+                        dest='restrict_grammar', action='store_true',
+                        required=False, default=False)
+    parser.add_argument("--tag_threshold",
+                        help="Prune preterminals whose posterior is not "
+                             "above this value.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--tag_top_k",
+                        help="Keep only the k best preterminals per word.",
+                        type=int, required=False, default=None)
+    parser.add_argument("--beam",
+                        help="Remove the items of a chart cell whose "
+                             "probability is below this fraction of the "
+                             "best item in the cell.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--max_pool_cells",
+                        help="Maximum number of chart cells kept for reuse "
+                             "(0 disables the chart pool).",
+                        type=int, required=False, default=200000)
+    parser.add_argument("--threads",
+                        help="Parse with this many threads that share the "
+                             "grammars. Input is read in batches.",
+                        type=int, required=False, default=1)
+    parser.add_argument("--format",
+                        help="Output format of the trees. 'jsonl' adds the "
+                             "statistics of every parse.",
+                        type=str, required=False, default="list",
+                        choices=TreeWriter.FORMATS)
+    parser.add_argument("--forest",
+                        help="Also write the pruned chart of every sentence "
+                             "as a packed forest to this JSONL file (.gz for "
+                             "compression).",
+                        type=str, required=False, default=None)
+
+    add_segment_arguments(parser)
+    add_statistics_arguments(parser)
+    add_corpus_arguments(parser)
 
     parser.add_argument("--enable_logs",
                         help="Enable logging to stdout and file.",
@@ -32,32 +290,65 @@ def ctf():
                         required=False, default=False)
 
     args = parser.parse_args()
-
-    if not args.enable_logs:
-        logger = logging.getLogger('CtF Parser')
-        logger.setLevel(logging.ERROR)
+    setup_logging(args.enable_logs)
 
     print("Preparing parser... This can take a few seconds...", file=stderr)
 
-    pcfg = PCFG()
-    pcfg.load_model([json.loads(l) for l in open(args.grammar)])
-    mapping = CtfMapper(yaml.load(open(args.ctfmapping)))
+    def load_parser():
+        pcfg = PCFG()
+        pcfg.load_model([json.loads(l) for l in open(args.grammar)])
+        mapping = read_mapping(args.ctfmapping)
+
+        ctf = CoarseToFineParser(pcfg, mapping,
+                                 threshold=args.threshold,
+                                 skip_levels=args.skip_levels,
+                                 restrict_grammar=args.restrict_grammar,
+                                 tag_threshold=args.tag_threshold,
+                                 tag_top_k=args.tag_top_k,
+                                 chart_pool=create_chart_pool(args),
+                                 inside_outside=inside_outside_modes(args),
+                                 beam=args.beam,
+                                 background=args.fast_start and
+                                 not args.hot_reload,
+                                 fallback=args.fallback)
+        return create_segmenting_parser(ctf, args)
 
-    # Create a hash from the file name so that a transformed grammar can be
-    # saved / read with that prefix. (e.g. tmp_ctf_grammar_11268463_0.pcfg
-    # for a grammar at level 0).
-    filename_hash = int(hashlib.sha1(args.grammar.encode()).hexdigest(), 16
-                        ) % (10 ** 8)
-    ctf = CoarseToFineParser(pcfg, mapping,
-                             prefix=f"tmp_ctf_grammar_{filename_hash}",
-                             threshold=args.threshold)
+    if args.hot_reload:
+        ctf = HotReloadParser(load_parser, refreeze=True)
+        signal.signal(signal.SIGHUP, lambda *_: ctf.reload(wait=False))
+    else:
+        ctf = load_parser()
+    freeze_grammars()
+
+    if args.input is not None:
+        parse_corpus(ctf, args)
+        return
 
     print("Done! Please enter a sentence.\n", file=stderr)
-    for line in stdin:
-        try:
-            print(ctf.parse_best(line.strip()))
-        except NoParseFoundException:
-            print("[]")
+    forests = open_forest_file(args)
+    statistics = create_statistics_sink(args)
+    with create_tree_writer(args) as writer:
+        if args.threads > 1:
+            parse_with_threads(ctf, args.threads, writer, statistics,
+                               forests=forests,
+                               parse_forest=ctf.parse_forest)
+        else:
+            for line in stdin:
+                log = {"sentence": line.strip(), "timestamp": time.time()}
+                if forests is None:
+                    ctf.write_best(line.strip(), writer, log)
+                else:
+                    try:
+                        forest = ctf.parse_forest(line.strip(), log)
+                    except NoParseFoundException:
+                        forest = None
+                    write_forest_and_tree(writer, forests, forest, log)
+                record_statistics(log, statistics)
+
+    if forests is not None:
+        forests.close()
+    if statistics is not None:
+        statistics.close()
 
 
 def cky():
@@ -67,6 +358,40 @@ def cky():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--grammar", help="Path to the grammar to be used.",
                         type=str, required=False, default="data/grammar.pcfg")
+    parser.add_argument("--tag_threshold",
+                        help="Prune preterminals whose posterior is not "
+                             "above this value.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--tag_top_k",
+                        help="Keep only the k best preterminals per word.",
+                        type=int, required=False, default=None)
+    parser.add_argument("--beam",
+                        help="Remove the items of a chart cell whose "
+                             "probability is below this fraction of the "
+                             "best item in the cell.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--max_pool_cells",
+                        help="Maximum number of chart cells kept for reuse "
+                             "(0 disables the chart pool).",
+                        type=int, required=False, default=200000)
+    parser.add_argument("--threads",
+                        help="Parse with this many threads that share the "
+                             "grammars. Input is read in batches.",
+                        type=int, required=False, default=1)
+    parser.add_argument("--format",
+                        help="Output format of the trees. 'jsonl' adds the "
+                             "statistics of every parse.",
+                        type=str, required=False, default="list",
+                        choices=TreeWriter.FORMATS)
+    parser.add_argument("--forest",
+                        help="Also write the pruned chart of every sentence "
+                             "as a packed forest to this JSONL file (.gz for "
+                             "compression).",
+                        type=str, required=False, default=None)
+
+    add_segment_arguments(parser)
+    add_statistics_arguments(parser)
+    add_corpus_arguments(parser)
 
     parser.add_argument("--enable_logs",
                         help="Enable logging to stdout and file.",
@@ -74,24 +399,47 @@ def cky():
                         required=False, default=False)
 
     args = parser.parse_args()
+    setup_logging(args.enable_logs)
     logger = logging.getLogger('CtF Parser')
 
-    if not args.enable_logs:
-        logger.setLevel(logging.ERROR)
-
     print("Preparing parser...", file=stderr)
 
     pcfg = PCFG()
     pcfg.load_model([json.loads(l) for l in open(args.grammar)])
 
-    parser = CKYParser(pcfg)
+    parser = CKYParser(pcfg, tag_threshold=args.tag_threshold,
+                       tag_top_k=args.tag_top_k,
+                       chart_pool=create_chart_pool(args), beam=args.beam)
+    parser = create_segmenting_parser(parser, args)
+    freeze_grammars()
+
+    if args.input is not None:
+        parse_corpus(parser, args)
+        return
 
     print("Done! Please enter a sentence.\n", file=stderr)
-    for line in stdin:
-        try:
-            log = {"sentence": line.strip(), "timestamp": time.time()}
-            tree = parser.parse_best(line.strip(), log)
-            print(tree)
-            logger.info(json.dumps(log, sort_keys=True))
-        except NoParseFoundException:
-            print("[]")
+    forests = open_forest_file(args)
+    statistics = create_statistics_sink(args)
+    with create_tree_writer(args) as writer:
+        if args.threads > 1:
+            parse_with_threads(parser, args.threads, writer, statistics,
+                               logger, forests=forests,
+                               parse_forest=partial(parse_chart_forest,
+                                                    parser))
+        else:
+            for line in stdin:
+                log = {"sentence": line.strip(), "timestamp": time.time()}
+                if forests is None:
+                    parser.write_best(line.strip(), writer, log)
+                else:
+                    try:
+                        forest = parse_chart_forest(parser, line.strip(), log)
+                    except NoParseFoundException:
+                        forest = None
+                    write_forest_and_tree(writer, forests, forest, log)
+                record_statistics(log, statistics, logger)
+
+    if forests is not None:
+        forests.close()
+    if statistics is not None:
+        statistics.close()
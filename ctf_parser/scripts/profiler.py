@@ -0,0 +1,299 @@
+import argparse
+import json
+from collections import Counter
+from itertools import islice
+from sys import stderr, stdout
+
+from ctf_parser import setup_logging
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import NoParseFoundException
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.inside_outside_calculator import \
+    InsideOutsideCalculator, SparseInsideOutsideCalculator
+from ctf_parser.scripts.parser import read_mapping
+
+"""
+Shows which parts of a grammar make parsing expensive.
+
+The static part describes the lookup structures of the CKY parser: how many
+second children every first child can be combined with (fan-out), how many
+first children can precede a symbol (fan-in) and how long the lists of rules
+in id_to_lhs are. The dynamic part parses a sample with the coarse-to-fine
+parser and counts, per level, the symbols entered into and pruned from the
+charts and the rules the inside/outside calculation applies most often.
+"""
+
+
+def rule_name(pcfg, rule):
+    lhs, rhs_1, rhs_2 = rule[:3]
+    symbol = pcfg.get_word_for_id
+    return f"{symbol(lhs)} -> {symbol(rhs_1)} {symbol(rhs_2)}"
+
+
+def grammar_profile(pcfg, top=20):
+    """
+    Statistics of the lookup structures of a grammar.
+    :param pcfg: PCFG
+    :param top: Number of entries in the lists of symbols and rule lists
+    :return: Dictionary
+    """
+    symbol = pcfg.get_word_for_id
+
+    fan_in = Counter()
+    rule_lists = []
+    for rhs_1, second_symbols in pcfg.first_rhs_to_second_rhs.items():
+        for rhs_2 in second_symbols:
+            fan_in[rhs_2] += 1
+            rule_lists.append((len(pcfg.get_lhs(rhs_1, rhs_2)), rhs_1, rhs_2))
+
+    symbols = []
+    for id_ in set(pcfg.first_rhs_to_second_rhs) | set(fan_in):
+        second_symbols = pcfg.first_rhs_to_second_rhs.get(id_, ())
+        symbols.append({
+            "symbol": symbol(id_),
+            "rhs1_fan_out": len(second_symbols),
+            "rhs2_fan_in": fan_in[id_],
+            "lhs_rules": len(pcfg.lhs_to_rhs.get(id_, ())),
+            # Rules the lookup may have to try for an item of this symbol as
+            # the first child
+            "rhs1_rules": sum(len(pcfg.get_lhs(id_, rhs_2))
+                              for rhs_2 in second_symbols)
+        })
+    symbols.sort(key=lambda entry: (-entry["rhs1_rules"], entry["symbol"]))
+
+    sizes = [size for size, _, _ in rule_lists]
+    rule_lists.sort(key=lambda entry: (-entry[0], entry[1], entry[2]))
+
+    return {
+        "symbols": len(pcfg.id_to_word),
+        "binary_rules": len(pcfg.binary_rules),
+        "lexical_rules": len(pcfg.lexical_rules),
+        "first_rhs_symbols": len(pcfg.first_rhs_symbols),
+        "fan_out": symbols[:top],
+        "id_to_lhs": {
+            "binary_lists": len(sizes),
+            "max": max(sizes, default=0),
+            "mean": sum(sizes) / max(len(sizes), 1),
+            "histogram": {str(size): count
+                          for size, count in sorted(Counter(sizes).items())},
+            "largest": [{"rhs": f"{symbol(rhs_1)} {symbol(rhs_2)}",
+                         "rules": size}
+                        for size, rhs_1, rhs_2 in rule_lists[:top]]
+        }
+    }
+
+
+def rule_applications(calculator):
+    """
+    Counts how often the inside/outside calculation of a chart applied
+    every binary rule.
+    :param calculator: Calculator after it has been used for pruning
+    :return: Counter of rule items
+    """
+    pcfg = calculator.pcfg
+    length = calculator.input_length
+    applications = Counter()
+
+    if isinstance(calculator, InsideOutsideCalculator):
+        # Every computed score is a sum over the rules and split points of
+        # its symbol.
+        for symbol, start, end in calculator.inside_cache:
+            if start < end:
+                for rule in pcfg.lhs_to_rhs.get(symbol, ()):
+                    applications[rule] += end - start
+        for symbol, start, end in calculator.outside_cache:
+            for rule in pcfg.rhs1_to_rule.get(symbol, ()):
+                applications[rule] += length - 1 - end
+            for rule in pcfg.rhs2_to_rule.get(symbol, ()):
+                applications[rule] += start
+        return applications
+
+    if isinstance(calculator, SparseInsideOutsideCalculator):
+        for span_edges in calculator.edges.values():
+            for lhs, rhs_1, rhs_2, _, prob in span_edges:
+                applications[(lhs, rhs_1, rhs_2, prob)] += 1
+        return applications
+
+    # Viterbi: the edges of all items with an outside score
+    chart = calculator.chart
+    outside = calculator.outside_cache
+    for (symbol, i, j) in list(outside):
+        for k in range(i, j):
+            for rhs_1 in pcfg.first_rhs_symbols.intersection(chart[i][k]):
+                for rhs_2 in pcfg.first_rhs_to_second_rhs[
+                        rhs_1].intersection(chart[k + 1][j]):
+                    for rule in pcfg.get_lhs(rhs_1, rhs_2):
+                        if rule[0] == symbol:
+                            applications[rule] += 1
+    return applications
+
+
+class GrammarProfiler:
+    """
+    Observer of a CoarseToFineParser that counts per level which symbols are
+    entered into the charts and pruned, and which rules the inside/outside
+    calculation applies.
+    """
+
+    def __init__(self):
+        self.grammars = {}
+        self.produced = {}
+        self.pruned = {}
+        self.rules = {}
+
+    def evaluation_function(self, level, grammar, evaluate):
+        """
+        Wraps the evaluation function of a level to count pruned items.
+        """
+        self.grammars[level] = grammar
+        pruned = self.pruned.setdefault(level, Counter())
+
+        def counting_evaluate(item):
+            if evaluate(item):
+                return True
+            pruned[item[0]] += 1
+            return False
+
+        return counting_evaluate
+
+    def level_parsed(self, level, grammar, chart):
+        """
+        Counts the items in the chart of a level.
+        """
+        produced = self.produced.setdefault(level, Counter())
+        for row in chart:
+            for cell in row:
+                produced.update(cell.keys())
+
+    def scores_used(self, level, calculator):
+        """
+        Counts the rule applications of the inside/outside calculator of a
+        level after the next level has been pruned with it.
+        """
+        self.rules.setdefault(level, Counter()).update(
+            rule_applications(calculator))
+
+    def report(self, top=20):
+        """
+        :return: List with the statistics of every level
+        """
+        levels = []
+        for level in sorted(self.produced):
+            grammar = self.grammars[level]
+            symbol = grammar.get_word_for_id
+            pruned = self.pruned.get(level, Counter())
+            rules = self.rules.get(level, Counter())
+
+            levels.append({
+                "level": level,
+                "items_produced": sum(self.produced[level].values()),
+                "items_pruned": sum(pruned.values()),
+                "produced": [{"symbol": symbol(id_), "items": count}
+                             for id_, count in
+                             self.produced[level].most_common(top)],
+                "pruned": [{"symbol": symbol(id_), "items": count}
+                           for id_, count in pruned.most_common(top)],
+                "rule_applications": sum(rules.values()),
+                "inside_outside_rules": [
+                    {"rule": rule_name(grammar, rule),
+                     "applications": count,
+                     "share": count / sum(rules.values())}
+                    for rule, count in rules.most_common(top)]
+            })
+        return levels
+
+
+def profile_sample(pcfg, mapping, sentences, top=20, **parser_arguments):
+    """
+    Parses a sample with the coarse-to-fine parser and profiles its levels.
+    :param pcfg: The fine grammar
+    :param mapping: CtfMapper
+    :param sentences: List of sentences
+    :param top: Number of entries in every list
+    :param parser_arguments: Further arguments for the CoarseToFineParser
+    :return: Dictionary
+    """
+    profiler = GrammarProfiler()
+    parser = CoarseToFineParser(pcfg, mapping, observer=profiler,
+                                **parser_arguments)
+
+    no_parse = 0
+    for sentence in sentences:
+        try:
+            parser.release(parser.parse(sentence))
+        except NoParseFoundException:
+            no_parse += 1
+
+    return {
+        "sentences": len(sentences),
+        "no_parse": no_parse,
+        "grammars": [grammar_profile(grammar, top)
+                     for grammar in parser.grammars],
+        "levels": profiler.report(top)
+    }
+
+
+def profile():
+    parser = argparse.ArgumentParser(
+        "ctfprofile", description="Reports which symbols and rules of a "
+                                  "grammar make parsing expensive (JSON).",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--grammar", help="Path to the grammar to be used.",
+                        type=str, required=False, default="data/grammar.pcfg")
+    parser.add_argument("--ctfmapping",
+                        help="Path to the coarse-to-fine symbol mapping file.",
+                        type=str, required=False,
+                        default="data/ctf_mapping.yml")
+    parser.add_argument("--sentences",
+                        help="File with one sentence per line to profile the "
+                             "levels on. Without it, only the grammar is "
+                             "profiled.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--sample",
+                        help="Number of sentences to parse.",
+                        type=int, required=False, default=50)
+    parser.add_argument("--threshold",
+                        help="Threshold for coarse-to-fine parsing.",
+                        type=float, required=False, default=0.0001)
+    parser.add_argument("--inside_outside",
+                        help="Inside/outside mode of all levels.",
+                        type=str, required=False, default="exact",
+                        choices=["exact", "sparse", "viterbi"])
+    parser.add_argument("--top",
+                        help="Number of entries in every list.",
+                        type=int, required=False, default=20)
+    parser.add_argument("--output",
+                        help="Write the JSON report to this file instead of "
+                             "stdout.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--enable_logs",
+                        help="Enable logging to stdout and file.",
+                        dest='enable_logs', action='store_true',
+                        required=False, default=False)
+
+    args = parser.parse_args()
+    setup_logging(args.enable_logs)
+
+    pcfg = PCFG()
+    pcfg.load_model([json.loads(l) for l in open(args.grammar)])
+
+    if args.sentences is None:
+        report = {"grammars": [grammar_profile(pcfg, args.top)]}
+    else:
+        with open(args.sentences) as f:
+            sentences = [line.strip() for line in islice(f, args.sample)]
+        sentences = [sentence for sentence in sentences if sentence]
+
+        print(f"Parsing {len(sentences)} sentences...", file=stderr)
+        report = profile_sample(pcfg, read_mapping(args.ctfmapping),
+                                sentences, args.top,
+                                threshold=args.threshold,
+                                inside_outside=args.inside_outside)
+
+    if args.output is None:
+        json.dump(report, stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote the profile to {args.output}.", file=stderr)
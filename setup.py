@@ -11,7 +11,11 @@ setup(
     entry_points={
           'console_scripts': [
               'ctfparser = ctf_parser.scripts.parser:ctf',
-              'ckyparser = ctf_parser.scripts.parser:cky'
+              'ckyparser = ctf_parser.scripts.parser:cky',
+              'ctfhierarchy = ctf_parser.scripts.hierarchy:hierarchy',
+              'ctfcoordinator = ctf_parser.scripts.distributed:coordinator',
+              'ctfworker = ctf_parser.scripts.distributed:worker',
+              'ctfprofile = ctf_parser.scripts.profiler:profile'
           ]
       }
 )
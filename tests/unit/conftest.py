@@ -0,0 +1,71 @@
+import copy
+
+import pytest
+import yaml
+from ctf_parser.grammar.pcfg import PCFG
+
+"""
+The toy grammar most tests parse with. The PP of "Peter sees a squirrel with
+the telescope" attaches either to the verb phrase or to the noun phrase, and
+the mapping projects the grammar to three coarser levels.
+"""
+
+TOY_GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.3],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "Det", "a", 0.5],
+    ["Q1", "Det", "the", 0.5],
+    ["Q1", "N", "squirrel", 0.5],
+    ["Q1", "N", "telescope", 0.5],
+    ["Q1", "IN", "with", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 0.6],
+    ["Q2", "VP", "VP", "PP", 0.4],
+    ["Q2", "NP", "Det", "N", 0.5],
+    ["Q2", "NP", "NP", "PP", 0.2],
+    ["Q2", "PP", "IN", "NP", 1.0],
+    ["WORDS", ["Peter", "a", "sees", "squirrel", "the", "telescope",
+               "with"]]
+]
+
+TOY_MAPPING = """
+P:
+  HP:
+    S_:
+      - S
+      - VP
+    N_:
+      - NP
+  MP:
+    P_:
+      - PP
+"""
+
+
+@pytest.fixture
+def toy_grammar():
+    """
+    The toy grammar in the raw format. Tests may change their copy.
+    """
+    return copy.deepcopy(TOY_GRAMMAR)
+
+
+@pytest.fixture
+def toy_mapping():
+    """
+    The coarse-to-fine mapping of the toy grammar as a dictionary.
+    """
+    return yaml.load(TOY_MAPPING)
+
+
+@pytest.fixture
+def create_toy_pcfg(toy_grammar):
+    """
+    Creates a new PCFG from the toy grammar (or the given model).
+    """
+    def create_pcfg(model=None, **kwargs):
+        pcfg = PCFG(**kwargs)
+        pcfg.load_model(toy_grammar if model is None else model)
+        return pcfg
+
+    return create_pcfg
@@ -0,0 +1,62 @@
+from ctf_parser.grammar.hierarchy import base_label, learn_hierarchy, \
+    phrase_labels
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.scripts.hierarchy import score_hierarchy
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.3],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "Det", "a", 0.5],
+    ["Q1", "Det", "the", 0.5],
+    ["Q1", "N", "squirrel", 0.5],
+    ["Q1", "N", "telescope", 0.5],
+    ["Q1", "IN", "with", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 0.5],
+    ["Q2", "VP", "VP", "PP", 0.3],
+    ["Q2", "VP", "VP†V", "PP", 0.2],
+    ["Q2", "VP†V", "V", "NP", 1.0],
+    ["Q2", "NP", "Det", "N", 0.5],
+    ["Q2", "NP", "NP", "PP", 0.2],
+    ["Q2", "PP", "IN", "NP", 1.0],
+    ["WORDS", ["Peter", "a", "sees", "squirrel", "the", "telescope",
+               "with"]]
+]
+
+
+def create_pcfg():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    return pcfg
+
+
+def test_phrase_labels():
+    assert base_label("S‡VP†VBD") == "S"
+    assert phrase_labels(create_pcfg()) == ["NP", "PP", "S", "VP"]
+
+
+def test_learn_hierarchy():
+    mapping = learn_hierarchy(create_pcfg(), [1, 2])
+
+    assert len(mapping) == 1
+    level_1 = list(mapping.values())[0]
+    assert len(level_1) == 2
+    assert sorted(label for labels in level_1.values()
+                  for label in labels) == ["NP", "PP", "S", "VP"]
+
+    mapper = CtfMapper(mapping)
+    assert mapper.levels == 1
+    assert set(mapper.fine_to_coarse[1]) == {"NP", "PP", "S", "VP"}
+
+
+def test_score_hierarchy():
+    pcfg = create_pcfg()
+    mapping = learn_hierarchy(pcfg, [1, 2])
+
+    score = score_hierarchy(pcfg, mapping,
+                            ["Peter sees a squirrel with the telescope"])
+
+    assert score['levels'] == 2
+    assert score['no_parse'] == 0
+    assert 0.0 <= score['pruning_rate'] <= 1.0
@@ -1,6 +1,7 @@
 import yaml
 from ctf_parser.grammar.pcfg import PCFG
-from ctf_parser.grammar.transform import transform, transform_to_new_grammar
+from ctf_parser.grammar.transform import project_grammar, transform, \
+    transform_to_new_grammar
 from ctf_parser.parser.ctf_mapper import CtfMapper
 
 GRAMMAR = [
@@ -33,15 +34,60 @@ def test_transform_once():
     mapping = CtfMapper(yaml.load(MAPPING))
     new_grammar = transform(pcfg, mapping, level=2)
 
-    assert new_grammar == [['Q1', 'V', 'Peter', 1.0],
-                           ['Q1', 'Det', 'sees', 1.0], ['Q1', 'N', 'a', 1.0],
-                           ['Q1', 'Peter', 'squirrel', 1.0],
-                           ['Q2', 'S_', 'N_', 'S_', 0.6666666666666666],
-                           ['Q2', 'S_', 'Det', 'N', 0.3333333333333333],
-                           ['Q2', 'N_', 'V', 'N_', 1.0],
+    assert new_grammar == [['Q1', 'N_', 'Peter', 0.5],
+                           ['Q1', 'V', 'sees', 1.0], ['Q1', 'Det', 'a', 1.0],
+                           ['Q1', 'N', 'squirrel', 1.0],
+                           ['Q2', 'S_', 'N_', 'S_', 0.5],
+                           ['Q2', 'S_', 'V', 'N_', 0.5],
+                           ['Q2', 'N_', 'Det', 'N', 0.5],
                            ['WORDS', ['Peter', 'a', 'sees', 'squirrel']]]
 
 
+def test_merged_rules_are_summed():
+    pcfg = PCFG()
+    pcfg.load_model([
+        ["Q1", "NP", "Peter", 1.0],
+        ["Q1", "V", "sees", 1.0],
+        ["Q2", "S", "NP", "VP", 1.0],
+        ["Q2", "VP", "NP", "VP", 0.4],
+        ["Q2", "VP", "V", "NP", 0.6],
+        ["WORDS", ["Peter", "sees"]]
+    ])
+
+    mapping = CtfMapper(yaml.load(MAPPING))
+    new_grammar = project_grammar(pcfg, mapping, level=2)
+    symbol = new_grammar.get_id_for_word
+
+    # S -> NP VP and VP -> NP VP are both projected to S_ -> N_ S_
+    rules = new_grammar.get_lhs(symbol("N_"), symbol("S_"))
+    assert len(rules) == 1
+    assert rules[0][:3] == (symbol("S_"), symbol("N_"), symbol("S_"))
+    assert abs(rules[0][3] - 0.7) < 1e-9
+
+    rules = new_grammar.get_lhs(symbol("V"), symbol("N_"))
+    assert abs(rules[0][3] - 0.3) < 1e-9
+
+
+def test_projection_equals_raw_grammar():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    mapping = CtfMapper(yaml.load(MAPPING))
+
+    projected = project_grammar(pcfg, mapping, level=2)
+    loaded = PCFG()
+    loaded.load_model(transform(pcfg, mapping, level=2))
+
+    def rules(grammar):
+        symbol = grammar.get_word_for_id
+        return sorted(tuple(symbol(s) for s in rule[:-1]) + (rule[-1],)
+                      for rule_list in grammar.id_to_lhs
+                      for rule in rule_list)
+
+    assert rules(projected) == rules(loaded)
+    assert projected.well_known_words == loaded.well_known_words
+    assert projected.get_word_for_id(projected.start_symbol) == "S"
+
+
 def test_dummy_grammar_creation():
     pcfg = PCFG()
     pcfg.load_model(GRAMMAR)
@@ -0,0 +1,50 @@
+import gc
+
+from ctf_parser.parser.chart_pool import ChartPool
+
+
+def test_acquire_release():
+    pool = ChartPool(bucket_size=4)
+
+    chart = pool.acquire(3)
+    assert len(chart) == 3
+    assert all(len(row) == 3 for row in chart)
+
+    chart[0][2]["item"] = 1
+    cell = chart[0][2]
+    pool.release(chart)
+    assert cell == {}
+
+    chart = pool.acquire(4)
+    assert chart[0][2] is cell
+    assert pool.hits == 1
+    assert pool.misses == 1
+
+
+def test_max_cells():
+    pool = ChartPool(max_cells=20, bucket_size=4)
+
+    charts = [pool.acquire(4), pool.acquire(2)]
+    for chart in charts:
+        pool.release(chart)
+
+    assert pool.cells == 16
+    assert sum(len(buffers) for buffers in pool.buffers.values()) == 1
+
+
+def test_dropped_charts_are_not_tracked():
+    pool = ChartPool(bucket_size=4)
+
+    chart = pool.acquire(3)
+    assert list(pool.in_use.values()) == [chart]
+
+    # E.g. a parse that failed with an exception
+    del chart
+    gc.collect()
+    assert len(pool.in_use) == 0
+
+    # A chart that is not from the pool is only cleared
+    chart = [[{"item": 1}]]
+    pool.release(chart)
+    assert chart == [[{}]]
+    assert pool.cells == 0
@@ -0,0 +1,169 @@
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "NP", "saw", 0.1],
+    ["Q1", "V", "saw", 0.5],
+    ["Q1", "V", "sees", 0.4],
+    ["Q1", "V", "runs", 0.1],
+    ["Q1", "Det", "a", 1.0],
+    ["Q1", "N", "squirrel", 0.5],
+    ["Q1", "N", "saw", 0.3],
+    ["Q1", "N", "dog", 0.2],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["Q2", "NP", "Det", "N", 0.4],
+    ["WORDS", ["Peter", "a", "dog", "runs", "saw", "sees", "squirrel"]]
+]
+
+SENTENCE = "Peter saw a squirrel"
+
+TREE = ['S', ['NP', 'Peter'],
+        ['VP', ['V', 'saw'], ['NP', ['Det', 'a'], ['N', 'squirrel']]]]
+
+
+def create_pcfg():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    return pcfg
+
+
+def test_parse_best():
+    parser = CKYParser(create_pcfg())
+
+    statistics = {}
+    assert parser.parse_best(SENTENCE, statistics) == TREE
+    assert statistics['tags_kept'] == 6
+    assert statistics['tags_pruned'] == 0
+
+
+def test_tag_top_k():
+    parser = CKYParser(create_pcfg(), tag_top_k=1)
+
+    statistics = {}
+    assert parser.parse_best(SENTENCE, statistics) == TREE
+    assert statistics['tags_kept'] == 4
+    assert statistics['tags_pruned'] == 2
+
+
+def test_tag_threshold():
+    pcfg = create_pcfg()
+    posteriors = {pcfg.get_id_for_word("N"): 0.5,
+                  pcfg.get_id_for_word("V"): 0.4}
+    parser = CKYParser(pcfg, tag_threshold=0.3,
+                       tag_posterior_function=lambda tag, _:
+                       posteriors.get(tag, 0.0))
+
+    chart = parser.parse(SENTENCE)
+
+    # The best tag is kept even if its posterior is below the threshold.
+    assert [len(chart[i][i]) for i in range(4)] == [1, 2, 1, 1]
+
+
+def test_parse_kbest_unambiguous():
+    pcfg = create_pcfg()
+    parser = CKYParser(pcfg)
+
+    trees = parser.parse_kbest(SENTENCE, 5)
+
+    assert len(trees) == 1
+    assert trees[0][1] == parser.parse_best(SENTENCE)
+    assert trees[0][0] == parser.parse(SENTENCE)[0][3][
+        pcfg.start_symbol].probability
+
+
+def test_lexical_cells():
+    pcfg = create_pcfg()
+    parser = CKYParser(pcfg)
+    saw = pcfg.get_id_for_word("saw")
+
+    # Ordered by probability
+    assert [pcfg.get_word_for_id(rule[0]) for rule in pcfg.lexicon[saw]] == \
+        ["V", "N", "NP"]
+
+    first = parser.parse(SENTENCE)
+    second = parser.parse("Peter saw a dog")
+    v = pcfg.get_id_for_word("V")
+    assert first[1][1][v] is second[1][1][v]
+    assert parser.parse_words(["Peter", "saw", "a", "squirrel"])[0][3][
+        pcfg.start_symbol].probability == \
+        first[0][3][pcfg.start_symbol].probability
+
+    # The cells are built once per grammar
+    assert CKYParser(pcfg).lexical_cells is parser.lexical_cells
+    assert CKYParser(create_pcfg()).lexical_cells is not parser.lexical_cells
+
+
+AMBIGUOUS_GRAMMAR = GRAMMAR[:-1] + [
+    ["Q1", "P", "with", 1.0],
+    ["Q2", "PP", "P", "NP", 1.0],
+    ["Q2", "NP", "NP", "PP", 0.5],
+    ["Q2", "VP", "VP", "PP", 0.3],
+    ["Q2", "X", "Det", "N", 0.02],
+    ["WORDS", ["Peter", "a", "dog", "runs", "saw", "sees", "squirrel",
+               "with"]]
+]
+
+
+def test_sorted_rules():
+    pcfg = PCFG()
+    pcfg.load_model(AMBIGUOUS_GRAMMAR)
+    det = pcfg.get_id_for_word("Det")
+    n = pcfg.get_id_for_word("N")
+
+    # Best rule first
+    assert [pcfg.get_word_for_id(rule[0])
+            for rule in pcfg.get_lhs(det, n)] == ["NP", "X"]
+    assert pcfg.max_rule_probability[det] == 0.4
+
+
+def test_beam():
+    pcfg = PCFG()
+    pcfg.load_model(AMBIGUOUS_GRAMMAR)
+    sentence = "Peter saw a dog with a squirrel"
+
+    statistics = {}
+    tree = CKYParser(pcfg).parse_best(sentence, statistics)
+    assert 'items_beam_pruned' not in statistics
+
+    parser = CKYParser(pcfg, beam=0.1)
+    beam_statistics = {}
+    assert parser.parse_best(sentence, beam_statistics) == tree
+    assert beam_statistics['items_beam_pruned'] == 2
+
+    # X is far below NP in both cells of 'a ...'
+    chart = parser.parse(sentence)
+    x = pcfg.get_id_for_word("X")
+    assert x not in chart[2][3] and x not in chart[5][6]
+
+
+# Both splits of "a b c" produce X and Y, the first one with higher scores
+CUTOFF_GRAMMAR = [
+    ["Q1", "A", "a", 1.0],
+    ["Q1", "B", "b", 1.0],
+    ["Q1", "C", "c", 1.0],
+    ["Q2", "BC", "B", "C", 1.0],
+    ["Q2", "AB", "A", "B", 0.1],
+    ["Q2", "X", "A", "BC", 0.6],
+    ["Q2", "Y", "A", "BC", 0.4],
+    ["Q2", "X", "AB", "C", 0.7],
+    ["Q2", "Y", "AB", "C", 0.3],
+    ["WORDS", ["a", "b", "c"]]
+]
+
+
+def test_lookup_cutoff():
+    pcfg = PCFG()
+    pcfg.load_model(CUTOFF_GRAMMAR)
+    symbol = pcfg.get_id_for_word
+
+    statistics = {}
+    chart = CKYParser(pcfg).parse("a b c", statistics)
+
+    # X -> AB C cannot beat the weakest item of the cell, and Y is already
+    # in it, so Y -> AB C is skipped
+    assert statistics['candidates_cut'] == 1
+    assert statistics['candidates_generated'] == 4
+    assert chart[0][2][symbol("X")].probability == 0.6
+    assert chart[0][2][symbol("Y")].probability == 0.4
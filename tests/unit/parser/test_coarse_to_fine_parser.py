@@ -0,0 +1,216 @@
+import threading
+
+import pytest
+import yaml
+from ctf_parser.grammar import transform
+from ctf_parser.parser.chart_pool import ChartPool
+from ctf_parser.parser.cky_parser import CKYParser, NoParseFoundException
+from ctf_parser.parser import coarse_to_fine_parser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+
+FLAT_MAPPING = """
+HP:
+  - S
+  - VP
+  - NP
+  - PP
+"""
+
+SENTENCE = "Peter sees a squirrel with the telescope"
+
+
+@pytest.fixture
+def create_parser(tmpdir, create_toy_pcfg, toy_mapping):
+    def create(mapping=None, **kwargs):
+        mapping = toy_mapping if mapping is None else yaml.load(mapping)
+        return CoarseToFineParser(create_toy_pcfg(), CtfMapper(mapping),
+                                  prefix=str(tmpdir.join("grammar")),
+                                  **kwargs)
+
+    return create
+
+
+@pytest.fixture
+def cky_tree(create_toy_pcfg):
+    return CKYParser(create_toy_pcfg()).parse_best(SENTENCE)
+
+
+def test_start_symbols_are_projected(create_parser):
+    parser = create_parser()
+
+    assert [g.get_word_for_id(g.start_symbol) for g in parser.grammars] == \
+        ["P", "HP", "S_", "S"]
+
+
+def test_explicit_start_symbols(create_parser, cky_tree):
+    parser = create_parser(start_symbols=["P", "HP", "S_", "S"])
+
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_parse_best(create_parser, cky_tree):
+    parser = create_parser()
+
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_flat_mapping(create_parser, cky_tree):
+    parser = create_parser(mapping=FLAT_MAPPING)
+
+    assert len(parser.grammars) == 2
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_skip_levels(create_parser, cky_tree):
+    parser = create_parser(skip_levels=True, warmup=1,
+                           min_effectiveness=float("inf"))
+
+    statistics = {}
+    parser.parse(SENTENCE, log_dict=statistics)
+    assert statistics['skipped_levels'] == []
+    assert all(e is not None for e in statistics['effectiveness'])
+
+    statistics = {}
+    parser.parse(SENTENCE, log_dict=statistics)
+    assert statistics['skipped_levels'] == [0, 1, 2]
+
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_restrict_grammar(create_parser, cky_tree):
+    parser = create_parser(restrict_grammar=True)
+
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_restricted_rules(create_parser):
+    parser = create_parser()
+    coarse = parser.grammars[2]
+    chart = CKYParser(coarse).parse("Peter sees a squirrel")
+
+    coarse_rules, support = parser.chart_rules(chart, coarse)
+    grammar = parser.restrict(3, 2, coarse_rules)
+
+    symbol = parser.grammars[3].get_id_for_word
+    assert grammar.size == 3
+    assert grammar.get_lhs(symbol("V"), symbol("NP")) != []
+    assert grammar.get_lhs(symbol("NP"), symbol("PP")) == []
+    assert coarse.get_id_for_word("S_") in support[0][3]
+
+
+def test_chart_pool(create_parser, cky_tree):
+    pool = ChartPool()
+    parser = create_parser(chart_pool=pool)
+
+    assert parser.parse_best(SENTENCE) == cky_tree
+    assert parser.parse_best(SENTENCE) == cky_tree
+    assert pool.in_use == {}
+    assert pool.hits > 0
+
+
+def test_parse_kbest(create_parser, cky_tree, create_toy_pcfg):
+    trees = CKYParser(create_toy_pcfg()).parse_kbest(SENTENCE, 5)
+
+    # The PP attaches either to the verb phrase or to the noun phrase
+    assert len(trees) == 2
+    assert trees[0][0] > trees[1][0]
+    assert trees[0][1] == cky_tree
+    assert trees[1][1] != cky_tree
+
+    parser = create_parser()
+    assert parser.parse_kbest(SENTENCE, 1) == trees[:1]
+
+
+def test_sparse_inside_outside(create_parser, cky_tree):
+    parser = create_parser(inside_outside="sparse")
+
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+    parser = create_parser(inside_outside=["sparse", "exact", "sparse",
+                                           "exact"])
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_viterbi_inside_outside(create_parser, cky_tree):
+    parser = create_parser(inside_outside="viterbi")
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+    parser = create_parser(inside_outside=["viterbi", "exact", "sparse",
+                                           "exact"])
+    assert parser.parse_best(SENTENCE) == cky_tree
+
+
+def test_background_levels(monkeypatch, create_parser, cky_tree):
+    # The coarse levels are only built once the test allows it
+    release = threading.Event()
+
+    def transform_to_new_grammar(*args, **kwargs):
+        release.wait(10)
+        return transform.transform_to_new_grammar(*args, **kwargs)
+
+    monkeypatch.setattr(coarse_to_fine_parser, "transform_to_new_grammar",
+                        transform_to_new_grammar)
+    parser = create_parser(background=True)
+
+    # Parsed with the fine grammar alone
+    assert not parser.wait_until_ready(0.01)
+    statistics = {}
+    chart = parser.parse(SENTENCE, statistics)
+    assert parser.parsers[-1].get_best_from_chart(chart) == cky_tree
+    assert not statistics['levels_ready']
+    assert len(parser.grammars) == 1
+
+    release.set()
+    assert parser.wait_until_ready(10)
+    assert parser.build_time > 0.0
+
+    statistics = {}
+    chart = parser.parse(SENTENCE, statistics)
+    assert parser.parsers[-1].get_best_from_chart(chart) == cky_tree
+    assert statistics['levels_ready']
+    assert [g.get_word_for_id(g.start_symbol) for g in parser.grammars] == \
+        ["P", "HP", "S_", "S"]
+
+
+def test_fallback(create_parser, cky_tree):
+    # Nothing passes a threshold above 1, so level 1 finds no parse
+    thresholds = [0.0, 2.0, 0.0, 0.0]
+    parser = create_parser(threshold=thresholds,
+                           inside_outside="sparse")
+    with pytest.raises(NoParseFoundException):
+        parser.parse_best(SENTENCE)
+
+    pool = ChartPool()
+    parser = create_parser(threshold=thresholds,
+                           inside_outside="sparse", fallback=True,
+                           chart_pool=pool)
+    statistics = {}
+    assert parser.parse_best(SENTENCE, statistics) == cky_tree
+    assert statistics['fallback'] == [{"level": 1, "threshold": 0.02}]
+    assert pool.in_use == {}
+    # The retry is counted apart from the cascade
+    for key in coarse_to_fine_parser.COUNTERS:
+        assert statistics[f"fallback_{key}"] >= 0
+    assert statistics["fallback_cells_visited"] > 0
+
+    # The finest level without pruning is the last resort
+    parser.relaxed_thresholds = lambda threshold: []
+    statistics = {}
+    assert parser.parse_best(SENTENCE, statistics) == cky_tree
+    assert statistics['fallback'] == [
+        {"level": 3, "threshold": None, "unpruned": True}]
+    assert pool.in_use == {}
+    unpruned = {}
+    parser.release(parser.parsers[-1].parse(SENTENCE, unpruned))
+    assert {key: statistics[f"fallback_{key}"]
+            for key in coarse_to_fine_parser.COUNTERS} == \
+        {key: unpruned[key] for key in coarse_to_fine_parser.COUNTERS}
+    assert not [key for key in statistics if key.startswith("fallback_io_")]
+
+    # Without any parse, every step is tried
+    statistics = {}
+    with pytest.raises(NoParseFoundException):
+        create_parser(fallback=True).parse_best("sees Peter", statistics)
+    assert [step["threshold"] for step in statistics['fallback']] == \
+        [1e-06, 1e-08, 0.0, None]
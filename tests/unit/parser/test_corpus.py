@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.corpus import CorpusParser
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "NP", "Mary", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "Det", "a", 1.0],
+    ["Q1", "N", "squirrel", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["Q2", "NP", "Det", "N", 0.5],
+    ["WORDS", ["Mary", "Peter", "a", "sees", "squirrel"]]
+]
+
+SENTENCES = ["Peter sees a squirrel", "Mary sees Peter", "", "sees Mary",
+             "a squirrel sees Mary", "Peter sees Mary"]
+
+
+class FailingParser(CKYParser):
+
+    def __init__(self, pcfg, fail_at):
+        super().__init__(pcfg)
+        self.fail_at = fail_at
+
+    def write_best(self, sentence, writer, log_dict=None, context=None):
+        if sentence == self.fail_at:
+            raise RuntimeError("Parser crashed")
+        super().write_best(sentence, writer, log_dict, context)
+
+
+def create_inputs(tmpdir):
+    plain = str(tmpdir.join("a.txt"))
+    with open(plain, "w") as f:
+        f.write("\n".join(SENTENCES[:4]) + "\n")
+
+    compressed = str(tmpdir.join("b.txt.gz"))
+    with gzip.open(compressed, "wt") as f:
+        f.write("\n".join(SENTENCES[4:]) + "\n")
+
+    return [plain, compressed]
+
+
+def read_output(output_dir, manifest):
+    lines = []
+    for shard in manifest["shards"]:
+        with open(os.path.join(output_dir, shard["name"])) as f:
+            lines.extend(json.loads(line) for line in f)
+    return lines
+
+
+def test_corpus(tmpdir):
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    inputs = create_inputs(tmpdir)
+    output_dir = str(tmpdir.join("parsed"))
+
+    manifest = CorpusParser(CKYParser(pcfg), output_dir,
+                            shard_sentences=4).run(inputs)
+
+    assert manifest["finished"]
+    assert [shard["sentences"] for shard in manifest["shards"]] == [4, 2]
+    assert manifest["shards"][0]["no_parse"] == 2
+
+    lines = read_output(output_dir, manifest)
+    assert [line["statistics"]["sentence"] for line in lines] == SENTENCES
+    assert lines[0]["tree"][0] == "S"
+    assert lines[2]["tree"] is None
+    assert lines[4]["statistics"]["file"] == 1
+    assert lines[4]["statistics"]["items_entered"] > 0
+
+
+def test_resume(tmpdir):
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    inputs = create_inputs(tmpdir)
+    output_dir = str(tmpdir.join("parsed"))
+
+    parser = FailingParser(pcfg, fail_at="a squirrel sees Mary")
+    with pytest.raises(RuntimeError):
+        CorpusParser(parser, output_dir, shard_sentences=2).run(inputs)
+
+    with open(os.path.join(output_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    assert manifest["position"] == {"file": 0, "line": 4}
+    assert not manifest["finished"]
+
+    manifest = CorpusParser(CKYParser(pcfg), output_dir,
+                            shard_sentences=2).run(inputs)
+
+    lines = read_output(output_dir, manifest)
+    assert [line["statistics"]["sentence"] for line in lines] == SENTENCES
+    assert sorted(os.listdir(output_dir)) == [
+        "manifest.json", "shard-00000.jsonl", "shard-00001.jsonl",
+        "shard-00002.jsonl"]
@@ -0,0 +1,242 @@
+import io
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.distributed import Coordinator, connect, \
+    parse_unit, receive_message, run_worker, send_message, work_units
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "NP", "Mary", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "Det", "a", 1.0],
+    ["Q1", "N", "squirrel", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["Q2", "NP", "Det", "N", 0.5],
+    ["WORDS", ["Mary", "Peter", "a", "sees", "squirrel"]]
+]
+
+SENTENCES = ["Peter sees a squirrel", "Mary sees Peter", "", "sees Mary",
+             "a squirrel sees Mary", "Peter sees Mary"] * 5
+
+
+def create_parser():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    return CKYParser(pcfg)
+
+
+class FlakyParser(CKYParser):
+    """
+    Fails the first times it sees a sentence.
+    """
+
+    def __init__(self, pcfg, sentence, failures):
+        super().__init__(pcfg)
+        self.sentence = sentence
+        self.failures = failures
+
+    def write_best(self, sentence, writer, log_dict=None, context=None):
+        if sentence == self.sentence and self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("Parser crashed")
+        super().write_best(sentence, writer, log_dict, context)
+
+
+def start_worker(address, name, crash=False, started=None):
+    parser = create_parser()
+    if crash:
+        # The process dies while it works on its first unit
+        parser.write_best = lambda *args: os._exit(1)
+    if started is not None:
+        started.set()
+    run_worker(parser, address, name)
+
+
+def expected_output():
+    return parse_unit(create_parser(), SENTENCES, "jsonl")
+
+
+def trees(output):
+    return [json.loads(line)["tree"] for line in output.splitlines()]
+
+
+def run_coordinator(coordinator, output):
+    thread = threading.Thread(target=coordinator.run,
+                              args=(SENTENCES, output))
+    thread.start()
+    return thread
+
+
+def test_work_units_are_length_aware():
+    sentences = ["a b", "a b", "a b c d e f", "a", "a b"]
+    units = list(work_units(sentences, unit_cost=20))
+
+    # The long sentence (cost 216) gets a unit of its own
+    assert [unit.sentences for unit in units] == [
+        ["a b", "a b"], ["a b c d e f"], ["a", "a b"]]
+    assert [unit.id for unit in units] == [0, 1, 2]
+    assert units[1].cost == 216
+
+
+def test_worker_processes():
+    context = multiprocessing.get_context("spawn")
+    output = io.StringIO()
+
+    with Coordinator(unit_cost=30) as coordinator:
+        # A worker that comes after all units are written cannot connect,
+        # so the coordinator starts when all workers are about to connect
+        started = [context.Event() for _ in range(3)]
+        workers = [context.Process(target=start_worker,
+                                   args=(coordinator.address, f"worker-{i}",
+                                         False, event))
+                   for i, event in enumerate(started)]
+        for worker in workers:
+            worker.start()
+        for event in started:
+            assert event.wait(60)
+
+        thread = run_coordinator(coordinator, output)
+        for worker in workers:
+            worker.join(60)
+            assert worker.exitcode == 0
+        thread.join(60)
+
+    assert trees(output.getvalue()) == trees(expected_output())
+    assert coordinator.statistics["sentences"] == len(SENTENCES)
+    assert sum(worker["sentences"] for worker in
+               coordinator.statistics["workers"].values()) == len(SENTENCES)
+
+
+def test_crashed_worker_is_retried():
+    context = multiprocessing.get_context("spawn")
+    output = io.StringIO()
+
+    with Coordinator(unit_cost=30) as coordinator:
+        thread = run_coordinator(coordinator, output)
+
+        crashing = context.Process(target=start_worker,
+                                   args=(coordinator.address, "crash", True))
+        crashing.start()
+        crashing.join(60)
+        assert crashing.exitcode == 1
+
+        healthy = context.Process(target=start_worker,
+                                  args=(coordinator.address, "healthy"))
+        healthy.start()
+        healthy.join(60)
+        thread.join(60)
+
+    assert trees(output.getvalue()) == trees(expected_output())
+    assert coordinator.statistics["retries"] == 1
+    assert list(coordinator.statistics["workers"]) == ["healthy"]
+
+
+def test_crashed_units_are_given_up():
+    context = multiprocessing.get_context("spawn")
+    output = io.StringIO()
+
+    with Coordinator(unit_cost=30, max_retries=0) as coordinator:
+        thread = run_coordinator(coordinator, output)
+
+        crashing = context.Process(target=start_worker,
+                                   args=(coordinator.address, "crash", True))
+        crashing.start()
+        crashing.join(60)
+
+        healthy = context.Process(target=start_worker,
+                                  args=(coordinator.address, "healthy"))
+        healthy.start()
+        healthy.join(60)
+        thread.join(60)
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    first_unit = next(work_units(SENTENCES, unit_cost=30)).sentences
+    assert coordinator.statistics["failed_units"] == 1
+    assert [line["tree"] for line in lines[len(first_unit):]] == \
+        trees(expected_output())[len(first_unit):]
+    for line in lines[:len(first_unit)]:
+        assert line["tree"] is None
+        assert "error" in line["statistics"]
+
+
+def test_failed_sentences_are_written_without_a_parse():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    output = io.StringIO()
+
+    with Coordinator(unit_cost=30, max_retries=1) as coordinator:
+        thread = run_coordinator(coordinator, output)
+        run_worker(FlakyParser(pcfg, "sees Mary", 100), coordinator.address)
+        thread.join(60)
+    assert not coordinator.acceptor.is_alive()
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(lines) == len(SENTENCES)
+    assert coordinator.statistics["retries"] == 0
+    assert coordinator.statistics["failed_units"] == 0
+    for line, tree, sentence in zip(lines, trees(expected_output()),
+                                    SENTENCES):
+        if sentence == "sees Mary":
+            assert "Parser crashed" in line["statistics"]["error"]
+        else:
+            assert "error" not in line["statistics"]
+        assert line["tree"] == tree
+
+
+def test_close_stops_accepting():
+    coordinator = Coordinator()
+    # run() waits for workers that never come
+    threading.Thread(target=coordinator.run, args=(SENTENCES, io.StringIO()),
+                     daemon=True).start()
+    connect(coordinator.address).close()
+    while not coordinator.connections:
+        time.sleep(0.01)
+
+    coordinator.close()
+    assert not coordinator.acceptor.is_alive()
+    with pytest.raises(OSError):
+        socket.create_connection(coordinator.address, timeout=1).close()
+
+
+def test_worker_stops_when_the_coordinator_closes_the_connection():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    connections = []
+
+    def coordinator():
+        connection, _ = server.accept()
+        connections.append(connection)
+        with connection.makefile("r", encoding="utf-8") as reader:
+            receive_message(reader)
+            send_message(connection, {"type": "unit", "id": 0,
+                                      "sentences": SENTENCES[:1],
+                                      "format": "jsonl"})
+
+    class TimedOutParser(CKYParser):
+        def write_best(self, sentence, writer, log_dict=None, context=None):
+            # The coordinator gives up on the unit and resets the connection
+            thread.join(60)
+            connections[0].setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                      struct.pack("ii", 1, 0))
+            connections[0].close()
+            super().write_best(sentence, writer, log_dict, context)
+
+    thread = threading.Thread(target=coordinator)
+    thread.start()
+
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    with server:
+        assert run_worker(TimedOutParser(pcfg), server.getsockname()) == 0
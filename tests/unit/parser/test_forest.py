@@ -0,0 +1,65 @@
+import pytest
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.parser.forest import Forest, open_forests, read_forests, \
+    write_forest
+
+SENTENCE = "Peter sees a squirrel with the telescope"
+
+
+@pytest.fixture
+def create_forest(create_toy_pcfg):
+    def create():
+        pcfg = create_toy_pcfg()
+        parser = CKYParser(pcfg)
+        return parser, Forest.from_chart(parser.parse(SENTENCE), pcfg,
+                                         SENTENCE)
+
+    return create
+
+
+def test_kbest(create_forest):
+    parser, forest = create_forest()
+    forest = Forest.from_json(forest.to_json())
+
+    assert forest.words == SENTENCE.split()
+    assert forest.kbest(5) == parser.parse_kbest(SENTENCE, 5)
+    assert forest.viterbi()[1] == parser.parse_best(SENTENCE)
+    assert forest.probability == pytest.approx(
+        sum(probability for probability, _ in forest.kbest(5)))
+
+
+def test_marginals(create_forest):
+    _, forest = create_forest()
+    marginals = forest.marginals()
+    (best, _), (second, _) = forest.kbest(2)
+
+    assert marginals[("S", 0, 6)] == pytest.approx(1.0)
+    assert marginals[("PP", 4, 6)] == pytest.approx(1.0)
+    assert marginals[("NP", 2, 6)] == pytest.approx(
+        second / (best + second))
+    assert sum(forest.edge_marginals()) == pytest.approx(
+        len(SENTENCE.split()) + len(SENTENCE.split()) - 1)
+
+
+def test_read_write(tmpdir, create_forest):
+    _, forest = create_forest()
+    path = str(tmpdir.join("forests.jsonl.gz"))
+
+    with open_forests(path, "w") as f:
+        write_forest(f, forest)
+        write_forest(f, None)
+
+    forests = list(read_forests(path))
+    assert forests[1] is None
+    assert forests[0].kbest(2) == forest.kbest(2)
+
+
+def test_coarse_to_fine_forest(tmpdir, create_toy_pcfg, toy_mapping):
+    pcfg = create_toy_pcfg()
+    parser = CoarseToFineParser(pcfg, CtfMapper(toy_mapping),
+                                prefix=str(tmpdir.join("grammar")))
+
+    forest = parser.parse_forest(SENTENCE)
+    assert forest.viterbi()[1] == CKYParser(pcfg).parse_best(SENTENCE)
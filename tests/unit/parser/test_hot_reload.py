@@ -0,0 +1,128 @@
+import threading
+
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.parser.hot_reload import HotReloadParser, parser_fingerprint
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "NP", "Mary", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["WORDS", ["Mary", "Peter", "sees"]]
+]
+
+# Only the probabilities of the names differ
+NEW_GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.25],
+    ["Q1", "NP", "Mary", 0.75]
+] + GRAMMAR[2:]
+
+# Has no rule for 'sees'
+BROKEN_GRAMMAR = GRAMMAR[:2] + GRAMMAR[3:]
+
+MAPPING = {
+    "P": {
+        "HP": ["S_", "N_"]
+    },
+    "S_": {
+        "S": ["S", "VP"]
+    },
+    "N_": {
+        "NP": ["NP", "V"]
+    }
+}
+
+SENTENCE = "Peter sees Mary"
+
+
+def create_pcfg(grammar):
+    pcfg = PCFG()
+    pcfg.load_model(grammar)
+    return pcfg
+
+
+def test_reload():
+    grammars = [GRAMMAR, NEW_GRAMMAR]
+
+    def load():
+        return CoarseToFineParser(create_pcfg(grammars[0]),
+                                  CtfMapper(MAPPING), threshold=0.0)
+
+    parser = HotReloadParser(load, validation_sentences=[SENTENCE])
+    first = parser.fingerprint
+    assert first == parser_fingerprint(load())
+
+    statistics = {}
+    tree = parser.parse_best(SENTENCE, statistics)
+    assert statistics["grammar_fingerprint"] == first
+    assert statistics["grammar_version"] == 0
+    assert "reload_time" in statistics
+
+    grammars.pop(0)
+    assert parser.reload()
+    assert parser.fingerprint != first
+    assert parser.reloads == 1
+
+    statistics = {}
+    assert parser.parse_best(SENTENCE, statistics) == tree
+    assert statistics["grammar_fingerprint"] == parser.fingerprint
+    assert statistics["grammar_version"] == 1
+
+    # Delegated to the active parser
+    assert parser.parse(SENTENCE)[0][-1]
+
+
+def test_failed_reload_keeps_version():
+    grammars = [GRAMMAR, BROKEN_GRAMMAR]
+
+    parser = HotReloadParser(lambda: CKYParser(create_pcfg(grammars[0])),
+                             validation_sentences=[SENTENCE])
+    fingerprint = parser.fingerprint
+
+    grammars.pop(0)
+    assert not parser.reload()
+    assert isinstance(parser.reload_error, ValueError)
+    assert parser.fingerprint == fingerprint
+    assert parser.reloads == 0
+    assert parser.parse_best(SENTENCE)
+
+
+def test_in_flight_parses_keep_their_version():
+    grammars = [GRAMMAR, NEW_GRAMMAR]
+    started = threading.Event()
+    resume = threading.Event()
+
+    class SlowParser(CKYParser):
+        def parse_best(self, sentence, log_dict=None, context=None):
+            started.set()
+            resume.wait(5)
+            return super().parse_best(sentence, log_dict, context)
+
+    parser = HotReloadParser(lambda: SlowParser(create_pcfg(grammars[0])))
+    old = parser.parser
+
+    statistics = {}
+    thread = threading.Thread(target=parser.parse_best,
+                              args=(SENTENCE, statistics))
+    thread.start()
+    started.wait(5)
+
+    grammars.pop(0)
+    reload = threading.Thread(target=parser.reload)
+    reload.start()
+
+    # The new version is active, but the reload waits for the old parse
+    reload.join(0.2)
+    assert reload.is_alive()
+    assert parser.parser is not old
+    assert parser.version.number == 1
+
+    resume.set()
+    thread.join(5)
+    reload.join(5)
+    assert not reload.is_alive()
+    assert statistics["grammar_version"] == 0
@@ -0,0 +1,70 @@
+import pytest
+
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.inside_outside_calculator import \
+    InsideOutsideCalculator, SparseInsideOutsideCalculator, \
+    ViterbiInsideOutsideCalculator
+
+SENTENCE = "Peter sees a squirrel with the telescope"
+
+
+def test_sparse_equals_exact(create_toy_pcfg):
+    pcfg = create_toy_pcfg()
+    chart = CKYParser(pcfg).parse(SENTENCE)
+
+    exact = InsideOutsideCalculator(chart, pcfg)
+    sparse = SparseInsideOutsideCalculator(chart, pcfg)
+
+    # Both PP attachments
+    assert sparse.inside(pcfg.start_symbol, 0, 6) == \
+        pytest.approx(0.3 * 0.6 * 0.5 * 0.25 * 0.5 * 0.25 * (0.4 + 0.2))
+
+    for i, row in enumerate(chart):
+        for j, cell in enumerate(row):
+            for symbol in cell:
+                assert sparse.inside(symbol, i, j) == \
+                    pytest.approx(exact.inside(symbol, i, j))
+                assert sparse.outside(symbol, i, j) == \
+                    pytest.approx(exact.outside(symbol, i, j))
+
+
+def test_sparse_uses_chart_only(create_toy_pcfg):
+    pcfg = create_toy_pcfg()
+    chart = CKYParser(pcfg).parse(SENTENCE)
+
+    # Remove the attachment of the PP to the noun phrase
+    del chart[2][6][pcfg.get_id_for_word("NP")]
+    sparse = SparseInsideOutsideCalculator(chart, pcfg)
+
+    assert sparse.inside(pcfg.get_id_for_word("NP"), 2, 6) == 0.0
+    assert sparse.inside(pcfg.start_symbol, 0, 6) == \
+        pytest.approx(0.3 * 0.6 * 0.5 * 0.25 * 0.5 * 0.25 * 0.4)
+
+
+def test_viterbi_scores(create_toy_pcfg):
+    pcfg = create_toy_pcfg()
+    chart = CKYParser(pcfg).parse(SENTENCE)
+    symbol = pcfg.get_id_for_word
+
+    viterbi = ViterbiInsideOutsideCalculator(chart, pcfg)
+
+    # The best parse attaches the PP to the verb phrase
+    best = 0.3 * 0.6 * 0.5 * 0.25 * 0.5 * 0.25 * 0.4
+    assert viterbi.inside(pcfg.start_symbol, 0, 6) == pytest.approx(best)
+    assert viterbi.outside(pcfg.start_symbol, 0, 6) == 1.0
+
+    def posterior(name, start, end):
+        return viterbi.inside(symbol(name), start, end) * \
+            viterbi.outside(symbol(name), start, end) / best
+
+    assert posterior("VP", 1, 6) == pytest.approx(1.0)
+    assert posterior("PP", 4, 6) == pytest.approx(1.0)
+    assert posterior("NP", 2, 6) == pytest.approx(0.2 / 0.4)
+    assert posterior("Det", 2, 2) == pytest.approx(1.0)
+
+    # The best parse through any item is never better than the best parse
+    for i, row in enumerate(chart):
+        for j, cell in enumerate(row):
+            for item in cell:
+                assert posterior(pcfg.get_word_for_id(item), i, j) <= \
+                    1.0 + 1e-9
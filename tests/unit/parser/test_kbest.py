@@ -0,0 +1,37 @@
+import sys
+
+import pytest
+from ctf_parser.parser.kbest import KBestExtractor
+
+LENGTH = 1500
+
+
+def chain(node):
+    """
+    A chain of unary edges over LENGTH nodes, with two leaves at the bottom.
+    """
+    if node == 0:
+        return [(1.0, (), "a"), (0.5, (), "b")]
+    return [(0.9, (node - 1,), "x"), (0.1, (node - 1,), "y")]
+
+
+def test_deep_chain():
+    assert LENGTH > sys.getrecursionlimit()
+
+    extractor = KBestExtractor(chain)
+    derivations = extractor.kbest(LENGTH - 1, 3)
+
+    best = 0.9 ** (LENGTH - 1)
+    assert [score for score, _, _ in derivations] == \
+        pytest.approx([best, best / 2, best / 9])
+
+    tree = extractor.tree(LENGTH - 1, derivations[1], str)
+    depth = 0
+    while len(tree) == 2 and isinstance(tree[1], list):
+        assert tree[0] == str(LENGTH - 1 - depth)
+        tree = tree[1]
+        depth += 1
+    assert depth == LENGTH - 1
+    assert tree == ["0", "b"]
+
+    assert extractor.kth_best(0, 2) is None
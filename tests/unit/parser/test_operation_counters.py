@@ -0,0 +1,107 @@
+from ctf_parser.parser.chart_pool import ChartPool
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.parser.inside_outside_calculator import \
+    InsideOutsideCalculator
+
+"""
+The operation counters of the parsers do not depend on the speed of the
+machine, so they can be compared against fixed upper bounds. A change that
+makes one of these tests fail makes the parser do more work; if that is
+intended, the bounds have to be raised.
+"""
+
+SENTENCES = ["Peter sees a squirrel with the telescope",
+             "Peter sees the squirrel with a telescope with the telescope"]
+
+CKY_BOUNDS = [
+    {"cells_visited": 28, "split_points": 56, "intersections": 32,
+     "candidates_generated": 9, "items_entered": 9},
+    {"cells_visited": 55, "split_points": 165, "intersections": 68,
+     "candidates_generated": 18, "items_entered": 18}
+]
+
+CTF_BOUNDS = {
+    "exact": [
+        {"intersections": 134, "candidates_generated": 33,
+         "io_inside_calls": 1927, "io_outside_calls": 352},
+        {"intersections": 289, "candidates_generated": 64,
+         "io_inside_calls": 6154, "io_outside_calls": 1417}
+    ],
+    "sparse": [
+        {"intersections": 134, "candidates_generated": 33,
+         "io_intersections": 60, "io_edges": 30},
+        {"intersections": 289, "candidates_generated": 64,
+         "io_intersections": 136, "io_edges": 67}
+    ],
+    "viterbi": [
+        {"intersections": 134, "candidates_generated": 33,
+         "io_intersections": 60, "io_edges": 30},
+        {"intersections": 289, "candidates_generated": 64,
+         "io_intersections": 136, "io_edges": 67}
+    ]
+}
+
+
+def assert_bounds(statistics, bounds):
+    for key, bound in bounds.items():
+        assert statistics[key] <= bound, \
+            f"{key}: {statistics[key]} > {bound}"
+
+
+def test_cky_counters(create_toy_pcfg):
+    parser = CKYParser(create_toy_pcfg())
+
+    for sentence, bounds in zip(SENTENCES, CKY_BOUNDS):
+        statistics = {}
+        parser.parse(sentence, statistics)
+        assert_bounds(statistics, bounds)
+
+        # Every cell of the chart is visited once
+        length = statistics['length']
+        assert statistics['cells_visited'] == length * (length + 1) // 2
+
+
+def test_inside_outside_counters(create_toy_pcfg):
+    pcfg = create_toy_pcfg()
+    chart = CKYParser(pcfg).parse(SENTENCES[0])
+    calculator = InsideOutsideCalculator(chart, pcfg)
+
+    calculator.inside(pcfg.start_symbol, 0, len(chart) - 1)
+    counters = calculator.counters()
+    assert counters['inside_calls'] > counters['inside_cache_hits'] > 0
+    assert counters['outside_calls'] == 0
+
+    # A second call is a single cache hit
+    calculator.inside(pcfg.start_symbol, 0, len(chart) - 1)
+    assert calculator.counters()['inside_calls'] == \
+        counters['inside_calls'] + 1
+    assert calculator.counters()['inside_cache_hits'] == \
+        counters['inside_cache_hits'] + 1
+
+
+def test_ctf_counters(create_toy_pcfg, toy_mapping):
+    for mode, all_bounds in CTF_BOUNDS.items():
+        parser = CoarseToFineParser(create_toy_pcfg(), CtfMapper(toy_mapping),
+                                    inside_outside=mode)
+
+        for sentence, bounds in zip(SENTENCES, all_bounds):
+            statistics = {}
+            parser.parse(sentence, statistics)
+            assert_bounds(statistics, bounds)
+
+
+def test_counters_are_deterministic(create_toy_pcfg, toy_mapping):
+    def counters(**kwargs):
+        parser = CoarseToFineParser(create_toy_pcfg(), CtfMapper(toy_mapping),
+                                    **kwargs)
+        statistics = {}
+        parser.parse(SENTENCES[1], statistics)
+        return {key: value for key, value in statistics.items()
+                if isinstance(value, int) and key != 'timestamp'}
+
+    expected = counters()
+    assert expected['io_inside_calls'] > 0
+    assert counters() == expected
+    assert counters(chart_pool=ChartPool()) == expected
@@ -0,0 +1,183 @@
+import argparse
+import io
+import json
+
+import pytest
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.parser.segmenter import SegmentingParser, \
+    chart_split_scores, segment
+from ctf_parser.parser.tree_writer import TreeWriter
+from ctf_parser.scripts.parser import add_segment_arguments
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "NP", "Mary", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "CC", "and", 1.0],
+    ["Q1", ",", ",", 1.0],
+    ["Q2", "S", "NP", "VP", 0.8],
+    ["Q2", "S", "S", ",", 0.2],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["WORDS", [",", "Mary", "Peter", "and", "sees"]]
+]
+
+MAPPING = {
+    "P": {
+        "HP": ["S_", "N_"]
+    },
+    "S_": {
+        "S": ["S", "VP"]
+    },
+    "N_": {
+        "NP": ["NP", "V", "CC", ","]
+    }
+}
+
+SENTENCE = "Peter sees Mary , Mary sees Peter"
+
+PETER_SEES_MARY = ['S', ['NP', 'Peter'], ['VP', ['V', 'sees'],
+                                          ['NP', 'Mary']]]
+MARY_SEES_PETER = ['S', ['NP', 'Mary'], ['VP', ['V', 'sees'],
+                                         ['NP', 'Peter']]]
+
+
+def create_pcfg():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    return pcfg
+
+
+def test_segment():
+    words = "a b , c d e and f g h i j k".split()
+
+    # As late as possible: after the comma and before 'and'
+    assert segment(words, 5) == [(0, 3), (3, 6), (6, 11), (11, 13)]
+    assert segment(words, 13) == [(0, 13)]
+
+    # Without boundaries, the words are cut at the limit
+    assert segment(list("abcdefg"), 3) == [(0, 3), (3, 6), (6, 7)]
+
+
+def test_segment_with_scores():
+    words = "a b , c d e and f g h i j k".split()
+
+    def score_splits(scores):
+        return lambda start, stop: {i: scores.get(i, 1.0)
+                                    for i in range(start + 1, stop)}
+
+    # The best scored boundary in the second half of the window
+    assert segment(words, 5, score_splits=score_splits({3: 2.0}))[0] == \
+        (0, 3)
+    assert segment(words, 5, score_splits=score_splits({2: 2.0}))[0] == \
+        (0, 3)
+    # Otherwise the best scored position
+    assert segment(words, 5, score_splits=score_splits({11: 2.0}))[2] == \
+        (6, 11)
+    assert segment(words, 5, score_splits=score_splits({}))[2] == (6, 11)
+    assert segment(words, 5, score_splits=score_splits({9: 2.0}))[2] == \
+        (6, 9)
+    # Without scores, at the punctuation and conjunctions
+    assert segment(words, 5, score_splits=lambda start, stop: {}) == \
+        segment(words, 5)
+
+
+def test_max_length_must_be_positive():
+    with pytest.raises(ValueError):
+        segment(["a", "b", "c", "d"], 0)
+    with pytest.raises(ValueError):
+        SegmentingParser(CKYParser(create_pcfg()), max_length=-1)
+
+    arguments = argparse.ArgumentParser()
+    add_segment_arguments(arguments)
+    assert arguments.parse_args(["--max_length", "1"]).max_length == 1
+    with pytest.raises(SystemExit):
+        arguments.parse_args(["--max_length", "0"])
+
+
+def test_short_input_is_not_segmented():
+    parser = SegmentingParser(CKYParser(create_pcfg()), max_length=10)
+
+    statistics = {}
+    assert parser.parse_best("Peter sees Mary", statistics) == \
+        PETER_SEES_MARY
+    assert "segmented" not in statistics
+    assert parser.parse("Peter sees Mary")[0][2]
+
+
+def test_segmented_parse():
+    statistics = {}
+    with SegmentingParser(CKYParser(create_pcfg()), max_length=4,
+                          root="ROOT") as parser:
+        tree = parser.parse_best(SENTENCE, statistics)
+
+    # The comma ends the first segment
+    assert tree == ["ROOT", ["S", PETER_SEES_MARY, [",", ","]],
+                    MARY_SEES_PETER]
+    assert statistics["segmented"]
+    assert statistics["segments"] == [4, 3]
+    assert statistics["unparsed_segments"] == 0
+
+    # A segment without a parse keeps its words
+    with SegmentingParser(CKYParser(create_pcfg()), max_length=4) as parser:
+        tree = parser.parse_best("sees Peter Mary , Mary sees Peter",
+                                 statistics)
+    assert tree == ["S-SEGMENTED", ["FRAG", "sees", "Peter", "Mary", ","],
+                    MARY_SEES_PETER]
+    assert statistics["unparsed_segments"] == 1
+
+    # The conjunction starts a new segment
+    with SegmentingParser(CKYParser(create_pcfg()), max_length=4) as parser:
+        tree = parser.parse_best("Peter sees Mary and Mary sees Peter")
+    assert tree[0] == "S-SEGMENTED"
+    assert tree[1] == PETER_SEES_MARY
+
+
+def test_segments_scored_by_the_coarse_chart():
+    pcfg = create_pcfg()
+    ctf = CoarseToFineParser(pcfg, CtfMapper(MAPPING), threshold=0.0)
+    sentence = "Peter sees Mary Mary sees Peter Peter sees Mary"
+    words = sentence.split()
+
+    coarse_parser = ctf.parsers[0]
+    chart = coarse_parser.parse_words(words[:5])
+    scores = chart_split_scores(chart, coarse_parser.pcfg.start_symbol)
+    # "Peter" is not a sentence, "Peter sees Mary Mary" is a worse one
+    assert sorted(scores) == [2, 3, 4]
+    assert scores[3] > scores[4]
+
+    # Without punctuation, the segments end where the coarse grammar has a
+    # complete sentence
+    assert segment(words, 4) == [(0, 4), (4, 8), (8, 9)]
+    statistics = {}
+    with SegmentingParser(ctf, max_length=4) as parser:
+        tree = parser.parse_best(sentence, statistics)
+    assert statistics["segments"] == [3, 3, 3]
+    assert statistics["unparsed_segments"] == 0
+    assert tree == ["S-SEGMENTED", PETER_SEES_MARY, MARY_SEES_PETER,
+                    PETER_SEES_MARY]
+
+
+def test_segments_in_threads():
+    pcfg = create_pcfg()
+    ctf = CoarseToFineParser(pcfg, CtfMapper(MAPPING), threshold=0.0)
+    sentence = "Peter sees Mary , Mary sees Peter ,"
+
+    with SegmentingParser(ctf, max_length=4) as parser:
+        expected = parser.parse_best(sentence)
+    with SegmentingParser(ctf, max_length=4, max_workers=3) as parser:
+        assert parser.parse_best(sentence) == expected
+
+        stream = io.StringIO()
+        with TreeWriter(stream, "jsonl") as writer:
+            parser.write_best(sentence, writer, {"sentence": sentence})
+
+    line = json.loads(stream.getvalue())
+    assert line["tree"] == ["S-SEGMENTED",
+                            ["S", PETER_SEES_MARY, [",", ","]],
+                            ["S", MARY_SEES_PETER, [",", ","]]]
+    assert line["segmented"]
+    assert line["statistics"]["segmented"]
+    assert line["statistics"]["segments"] == [4, 4]
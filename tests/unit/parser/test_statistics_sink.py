@@ -0,0 +1,123 @@
+import logging
+import os
+
+import numpy as np
+import pytest
+import yaml
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser import coarse_to_fine_parser
+from ctf_parser.parser.coarse_to_fine_parser import CoarseToFineParser
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.parser.statistics_sink import StatisticsSink, \
+    load_statistics, numeric_values
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "NP", "Mary", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["WORDS", ["Mary", "Peter", "sees"]]
+]
+
+MAPPING = """
+P:
+  HP:
+    S_:
+      - S
+      - VP
+    N_:
+      - NP
+      - V
+"""
+
+
+def test_numeric_values():
+    statistics = {"time": 0.5, "length": 3, "input": "Peter sees Mary",
+                  "level_times": [0.1, 0.2], "effectiveness": [None, 2.0]}
+
+    assert numeric_values(statistics) == {
+        "time": 0.5, "length": 3, "level_times_0": 0.1,
+        "level_times_1": 0.2, "effectiveness_1": 2.0}
+    assert numeric_values(statistics, ["length", "missing"]) == {"length": 3}
+
+
+def test_csv_chunks(tmpdir):
+    path = str(tmpdir.join("statistics"))
+    with StatisticsSink(path, batch_size=2, output_format="csv") as sink:
+        for i in range(5):
+            statistics = {"length": i, "time": i / 10, "input": "x"}
+            if i == 3:
+                statistics["fallback_steps"] = 1
+            sink.add(statistics)
+
+        # Only full batches are written before the sink is closed
+        assert sorted(os.listdir(path)) == ["statistics-00000.csv",
+                                            "statistics-00001.csv"]
+
+    assert sorted(os.listdir(path))[-1] == "statistics-00002.csv"
+    assert sink.rows == 5
+
+    statistics = load_statistics(path)
+    assert statistics["length"].tolist() == [0, 1, 2, 3, 4]
+    assert np.allclose(statistics["time"], [0.0, 0.1, 0.2, 0.3, 0.4])
+    assert np.isnan(statistics["fallback_steps"]).tolist() == \
+        [True, True, True, False, True]
+
+    # A second run adds further chunks
+    with StatisticsSink(path, output_format="csv") as sink:
+        sink.add({"length": 5})
+    assert load_statistics(path)["length"].tolist() == [0, 1, 2, 3, 4, 5]
+
+
+def test_parquet_chunks(tmpdir):
+    pytest.importorskip("pyarrow")
+
+    path = str(tmpdir.join("statistics"))
+    with StatisticsSink(path, output_format="parquet") as sink:
+        sink.add({"length": 3, "level_times": [0.1, 0.2]})
+
+    assert os.listdir(path) == ["statistics-00000.parquet"]
+    assert load_statistics(path)["level_times_1"].tolist() == [0.2]
+
+
+def test_phase_timings(tmpdir):
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    parser = CoarseToFineParser(pcfg, CtfMapper(yaml.load(MAPPING)))
+
+    path = str(tmpdir.join("statistics"))
+    with StatisticsSink(path, output_format="csv") as sink:
+        for sentence in ["Peter sees Mary", "Mary sees Peter"]:
+            statistics = {}
+            parser.parse_best(sentence, statistics)
+            sink.add(statistics)
+
+    for key in ("tokenize_time", "chart_time", "inside_outside_time",
+                "backtrace_time"):
+        assert statistics[key] >= 0.0
+    assert len(statistics["level_times"]) == len(parser.grammars)
+    assert statistics["chart_time"] + statistics["inside_outside_time"] <= \
+        statistics["time"]
+
+    columns = load_statistics(path)
+    assert columns["length"].tolist() == [3, 3]
+    assert columns["items_entered"].tolist() == \
+        [statistics["items_entered"]] * 2
+    assert "level_times_2" in columns
+
+
+def test_statistics_are_not_serialized_without_info_logging(monkeypatch,
+                                                            caplog):
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    parser = CoarseToFineParser(pcfg, CtfMapper(yaml.load(MAPPING)))
+
+    def dumps(*args, **kwargs):
+        raise AssertionError("Statistics were serialized")
+
+    caplog.set_level(logging.WARNING, logger="CtF Parser")
+    monkeypatch.setattr(coarse_to_fine_parser.json, "dumps", dumps)
+    statistics = {}
+    parser.parse_best("Peter sees Mary", statistics)
+    assert statistics["items_entered"] > 0
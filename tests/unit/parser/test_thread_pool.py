@@ -0,0 +1,54 @@
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser, NoParseFoundException
+from ctf_parser.parser.thread_pool import ThreadPoolParser
+
+GRAMMAR = [
+    ["Q1", "NP", "Peter", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "Det", "a", 1.0],
+    ["Q1", "N", "squirrel", 1.0],
+    ["Q2", "S", "NP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 1.0],
+    ["Q2", "NP", "Det", "N", 0.5],
+    ["WORDS", ["Peter", "a", "sees", "squirrel"]]
+]
+
+
+def test_parse_batch():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    parser = CKYParser(pcfg)
+
+    sentences = ["Peter sees a squirrel", "a squirrel sees Peter",
+                 "sees Peter"] * 10
+
+    with ThreadPoolParser(parser, max_workers=4) as pool:
+        trees = pool.parse_batch(sentences)
+        streamed = list(pool.parse_stream(iter(sentences), batch_size=7))
+
+    assert trees == [parser.parse_best(s) if i % 3 != 2 else None
+                     for i, s in enumerate(sentences)]
+    assert streamed == trees
+
+
+def test_parse_stream_with_statistics():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    parser = CKYParser(pcfg)
+
+    def parse(sentence):
+        log = {"sentence": sentence}
+        try:
+            return parser.parse_best(sentence, log), log
+        except NoParseFoundException:
+            return None, log
+
+    sentences = ["Peter sees a squirrel", "sees Peter"] * 10
+
+    with ThreadPoolParser(parser, max_workers=4) as pool:
+        results = list(pool.parse_stream(sentences, batch_size=3,
+                                         parse=parse))
+
+    assert [log["sentence"] for _, log in results] == sentences
+    assert [tree is None for tree, _ in results] == [False, True] * 10
+    assert all("time" in log for _, log in results)
@@ -0,0 +1,60 @@
+import random
+
+from ctf_parser.parser.tokenizer import FastPennTreebankTokenizer, \
+    PennTreebankTokenizer
+
+SENTENCES = [
+    "Good muffins cost $3.88\nin New York.  Please buy me\ntwo of them.\n"
+    "Thanks.",
+    "They'll save and invest more.",
+    "\"I cannot,\" she said, \"and I won't (at least not today)...\"",
+    "AT&T bought 1,000 shares -- or so they say -- for #5.",
+    "'Tis the 1990's, gonna be fine ; wanna come? Yes!",
+    "\t\"quoted\" <tag> [x] {y} 'single' ",
+    "rock &",
+    "number #",
+    "",
+    "a,,b ,:,:x 1,000 a.... a..",
+    "x x'll's 1'S'% wanna's cannot'tis 'TIS'TIS d'ye",
+    "Take the 'cannot.'\t",
+]
+
+PIECES = list("ab1.,:;'\"`&#$%?!()[]{}<>- \t\n") + [
+    "'s", "n't", "can", "not", "'ll", "wan", "na", "'t", "is", "``", "''",
+    "...", "--", "AT&T", "'S", "'TIS", "was", "d'ye", "N'T"]
+
+
+def test_conformance():
+    original = PennTreebankTokenizer()
+    tokenizer = FastPennTreebankTokenizer()
+
+    for sentence in SENTENCES:
+        assert tokenizer.tokenize(sentence) == original.tokenize(sentence)
+
+
+def test_conformance_random():
+    original = PennTreebankTokenizer()
+    tokenizer = FastPennTreebankTokenizer(cache_size=16)
+    generator = random.Random(0)
+
+    for _ in range(5000):
+        text = "".join(generator.choice(PIECES)
+                       for _ in range(generator.randint(0, 12)))
+        assert tokenizer.tokenize(text) == original.tokenize(text)
+
+
+def test_trailing_ampersand_and_hash():
+    for tokenizer in [PennTreebankTokenizer(), FastPennTreebankTokenizer()]:
+        assert tokenizer.tokenize("rock &") == ["rock", "&"]
+        assert tokenizer.tokenize("number #") == ["number", "#"]
+        assert tokenizer.tokenize("& more") == ["&", "more"]
+
+
+def test_tokenize_many():
+    tokenizer = FastPennTreebankTokenizer()
+    lines = iter(["This is a test.", "AT&T isn't."])
+
+    assert list(tokenizer.tokenize_many(lines)) == [
+        ["This", "is", "a", "test", "."], ["AT&T", "is", "n't", "."]]
+    assert list(tokenizer.iter_tokenize("a (b)")) == [
+        "a", ("-LRB-", "("), "b", ("-RRB-", ")")]
@@ -0,0 +1,85 @@
+import io
+import json
+
+from ctf_parser.grammar.pcfg import PCFG
+from ctf_parser.parser.cky_parser import CKYParser
+from ctf_parser.parser.tree_writer import TreeWriter, build_tree, \
+    debinarize, tree_events
+
+GRAMMAR = [
+    ["Q1", "NP‡NNP", "Peter", 0.5],
+    ["Q1", "V", "sees", 1.0],
+    ["Q1", "V", "gives", 1.0],
+    ["Q1", "Det", "a", 1.0],
+    ["Q1", "N", "squirrel", 0.5],
+    ["Q1", "N", "nut", 0.5],
+    ["Q1", "NP‡NNP", "Mary", 0.5],
+    ["Q2", "S", "NP‡NNP", "VP", 1.0],
+    ["Q2", "VP", "V", "NP", 0.5],
+    ["Q2", "VP", "VP†V†NP", "NP", 0.5],
+    ["Q2", "VP†V†NP", "V", "NP‡NNP", 1.0],
+    ["Q2", "NP", "Det", "N", 1.0],
+    ["WORDS", ["Peter", "Mary", "a", "gives", "nut", "sees", "squirrel"]]
+]
+
+SENTENCE = "Peter gives Mary a nut"
+
+
+def create_parser():
+    pcfg = PCFG()
+    pcfg.load_model(GRAMMAR)
+    return CKYParser(pcfg)
+
+
+def write(output_format, statistics=None):
+    stream = io.StringIO()
+    with TreeWriter(stream, output_format) as writer:
+        create_parser().write_best(SENTENCE, writer, statistics)
+    return stream.getvalue()
+
+
+def test_list_format():
+    parser = create_parser()
+
+    assert write("list") == str(parser.parse_best(SENTENCE)) + "\n"
+
+
+def test_ptb_format():
+    assert write("ptb") == "(S (NP (NNP Peter)) (VP (V gives) " \
+                           "(NP (NNP Mary)) (NP (Det a) (N nut))))\n"
+
+
+def test_json_formats():
+    tree = ["S", ["NP", ["NNP", "Peter"]],
+            ["VP", ["V", "gives"], ["NP", ["NNP", "Mary"]],
+             ["NP", ["Det", "a"], ["N", "nut"]]]]
+    assert json.loads(write("json")) == tree
+
+    line = json.loads(write("jsonl", {"sentence": SENTENCE}))
+    assert line["tree"] == tree
+    assert line["statistics"]["sentence"] == SENTENCE
+    assert line["statistics"]["items_entered"] > 0
+
+
+def test_no_parse():
+    stream = io.StringIO()
+    with TreeWriter(stream, "ptb") as writer:
+        create_parser().write_best("nut Peter", writer)
+        writer.write_tree(None)
+
+    assert stream.getvalue() == "()\n()\n"
+
+
+def test_deep_tree():
+    # Deeper than the recursion limit
+    tree = ["X", "word"]
+    for _ in range(5000):
+        tree = ["X†Y", tree]
+    tree = ["S", tree]
+
+    assert build_tree(debinarize(tree_events(tree))) == ["S", ["X", "word"]]
+
+    stream = io.StringIO()
+    with TreeWriter(stream, "ptb") as writer:
+        writer.write_tree(tree)
+    assert stream.getvalue() == "(S (X word))\n"
@@ -0,0 +1,65 @@
+import pytest
+from ctf_parser.parser.ctf_mapper import CtfMapper
+from ctf_parser.scripts.profiler import grammar_profile, profile_sample
+
+# X is never part of a parse and is pruned in the finest level
+X_RULE = ["Q2", "X", "Det", "N", 0.02]
+
+SENTENCES = ["Peter sees a squirrel with the telescope",
+             "Peter sees the telescope"]
+
+
+@pytest.fixture
+def create_pcfg(create_toy_pcfg, toy_grammar):
+    grammar = toy_grammar[:-1] + [X_RULE] + toy_grammar[-1:]
+    return lambda: create_toy_pcfg(grammar)
+
+
+@pytest.fixture
+def mapping(toy_mapping):
+    toy_mapping["P"]["HP"]["X_"] = ["X"]
+    return toy_mapping
+
+
+def test_grammar_profile(create_pcfg):
+    profile = grammar_profile(create_pcfg(), top=2)
+
+    assert profile["binary_rules"] == 7
+    assert profile["first_rhs_symbols"] == 5
+
+    # Det has the longest rule list, NP is the second child of V and IN
+    assert [entry["symbol"] for entry in profile["fan_out"]] == \
+        ["Det", "NP"]
+    assert profile["fan_out"][0] == {"symbol": "Det", "rhs1_fan_out": 1,
+                                     "rhs2_fan_in": 0, "lhs_rules": 0,
+                                     "rhs1_rules": 2}
+    assert profile["fan_out"][1]["rhs2_fan_in"] == 2
+
+    lists = profile["id_to_lhs"]
+    assert lists["binary_lists"] == 6
+    assert lists["max"] == 2
+    assert lists["histogram"] == {"1": 5, "2": 1}
+    assert lists["largest"][0] == {"rhs": "Det N", "rules": 2}
+
+
+def test_profile_sample(create_pcfg, mapping):
+    for mode in ("exact", "sparse", "viterbi"):
+        report = profile_sample(create_pcfg(), CtfMapper(mapping),
+                                SENTENCES, top=3, threshold=0.0001,
+                                inside_outside=mode)
+
+        assert report["no_parse"] == 0
+        assert len(report["grammars"]) == len(report["levels"]) == 4
+
+        fine = report["levels"][-1]
+        assert fine["pruned"] == [{"symbol": "X", "items": 3}]
+        assert fine["items_pruned"] == 3
+        assert fine["produced"][0] == {"symbol": "NP", "items": 6}
+        # The finest level is not used for pruning
+        assert fine["inside_outside_rules"] == []
+
+        for level in report["levels"][:-1]:
+            rules = level["inside_outside_rules"]
+            assert level["rule_applications"] > 0
+            assert 0 < len(rules) <= 3
+            assert rules[0]["applications"] >= rules[-1]["applications"]
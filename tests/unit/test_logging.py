@@ -0,0 +1,26 @@
+import logging
+
+from ctf_parser import logger, setup_logging
+
+
+def test_setup_logging_replaces_its_handlers(tmp_path):
+    before = list(logger.handlers)
+    level = logger.level
+    try:
+        setup_logging(path=str(tmp_path / "first.log"))
+        setup_logging(enable_logs=False, path=str(tmp_path / "second.log"))
+
+        handlers = [handler for handler in logger.handlers
+                    if handler not in before]
+        assert len(handlers) == 2
+        assert handlers[0].baseFilename.endswith("second.log")
+        assert logger.level == logging.ERROR
+
+        logger.error("Only in the second log")
+        assert not (tmp_path / "first.log").exists()
+    finally:
+        logger.setLevel(level)
+        for handler in logger.handlers[:]:
+            if handler not in before:
+                logger.removeHandler(handler)
+                handler.close()